@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成压测用的合成数据：包含 N 个超链接的工作簿，以及带有可配置图片数量的
+PDF / DOCX / PPTX / XMind / XLSX / TXT 附件。图片内容随机生成，互不重复。
+"""
+import io
+import json
+import os
+import random
+import zipfile
+import zlib
+from typing import List
+
+from PIL import Image
+
+SUPPORTED_FORMATS = ("pdf", "docx", "pptx", "xmind", "xlsx", "txt")
+
+
+def random_image(width: int = 320, height: int = 240, seed: int = None) -> Image.Image:
+    """生成随机色块图片（先生成小图再放大，保证彼此的感知哈希差异足够大）。"""
+    rng = random.Random(seed)
+    small = Image.frombytes(
+        "RGB", (16, 12), bytes(rng.randrange(256) for _ in range(16 * 12 * 3))
+    )
+    return small.resize((width, height), Image.NEAREST)
+
+
+def random_png_bytes(seed: int = None) -> bytes:
+    buffer = io.BytesIO()
+    random_image(seed=seed).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def _paragraphs(doc_idx: int, count: int) -> List[str]:
+    return [f"文档 {doc_idx} 第 {i} 段：这是用于压测的示例文本内容。" for i in range(1, count + 1)]
+
+
+def make_txt(path: str, doc_idx: int, images: int = 0):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(_paragraphs(doc_idx, 20)))
+
+
+def make_pdf(path: str, doc_idx: int, images: int = 2):
+    """手工写出一个简单的PDF：每页一行文字，最多两张嵌入图片。"""
+    objects: List[bytes] = []
+
+    def add(obj: bytes) -> int:
+        objects.append(obj)
+        return len(objects)
+
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_count = max(1, (images + 1) // 2)
+    page_contents = []
+    remaining = images
+    for page_idx in range(page_count):
+        content = b"BT /F1 14 Tf 72 740 Td (Document %d page %d) Tj ET\n" % (
+            doc_idx,
+            page_idx + 1,
+        )
+        xobjects = []
+        for slot in range(min(2, remaining)):
+            img = random_image(160, 120, seed=doc_idx * 1000 + page_idx * 10 + slot)
+            data = zlib.compress(img.tobytes())
+            image_id = add(
+                b"<< /Type /XObject /Subtype /Image /Width 160 /Height 120 "
+                b"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode "
+                b"/Length %d >>\nstream\n" % len(data)
+                + data
+                + b"\nendstream"
+            )
+            xobjects.append((f"Im{slot}".encode(), image_id))
+            y = 450 - slot * 300
+            content += b"q 320 0 0 240 72 %d cm /Im%d Do Q\n" % (y, slot)
+            content += b"BT /F1 12 Tf 72 %d Td (Caption %d) Tj ET\n" % (y - 20, slot + 1)
+        remaining -= len(xobjects)
+        content_id = add(
+            b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream"
+        )
+        page_contents.append((content_id, xobjects))
+
+    pages_id = len(objects) + len(page_contents) + 1
+    kids = []
+    for content_id, xobjects in page_contents:
+        xobject_dict = b" ".join(b"/%s %d 0 R" % (name, obj) for name, obj in xobjects)
+        kids.append(
+            add(
+                b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+                b"/Contents %d 0 R /Resources << /Font << /F1 %d 0 R >> "
+                b"/XObject << %s >> >> >>" % (pages_id, content_id, font_id, xobject_dict)
+            )
+        )
+    add(
+        b"<< /Type /Pages /Kids [%s] /Count %d >>"
+        % (b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+    )
+    catalog_id = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + obj + b"\nendobj\n"
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        catalog_id,
+        xref_offset,
+    )
+    with open(path, "wb") as f:
+        f.write(bytes(output))
+
+
+_DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Default Extension="png" ContentType="image/png"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+
+_DOCX_ROOT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+_DOCX_PICTURE = (
+    '<w:p><w:r><w:drawing><wp:inline><wp:extent cx="3048000" cy="2286000"/>'
+    '<wp:docPr id="{n}" name="Picture {n}"/><a:graphic>'
+    '<a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic><pic:nvPicPr><pic:cNvPr id="{n}" name="image{n}.png"/><pic:cNvPicPr/></pic:nvPicPr>'
+    '<pic:blipFill><a:blip r:embed="rIdImg{n}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="3048000" cy="2286000"/></a:xfrm>'
+    '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></pic:spPr></pic:pic>'
+    "</a:graphicData></a:graphic></wp:inline></w:drawing></w:r></w:p>"
+)
+
+
+def make_docx(path: str, doc_idx: int, images: int = 2):
+    """手工写出最小的 DOCX 包：段落、一个表格和若干内联图片。"""
+    body = []
+    for i, text in enumerate(_paragraphs(doc_idx, max(images, 3)), 1):
+        body.append(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>")
+        if i == 1:
+            body.append(
+                "<w:tbl><w:tr><w:tc><w:p><w:r><w:t>指标</w:t></w:r></w:p></w:tc>"
+                "<w:tc><w:p><w:r><w:t>数值</w:t></w:r></w:p></w:tc></w:tr>"
+                "<w:tr><w:tc><w:p><w:r><w:t>链接数</w:t></w:r></w:p></w:tc>"
+                f"<w:tc><w:p><w:r><w:t>{doc_idx}</w:t></w:r></w:p></w:tc></w:tr></w:tbl>"
+            )
+        if i <= images:
+            body.append(_DOCX_PICTURE.format(n=i))
+
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+        'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+        'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+        'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+        f"<w:body>{''.join(body)}</w:body></w:document>"
+    )
+    rels = "".join(
+        f'<Relationship Id="rIdImg{n}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" '
+        f'Target="media/image{n}.png"/>'
+        for n in range(1, images + 1)
+    )
+    document_rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f"{rels}</Relationships>"
+    )
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _DOCX_CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _DOCX_ROOT_RELS)
+        zf.writestr("word/document.xml", document)
+        zf.writestr("word/_rels/document.xml.rels", document_rels)
+        for n in range(1, images + 1):
+            zf.writestr(f"word/media/image{n}.png", random_png_bytes(seed=doc_idx * 1000 + n))
+
+
+def make_pptx(path: str, doc_idx: int, images: int = 2):
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    prs = Presentation()
+    for i in range(max(images, 1)):
+        slide = prs.slides.add_slide(prs.slide_layouts[5])
+        slide.shapes.title.text = f"文档 {doc_idx} 幻灯片 {i + 1}"
+        if i < images:
+            stream = io.BytesIO(random_png_bytes(seed=doc_idx * 1000 + i))
+            slide.shapes.add_picture(stream, Inches(1), Inches(2), width=Inches(4))
+    prs.save(path)
+
+
+def make_xmind(path: str, doc_idx: int, images: int = 2):
+    children = []
+    for i in range(max(images, 3)):
+        topic = {"title": f"分支 {i + 1}", "note": f"文档 {doc_idx} 的备注"}
+        if i < images:
+            topic["image"] = {"src": f"xap:resources/{doc_idx:04d}{i:012d}.png"}
+        children.append(topic)
+    content = [
+        {
+            "title": f"画布 {doc_idx}",
+            "rootTopic": {"title": "中心主题", "children": {"attached": children}},
+        }
+    ]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("content.json", json.dumps(content, ensure_ascii=False))
+        zf.writestr("manifest.json", json.dumps({"file-entries": {}}))
+        for i in range(images):
+            zf.writestr(
+                f"resources/{doc_idx:04d}{i:012d}.png",
+                random_png_bytes(seed=doc_idx * 1000 + i),
+            )
+
+
+def make_xlsx(path: str, doc_idx: int, images: int = 2, rows: int = 200):
+    import openpyxl
+    from openpyxl.drawing.image import Image as XLImage
+
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["编号", "名称", "数量", "备注"])
+    for row in range(1, rows + 1):
+        sheet.append([row, f"条目{row}", row * doc_idx, "示例数据"])
+    for i in range(images):
+        picture = XLImage(io.BytesIO(random_png_bytes(seed=doc_idx * 1000 + i)))
+        sheet.add_image(picture, f"F{2 + i * 15}")
+    workbook.save(path)
+
+
+FIXTURE_BUILDERS = {
+    "pdf": make_pdf,
+    "docx": make_docx,
+    "pptx": make_pptx,
+    "xmind": make_xmind,
+    "xlsx": make_xlsx,
+    "txt": make_txt,
+}
+
+
+def make_workbook(
+    directory: str,
+    links: int = 20,
+    images_per_doc: int = 2,
+    formats=SUPPORTED_FORMATS,
+    workbook_name: str = "benchmark.xlsx",
+) -> str:
+    """
+    在 directory 中生成 links 个附件和一个链接到它们的工作簿，返回工作簿路径。
+    附件格式在 formats 之间轮换，链接使用相对路径（与真实台账一致）。
+    """
+    import openpyxl
+
+    attachments_dir = os.path.join(directory, "附件")
+    os.makedirs(attachments_dir, exist_ok=True)
+
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["编号", "任务", "附件", "负责人"])
+    for idx in range(1, links + 1):
+        fmt = formats[(idx - 1) % len(formats)]
+        name = f"doc_{idx:05d}.{fmt}"
+        FIXTURE_BUILDERS[fmt](os.path.join(attachments_dir, name), idx, images_per_doc)
+
+        row = idx + 1
+        sheet.cell(row=row, column=1, value=idx)
+        sheet.cell(row=row, column=2, value=f"任务 {idx}")
+        link_cell = sheet.cell(row=row, column=3, value=name)
+        link_cell.hyperlink = f"附件/{name}"
+        sheet.cell(row=row, column=4, value="压测")
+
+    path = os.path.join(directory, workbook_name)
+    workbook.save(path)
+    return path
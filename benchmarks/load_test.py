@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端到端压测：生成合成工作簿和附件，把 QWEN_VL_CONFIG["base_url"] 指向本地模拟服务，
+运行 process_excel_in_place 并输出 links/sec、images/sec、单链接耗时 p50/p95/p99 和峰值内存。
+
+示例：
+    python benchmarks/load_test.py --links 40 --images-per-doc 4 --latency 0.5 --llm-concurrency 8
+    python benchmarks/load_test.py --links 100 --error-rate 0.05 --rate-limit-rate 0.1 --json
+    python benchmarks/load_test.py --links 40 --formats pdf,docx --no-pipeline
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import write_file_excel  # noqa: E402
+from fixtures import SUPPORTED_FORMATS, make_workbook  # noqa: E402
+from mock_vision_server import MockVisionServer  # noqa: E402
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法百分位数。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """返回本进程和已结束子进程的峰值常驻内存（MB），不支持的平台返回 None。"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # macOS 上 ru_maxrss 的单位是字节
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return max(self_kb, children_kb) / divisor
+
+
+class LinkTimer:
+    """
+    包装 prepare_document / prepare_images / apply_image_descriptions，按链接记录耗时。
+    同一链接在各阶段之间传递的是同一个 image_paths 列表，据此把开始和结束对应起来，流水线模式下同样适用。
+    串行解析时单链接耗时 = 解析 + 图片分析；并行解析时解析在子进程中，只能从主进程的图片预处理阶段开始计时。
+    """
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self._started: Dict[int, float] = {}
+        self._originals = {}
+
+    def install(self):
+        module = write_file_excel
+        self._originals = {
+            "prepare_document": module.prepare_document,
+            "prepare_images": module.prepare_images,
+            "apply_image_descriptions": module.apply_image_descriptions,
+        }
+        timer = self
+
+        def timed_prepare(*args, **kwargs):
+            started = time.perf_counter()
+            result = timer._originals["prepare_document"](*args, **kwargs)
+            timer._started[id(result[1])] = started
+            return result
+
+        def timed_prepare_images(image_paths, *args, **kwargs):
+            timer._started.setdefault(id(image_paths), time.perf_counter())
+            return timer._originals["prepare_images"](image_paths, *args, **kwargs)
+
+        def timed_apply(markdown, image_paths, *args, **kwargs):
+            try:
+                return timer._originals["apply_image_descriptions"](
+                    markdown, image_paths, *args, **kwargs
+                )
+            finally:
+                started = timer._started.pop(id(image_paths), None)
+                if started is not None:
+                    timer.latencies.append(time.perf_counter() - started)
+
+        module.prepare_document = timed_prepare
+        module.prepare_images = timed_prepare_images
+        module.apply_image_descriptions = timed_apply
+
+    def uninstall(self):
+        for name, func in self._originals.items():
+            setattr(write_file_excel, name, func)
+
+
+def run_load_test(args) -> Dict:
+    work_dir = tempfile.mkdtemp(prefix="linkcontent_bench_")
+    try:
+        formats = tuple(fmt.strip() for fmt in args.formats.split(",") if fmt.strip())
+        started = time.perf_counter()
+        workbook_path = make_workbook(
+            work_dir, links=args.links, images_per_doc=args.images_per_doc, formats=formats
+        )
+        fixture_seconds = time.perf_counter() - started
+
+        server = MockVisionServer(
+            latency=args.latency,
+            latency_jitter=args.latency_jitter,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            max_rps=args.max_rps,
+        )
+        config = write_file_excel.QWEN_VL_CONFIG
+        config.update(
+            api_key="mock-key",
+            base_url=server.base_url,
+            max_concurrency=args.llm_concurrency,
+            batch_size=args.batch_size,
+        )
+        write_file_excel.PROCESSING_CONFIG.update(
+            pipeline=not args.no_pipeline, llm_workers=args.llm_workers
+        )
+        write_file_excel.API_LIMIT_CONFIG["requests_per_second"] = args.client_rps
+        if not args.use_cache:
+            write_file_excel.CACHE_CONFIG["enabled"] = False
+
+        timer = LinkTimer()
+        timer.install()
+        output = open(os.devnull, "w", encoding="utf-8") if not args.verbose else None
+        try:
+            with server:
+                started = time.perf_counter()
+                if output is not None:
+                    real_stdout, sys.stdout = sys.stdout, output
+                try:
+                    write_file_excel.process_excel_in_place(
+                        workbook_path, workers=args.workers
+                    )
+                finally:
+                    if output is not None:
+                        sys.stdout = real_stdout
+                elapsed = time.perf_counter() - started
+        finally:
+            timer.uninstall()
+            if output is not None:
+                output.close()
+
+        stats = dict(server.stats)
+        latencies = timer.latencies
+        return {
+            "links": args.links,
+            "images_per_doc": args.images_per_doc,
+            "formats": list(formats),
+            "workers": args.workers,
+            "llm_concurrency": args.llm_concurrency,
+            "batch_size": args.batch_size,
+            "pipeline": not args.no_pipeline,
+            "llm_workers": args.llm_workers,
+            "fixture_seconds": round(fixture_seconds, 3),
+            "elapsed_seconds": round(elapsed, 3),
+            "links_per_sec": round(args.links / elapsed, 3) if elapsed else 0.0,
+            "images_per_sec": round(stats["images"] / elapsed, 3) if elapsed else 0.0,
+            "link_latency_p50": round(percentile(latencies, 50), 3),
+            "link_latency_p95": round(percentile(latencies, 95), 3),
+            "link_latency_p99": round(percentile(latencies, 99), 3),
+            "link_latency_scope": "main_process" if args.workers > 1 else "end_to_end",
+            "peak_rss_mb": round(peak_rss_mb() or 0.0, 1),
+            "server": stats,
+        }
+    finally:
+        if args.keep:
+            print(f"保留压测目录: {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_report(result: Dict):
+    print("=" * 60)
+    print(
+        f"链接数: {result['links']}  每文档图片数: {result['images_per_doc']}  "
+        f"格式: {','.join(result['formats'])}"
+    )
+    print(
+        f"解析进程: {result['workers']}  LLM并发: {result['llm_concurrency']}  "
+        f"批大小: {result['batch_size']}  "
+        f"流水线: {'开启（图片分析 %d 个文档并发）' % result['llm_workers'] if result['pipeline'] else '关闭'}"
+    )
+    print("-" * 60)
+    print(f"总耗时:        {result['elapsed_seconds']:.2f} s")
+    print(f"links/sec:     {result['links_per_sec']:.2f}")
+    print(f"images/sec:    {result['images_per_sec']:.2f}")
+    print(
+        f"单链接耗时:    p50 {result['link_latency_p50']:.3f} s  "
+        f"p95 {result['link_latency_p95']:.3f} s  p99 {result['link_latency_p99']:.3f} s"
+        f"  ({result['link_latency_scope']})"
+    )
+    print(f"峰值内存:      {result['peak_rss_mb']:.1f} MB")
+    server = result["server"]
+    print(
+        f"模拟服务:      请求 {server['requests']}  图片 {server['images']}  "
+        f"200={server['status_200']} 429={server['status_429']} 500={server['status_500']}"
+    )
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LinkContentAI 端到端压测")
+    parser.add_argument("--links", type=int, default=20, help="工作簿中的超链接数量")
+    parser.add_argument("--images-per-doc", type=int, default=2, help="每个附件包含的图片数量")
+    parser.add_argument(
+        "--formats",
+        default=",".join(SUPPORTED_FORMATS),
+        help="附件格式列表（轮换使用），例如 pdf,docx",
+    )
+    parser.add_argument("--latency", type=float, default=0.3, help="模拟服务平均延迟（秒）")
+    parser.add_argument("--latency-jitter", type=float, default=0.05, help="延迟标准差（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务 500 比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="模拟服务随机 429 比例")
+    parser.add_argument("--max-rps", type=float, default=0.0, help="模拟服务每秒请求上限")
+    parser.add_argument("--client-rps", type=float, default=0.0, help="客户端限流（0 表示不限制）")
+    parser.add_argument("--workers", type=int, default=1, help="解析进程数")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="LLM并发请求数")
+    parser.add_argument("--batch-size", type=int, default=1, help="每个请求打包的图片数")
+    parser.add_argument("--no-pipeline", action="store_true", help="关闭分阶段流水线，逐个链接处理")
+    parser.add_argument("--llm-workers", type=int, default=2, help="流水线中同时进行图片分析的文档数")
+    parser.add_argument("--use-cache", action="store_true", help="启用图片描述缓存（默认关闭）")
+    parser.add_argument("--keep", action="store_true", help="保留生成的工作簿和附件")
+    parser.add_argument("--verbose", action="store_true", help="显示处理日志")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    result = run_load_test(args)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟的 OpenAI 兼容多模态接口（/v1/chat/completions），用于在不消耗真实API额度的情况下压测。
+支持配置响应延迟、随机 5xx 错误率、随机 429 比例以及每秒请求数上限（超出返回 429）。
+
+单独运行：
+    python benchmarks/mock_vision_server.py --port 8765 --latency 0.5 --error-rate 0.02
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+
+class MockVisionServer:
+    """在后台线程中运行的模拟视觉模型服务，可作为上下文管理器使用。"""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.2,
+        latency_jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        max_rps: float = 0.0,
+        retry_after: float = 1.0,
+    ):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.max_rps = max_rps
+        self.retry_after = retry_after
+        self.stats: Dict[str, int] = {
+            "requests": 0,
+            "images": 0,
+            "status_200": 0,
+            "status_429": 0,
+            "status_500": 0,
+        }
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockVisionServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + amount
+
+    def _over_rps_limit(self) -> bool:
+        """按1秒固定窗口统计请求数，超过 max_rps 时返回 True。"""
+        if not self.max_rps:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            return self._window_count > self.max_rps
+
+    def _build_completion(self, request: Dict) -> Tuple[Dict, int]:
+        image_count = sum(
+            1
+            for message in request.get("messages", [])
+            if isinstance(message.get("content"), list)
+            for part in message["content"]
+            if part.get("type") == "image_url"
+        )
+        if image_count > 1:
+            # 批量请求按约定返回 JSON 数组
+            content = json.dumps(
+                [
+                    {"index": i, "description": f"模拟描述：第 {i} 张图片，包含示例文字和图表。"}
+                    for i in range(1, image_count + 1)
+                ],
+                ensure_ascii=False,
+            )
+        else:
+            content = "模拟描述：图片包含示例文字、一个柱状图和页眉标志。"
+        completion_tokens = len(content)
+        prompt_tokens = 50 + image_count * 800
+        return {
+            "id": f"chatcmpl-mock-{random.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock-vl"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }, image_count
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send_json(self, status: int, payload: Dict, headers: Dict = None):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    request = {}
+                server._count("requests")
+
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+
+                if server._over_rps_limit() or random.random() < server.rate_limit_rate:
+                    server._count("status_429")
+                    self._send_json(
+                        429,
+                        {"error": {"message": "rate limited", "type": "rate_limit"}},
+                        {"Retry-After": str(server.retry_after)},
+                    )
+                    return
+
+                delay = server.latency
+                if server.latency_jitter:
+                    delay = max(0.0, random.gauss(server.latency, server.latency_jitter))
+                time.sleep(delay)
+
+                if random.random() < server.error_rate:
+                    server._count("status_500")
+                    self._send_json(500, {"error": {"message": "mock internal error"}})
+                    return
+
+                completion, image_count = server._build_completion(request)
+                server._count("images", image_count)
+                server._count("status_200")
+                self._send_json(200, completion)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI 兼容视觉模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="平均响应延迟（秒）")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="延迟标准差（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="随机返回 429 的比例")
+    parser.add_argument("--max-rps", type=float, default=0.0, help="每秒请求数上限，0 表示不限制")
+    args = parser.parse_args()
+
+    server = MockVisionServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        max_rps=args.max_rps,
+    )
+    print(f"模拟视觉服务已启动: {server.base_url}")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(f"统计: {server.stats}")
+
+
+if __name__ == "__main__":
+    main()
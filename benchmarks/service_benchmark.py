@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常驻服务对比基准：同样的一组工作簿，分别用“每个工作簿启动一次命令行”和“提交给常驻服务”两种方式处理，
+视觉模型接口指向本地模拟服务，全程离线。输出两种方式的单工作簿耗时中位数和总耗时。
+两种方式各自使用临时的用户目录，图片描述缓存互不影响，也不会写入真实的缓存。
+
+示例：
+    python benchmarks/service_benchmark.py --workbooks 5 --links 4 --latency 0.2
+    python benchmarks/service_benchmark.py --workbooks 10 --formats docx,txt --json
+"""
+import argparse
+import json
+import os
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import write_file_excel  # noqa: E402
+from fixtures import make_workbook  # noqa: E402
+from load_test import percentile  # noqa: E402
+from mock_vision_server import MockVisionServer  # noqa: E402
+
+SCRIPT_PATH = os.path.join(REPO_DIR, "write_file_excel.py")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def with_home(env: Dict[str, str], home: str) -> Dict[str, str]:
+    """把用户目录指向 home，使 CACHE_CONFIG 默认的描述缓存落在临时目录中。"""
+    os.makedirs(home, exist_ok=True)
+    return dict(env, HOME=home, USERPROFILE=home)
+
+
+def make_workbooks(directory: str, count: int, links: int, images_per_doc: int, formats) -> List[str]:
+    paths = []
+    for index in range(count):
+        workbook_dir = os.path.join(directory, f"wb_{index:03d}")
+        os.makedirs(workbook_dir)
+        paths.append(
+            make_workbook(
+                workbook_dir, links=links, images_per_doc=images_per_doc, formats=formats
+            )
+        )
+    return paths
+
+
+def run_cold(paths: List[str], env: Dict[str, str]) -> List[float]:
+    """每个工作簿启动一个新的命令行进程。"""
+    durations = []
+    for path in paths:
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, SCRIPT_PATH, path, "--output", "copy", "--workers", "1"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        durations.append(time.perf_counter() - started)
+        if completed.returncode != 0:
+            raise RuntimeError(f"命令行处理失败（退出码 {completed.returncode}）: {completed.stderr[-500:]}")
+    return durations
+
+
+def run_warm(paths: List[str], env: Dict[str, str], log_path: str) -> List[float]:
+    """启动一个常驻服务，依次提交工作簿并等待完成（服务启动时间不计入）。"""
+    port = free_port()
+    # 服务的用户目录指向临时目录，自动生成的令牌文件不在本进程能找到的位置，直接指定令牌
+    token = secrets.token_urlsafe(16)
+    with open(log_path, "w", encoding="utf-8") as log:
+        daemon = subprocess.Popen(
+            [sys.executable, SCRIPT_PATH, "--serve", "--port", str(port), "--workers", "1"],
+            env=dict(env, LINKCONTENT_SERVICE_TOKEN=token),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+    client = write_file_excel.ServiceClient(f"http://127.0.0.1:{port}", token=token)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                client.health()
+                break
+            except ConnectionError:
+                if daemon.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"常驻服务未能启动，日志见 {log_path}")
+                time.sleep(0.1)
+
+        durations = []
+        for path in paths:
+            started = time.perf_counter()
+            job = client.submit("workbook", {"path": path, "output": "copy"})
+            finished = client.wait(job["id"])
+            durations.append(time.perf_counter() - started)
+            if finished["status"] != "done" or finished["result"]["status"] != "ok":
+                raise RuntimeError(f"常驻服务处理失败: {finished.get('error') or finished['result']}")
+        client.shutdown()
+        daemon.wait(timeout=60)
+        return durations
+    finally:
+        if daemon.poll() is None:
+            daemon.kill()
+
+
+def summarize(durations: List[float]) -> Dict:
+    return {
+        "total_seconds": round(sum(durations), 3),
+        "p50": round(percentile(durations, 50), 3),
+        "p95": round(percentile(durations, 95), 3),
+        "first": round(durations[0], 3) if durations else 0.0,
+    }
+
+
+def run_benchmark(args) -> Dict:
+    work_dir = tempfile.mkdtemp(prefix="linkcontent_service_")
+    formats = tuple(fmt.strip() for fmt in args.formats.split(",") if fmt.strip())
+    try:
+        cold_paths = make_workbooks(
+            os.path.join(work_dir, "cold"), args.workbooks, args.links, args.images_per_doc, formats
+        )
+        warm_paths = make_workbooks(
+            os.path.join(work_dir, "warm"), args.workbooks, args.links, args.images_per_doc, formats
+        )
+        with MockVisionServer(latency=args.latency) as server:
+            env = dict(
+                os.environ,
+                QWEN_V="mock-key",
+                QWEN_VL_BASE_URL=server.base_url,
+                PYTHONIOENCODING="utf-8",
+            )
+            cold = run_cold(cold_paths, with_home(env, os.path.join(work_dir, "home_cold")))
+            warm = run_warm(
+                warm_paths,
+                with_home(env, os.path.join(work_dir, "home_warm")),
+                os.path.join(work_dir, "service.log"),
+            )
+        cold_summary, warm_summary = summarize(cold), summarize(warm)
+        return {
+            "workbooks": args.workbooks,
+            "links": args.links,
+            "images_per_doc": args.images_per_doc,
+            "formats": list(formats),
+            "latency": args.latency,
+            "cold_cli": cold_summary,
+            "service": warm_summary,
+            "speedup_p50": round(cold_summary["p50"] / warm_summary["p50"], 2)
+            if warm_summary["p50"]
+            else None,
+        }
+    finally:
+        if args.keep:
+            print(f"保留基准目录: {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_report(result: Dict):
+    print("=" * 60)
+    print(
+        f"工作簿: {result['workbooks']}  每个工作簿链接数: {result['links']}  "
+        f"每文档图片数: {result['images_per_doc']}  格式: {','.join(result['formats'])}"
+    )
+    print("-" * 60)
+    for key, label in (("cold_cli", "每次启动命令行"), ("service", "常驻服务")):
+        section = result[key]
+        print(
+            f"{label:<10} 总耗时 {section['total_seconds']:.2f} s  p50 {section['p50']:.3f} s  "
+            f"p95 {section['p95']:.3f} s  首个 {section['first']:.3f} s"
+        )
+    if result["speedup_p50"]:
+        print(f"单工作簿 p50 加速: {result['speedup_p50']:.2f}x")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LinkContentAI 常驻服务对比基准")
+    parser.add_argument("--workbooks", type=int, default=5, help="每种方式处理的工作簿数量")
+    parser.add_argument("--links", type=int, default=4, help="每个工作簿中的超链接数量")
+    parser.add_argument("--images-per-doc", type=int, default=1, help="每个附件包含的图片数量")
+    parser.add_argument("--formats", default="docx,pptx,txt", help="附件格式列表（轮换使用）")
+    parser.add_argument("--latency", type=float, default=0.1, help="模拟服务平均延迟（秒）")
+    parser.add_argument("--keep", action="store_true", help="保留生成的工作簿和服务日志")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
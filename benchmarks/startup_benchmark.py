@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+冷启动基准：用 python -X importtime 在全新子进程中测量
+1) import write_file_excel 的导入耗时；
+2) 命令行处理一个只含 TXT 附件的工作簿时的总耗时和导入耗时。
+同时列出导入耗时最高的模块，并检查 TXT 场景是否误导入了 openai / httpx / PIL 等重依赖。
+
+示例：
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --repeat 5 --links 5 --json
+    python benchmarks/startup_benchmark.py --import-budget-ms 300 --run-budget-ms 1500
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fixtures import make_workbook  # noqa: E402
+
+SCRIPT_PATH = os.path.join(REPO_DIR, "write_file_excel.py")
+
+# TXT 工作簿不应触发的重依赖（顶层包名）
+HEAVY_MODULES = ("openai", "httpx", "httpx2", "pydantic", "PIL", "numpy", "pdfplumber", "pdf2image", "pptx")
+# 这些第三方包会自行导入部分重依赖（openpyxl 在已安装时导入 PIL 和 numpy），不计为违规
+TOLERATED_IMPORTERS = ("openpyxl",)
+
+_IMPORTTIME_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def parse_importtime(stderr: str) -> List[Dict]:
+    """解析 -X importtime 输出，返回 [{module, self_us, cumulative_us, depth}]。"""
+    entries = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_PATTERN.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        entries.append(
+            {
+                "module": module,
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+                "depth": (len(indent) - 1) // 2,
+            }
+        )
+    return entries
+
+
+def run_with_importtime(args: List[str], cwd: str) -> Dict:
+    """在全新解释器中运行命令并收集导入记录和墙钟耗时。"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_DIR, env.get("PYTHONPATH")]))
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+    )
+    wall_seconds = time.perf_counter() - started
+    entries = parse_importtime(completed.stderr)
+    return {
+        "returncode": completed.returncode,
+        "wall_seconds": wall_seconds,
+        "entries": entries,
+        # 顶层导入的累计耗时之和即为所有导入的总耗时
+        "import_us": sum(e["cumulative_us"] for e in entries if e["depth"] == 0),
+        "stderr_tail": "\n".join(
+            line for line in completed.stderr.splitlines()[-20:]
+            if not line.startswith("import time:")
+        ),
+    }
+
+
+def heavy_modules_loaded(entries: List[Dict]) -> Dict[str, str]:
+    """
+    返回 {重依赖包名: 触发导入的顶层模块}。
+    importtime 按后序输出（子模块先于父模块），向后找到的第一个 depth 为 0 的记录即顶层导入。
+    """
+    loaded: Dict[str, str] = {}
+    pending: List[str] = []
+    for entry in entries:
+        name = entry["module"].split(".")[0]
+        if name in HEAVY_MODULES and name not in loaded:
+            pending.append(name)
+        if entry["depth"] == 0:
+            for heavy in pending:
+                loaded.setdefault(heavy, entry["module"].split(".")[0])
+            pending = []
+    return loaded
+
+
+def top_modules(entries: List[Dict], count: int) -> List[Dict]:
+    """按自身耗时排序的前 count 个模块。"""
+    ordered = sorted(entries, key=lambda e: e["self_us"], reverse=True)[:count]
+    return [
+        {"module": e["module"], "self_ms": round(e["self_us"] / 1000, 1),
+         "cumulative_ms": round(e["cumulative_us"] / 1000, 1)}
+        for e in ordered
+    ]
+
+
+def summarize(runs: List[Dict], top: int) -> Dict:
+    """多次运行取中位数，导入明细取中位数那一次。"""
+    ordered = sorted(runs, key=lambda r: r["import_us"])
+    median = ordered[len(ordered) // 2]
+    walls = sorted(r["wall_seconds"] for r in runs)
+    return {
+        "import_ms": round(median["import_us"] / 1000, 1),
+        "import_ms_min": round(ordered[0]["import_us"] / 1000, 1),
+        "wall_ms": round(walls[len(walls) // 2] * 1000, 1),
+        "modules": len(median["entries"]),
+        "heavy_modules": heavy_modules_loaded(median["entries"]),
+        "top_modules": top_modules(median["entries"], top),
+        "failed_runs": sum(1 for r in runs if r["returncode"] != 0),
+    }
+
+
+def run_benchmark(args) -> Dict:
+    work_dir = tempfile.mkdtemp(prefix="linkcontent_startup_")
+    try:
+        import_runs = [
+            run_with_importtime(["-c", "import write_file_excel"], cwd=work_dir)
+            for _ in range(args.repeat)
+        ]
+
+        workbook_runs = []
+        for index in range(args.repeat):
+            run_dir = os.path.join(work_dir, f"run_{index}")
+            os.makedirs(run_dir)
+            workbook_path = make_workbook(run_dir, links=args.links, formats=("txt",))
+            workbook_runs.append(
+                run_with_importtime(
+                    [SCRIPT_PATH, workbook_path, "--workers", "1"], cwd=run_dir
+                )
+            )
+        failed = next((r for r in workbook_runs if r["returncode"] != 0), None)
+
+        result = {
+            "python": sys.version.split()[0],
+            "repeat": args.repeat,
+            "links": args.links,
+            "import": summarize(import_runs, args.top),
+            "txt_workbook": summarize(workbook_runs, args.top),
+        }
+        if failed is not None:
+            result["txt_workbook"]["stderr_tail"] = failed["stderr_tail"]
+        return result
+    finally:
+        if args.keep:
+            print(f"保留基准目录: {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def check_budgets(result: Dict, import_budget_ms: Optional[float], run_budget_ms: Optional[float]) -> List[str]:
+    violations = []
+    if import_budget_ms and result["import"]["import_ms"] > import_budget_ms:
+        violations.append(
+            f"导入耗时 {result['import']['import_ms']} ms 超过预算 {import_budget_ms} ms"
+        )
+    if run_budget_ms and result["txt_workbook"]["wall_ms"] > run_budget_ms:
+        violations.append(
+            f"TXT 工作簿总耗时 {result['txt_workbook']['wall_ms']} ms 超过预算 {run_budget_ms} ms"
+        )
+    for name in ("import", "txt_workbook"):
+        unexpected = [
+            heavy for heavy, importer in result[name]["heavy_modules"].items()
+            if importer not in TOLERATED_IMPORTERS
+        ]
+        if unexpected:
+            violations.append(f"{name} 导入了重依赖: {', '.join(unexpected)}")
+        if result[name]["failed_runs"]:
+            violations.append(f"{name} 有 {result[name]['failed_runs']} 次运行失败")
+    return violations
+
+
+def print_report(result: Dict):
+    print("=" * 60)
+    print(f"Python {result['python']}  重复次数: {result['repeat']}  TXT 链接数: {result['links']}")
+    for name, label in (("import", "import write_file_excel"), ("txt_workbook", "TXT 工作簿命令行运行")):
+        section = result[name]
+        print("-" * 60)
+        print(f"{label}")
+        print(
+            f"  导入耗时: {section['import_ms']:.1f} ms（最小 {section['import_ms_min']:.1f} ms）"
+            f"  进程总耗时: {section['wall_ms']:.1f} ms  模块数: {section['modules']}"
+        )
+        heavy = [
+            heavy if importer == heavy else f"{heavy}（经 {importer} 导入）"
+            for heavy, importer in section["heavy_modules"].items()
+        ]
+        print(f"  重依赖: {', '.join(heavy) or '无'}")
+        for entry in section["top_modules"]:
+            print(
+                f"    {entry['self_ms']:>7.1f} ms self  {entry['cumulative_ms']:>7.1f} ms cum  "
+                f"{entry['module']}"
+            )
+        if section.get("stderr_tail"):
+            print(f"  失败输出:\n{section['stderr_tail']}")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LinkContentAI 冷启动基准")
+    parser.add_argument("--repeat", type=int, default=3, help="每个场景运行的次数（取中位数）")
+    parser.add_argument("--links", type=int, default=3, help="TXT 工作簿中的链接数量")
+    parser.add_argument("--top", type=int, default=10, help="列出自身导入耗时最高的模块数")
+    parser.add_argument("--import-budget-ms", type=float, default=None, help="导入耗时预算，超出时退出码为 1")
+    parser.add_argument("--run-budget-ms", type=float, default=None, help="TXT 工作簿总耗时预算，超出时退出码为 1")
+    parser.add_argument("--keep", action="store_true", help="保留生成的工作簿和附件")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    violations = check_budgets(result, args.import_budget_ms, args.run_budget_ms)
+    result["violations"] = violations
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        print_report(result)
+        for violation in violations:
+            print(f"[超出预算] {violation}")
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
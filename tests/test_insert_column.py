@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+insert 模式插入内容列后，右侧的超链接、合并单元格、条件格式和数据验证随单元格一起右移。
+"""
+import os
+import sys
+
+import openpyxl
+from openpyxl.formatting.rule import CellIsRule
+from openpyxl.worksheet.datavalidation import DataValidation
+from openpyxl.worksheet.hyperlink import Hyperlink
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import write_file_excel  # noqa: E402
+
+
+def make_sheet_with_layout(directory: str) -> str:
+    with open(os.path.join(directory, "notes.txt"), "w", encoding="utf-8") as f:
+        f.write("附件正文")
+
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["编号", "任务", "附件", "备注", "分组", "", "跳转"])
+    sheet["C2"] = "notes.txt"
+    sheet["C2"].hyperlink = "notes.txt"
+    # 插入点右侧：合并单元格、条件格式、数据验证和工作簿内部跳转链接
+    sheet.merge_cells("E1:F2")
+    sheet["E3"] = 5
+    sheet.conditional_formatting.add(
+        "E3:E9", CellIsRule(operator="greaterThan", formula=["1"])
+    )
+    validation = DataValidation(type="list", formula1='"是,否"')
+    validation.add("F3:F9")
+    sheet.add_data_validation(validation)
+    sheet["G3"] = "回到开头"
+    sheet["G3"].hyperlink = Hyperlink(ref="G3", location="'Sheet'!A1")
+    # 跨越插入点的合并区域
+    sheet.merge_cells("B5:D5")
+
+    path = os.path.join(directory, "layout.xlsx")
+    workbook.save(path)
+    return path
+
+
+def test_insert_column_shifts_layout(tmp_path, monkeypatch):
+    workbook_path = make_sheet_with_layout(str(tmp_path))
+    monkeypatch.setitem(write_file_excel.WORKBOOK_CONFIG, "layout", "insert")
+    monkeypatch.setitem(write_file_excel.CACHE_CONFIG, "enabled", False)
+    monkeypatch.setitem(write_file_excel.CHECKPOINT_CONFIG, "journal", False)
+
+    summary = write_file_excel.process_excel_in_place(workbook_path)
+    assert summary["status"] == "ok"
+
+    sheet = openpyxl.load_workbook(workbook_path).active
+    assert sheet["D1"].value == write_file_excel.CONTENT_HEADER
+    assert "附件正文" in sheet["D2"].value
+    assert sheet["C2"].hyperlink.target == "notes.txt"
+
+    assert sorted(str(r) for r in sheet.merged_cells.ranges) == ["B5:E5", "F1:G2"]
+    assert sheet["F3"].value == 5
+    assert [str(cf.sqref) for cf in sheet.conditional_formatting] == ["F3:F9"]
+    assert [str(dv.sqref) for dv in sheet.data_validations.dataValidation] == ["G3:G9"]
+    assert sheet["H3"].hyperlink.location == "'Sheet'!A1"
+    assert sheet["H3"].hyperlink.ref == "H3"
+    assert sheet["G3"].hyperlink is None
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+多进程解析工作簿时，大型PDF按页码范围分发给解析进程池并行提取。
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import write_file_excel  # noqa: E402
+from fixtures import make_workbook  # noqa: E402
+
+
+class RecordingPool:
+    """包装真实的解析进程池，记录提交的任务。"""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self.submitted = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.submitted.append((fn.__name__, args))
+        return self._pool.submit(fn, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+def test_workbook_dispatches_pdf_page_ranges(tmp_path, monkeypatch):
+    # 第 1 个链接是 8 页的PDF（每页两张图片），第 2 个是普通文本
+    workbook_path = make_workbook(
+        str(tmp_path), links=2, images_per_doc=16, formats=("pdf", "txt")
+    )
+    monkeypatch.setitem(write_file_excel.PROCESSING_CONFIG, "parse_workers", 2)
+    monkeypatch.setitem(write_file_excel.PDF_CONFIG, "text_workers", 2)
+    monkeypatch.setitem(write_file_excel.PDF_CONFIG, "parallel_min_pages", 4)
+    monkeypatch.setitem(write_file_excel.PDF_CONFIG, "pages_per_task", 2)
+    monkeypatch.setitem(write_file_excel.CACHE_CONFIG, "enabled", False)
+    monkeypatch.setitem(write_file_excel.CHECKPOINT_CONFIG, "journal", False)
+    # 不调用视觉模型，只验证解析调度
+    monkeypatch.setitem(write_file_excel.QWEN_VL_CONFIG, "api_key", None)
+
+    real_get_parse_pool = write_file_excel.get_parse_pool
+    recorder = {}
+
+    def get_recording_pool(workers):
+        pool = real_get_parse_pool(workers)
+        if recorder.get("pool") is None or recorder["pool"]._pool is not pool:
+            recorder["pool"] = RecordingPool(pool)
+        return recorder["pool"]
+
+    monkeypatch.setattr(write_file_excel, "get_parse_pool", get_recording_pool)
+    try:
+        write_file_excel.process_excel_in_place(workbook_path)
+    finally:
+        write_file_excel.close_shared_resources()
+
+    submitted = recorder["pool"].submitted
+    page_ranges = sorted(args[1:] for name, args in submitted if name == "_extract_pdf_page_range")
+    assert page_ranges == [(1, 2), (3, 4), (5, 6), (7, 8)]
+    # 大型PDF不再整本交给一个子进程，其他文档仍在子进程中解析
+    documents = [args[0] for name, args in submitted if name == "_prepare_document_in_worker"]
+    assert [os.path.basename(path) for path in documents] == ["doc_00002.txt"]
@@ -11,18 +11,37 @@ import logging
 # 抑制所有PDF相关警告
 logging.getLogger("pdfminer").setLevel(logging.ERROR)
 
-import openpyxl
-import docx
 import tempfile
 import shutil
 import uuid
 import re
 import json
 import base64
-from typing import Dict, List, Tuple, Optional
+import hashlib
+import gzip
+import io
+import mimetypes
+import random
+import posixpath
+import zipfile
+import glob
+import xml.etree.ElementTree as ET
+import sqlite3
+import threading
+import time
+import queue
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Tuple, Optional
 from pathlib import Path
-from openpyxl.utils import get_column_letter
-from openai import OpenAI
+
+# openpyxl、openai（连带其 HTTP 客户端和 pydantic）、Pillow、pdfplumber、python-pptx 等较重的依赖
+# 都在用到时才导入，RPA 逐个工作簿调用时不必为用不到的格式和后端付出启动开销
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+    import numpy as np
+    from openai import OpenAI
 
 # from xbot import print
 
@@ -31,25 +50,204 @@ from openai import OpenAI
 # TODO: 请配置您的qwen-vl API信息
 QWEN_VL_CONFIG = {
     "api_key": os.getenv("QWEN_V"),  # API密钥
-    "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1",  # 通义千问API endpoint
+    "base_url": os.getenv(
+        "QWEN_VL_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    ),  # 通义千问API endpoint（可用环境变量指向本地模拟服务）
     "model": "qwen-vl-plus",  # 或 qwen-vl-max
+    "max_concurrency": 4,  # 单个文档内并发分析图片的最大请求数，1 表示逐张串行
+    # 整次运行共享的HTTP连接池
+    "max_connections": 16,  # 最大连接数
+    "max_keepalive_connections": 8,  # 最多保持的空闲长连接数
+    "keepalive_expiry": 60.0,  # 空闲长连接保留时间（秒）
+    "prompt": "请详细描述这张图片的内容，包括文字、图表、布局等所有可见信息。请用中文回答。",
+    "max_tokens": 1500,  # 每张图片描述的最大输出 token 数
+    # 多图批量请求：把多张小图片打包到一次请求中，1 表示每张图片单独请求
+    "batch_size": 1,
+    "batch_max_pixels": 4_000_000,  # 单个批次内图片的总像素上限
+    "batch_max_bytes": 4 * 1024 * 1024,  # 单个批次内图片文件的总字节上限
+    "batch_prompt": (
+        "下面依次给出 {count} 张图片。请分别详细描述每张图片的内容，包括文字、图表、布局等所有可见信息，请用中文回答。"
+        '只输出一个JSON数组，不要输出其他内容，格式为：[{{"index": 1, "description": "..."}}, ...]，'
+        "index 为图片序号（从1开始），数组长度必须等于图片数量。"
+    ),
+}
+
+# 视觉模型API的限流、重试和熔断配置（所有并发请求共享）
+API_LIMIT_CONFIG = {
+    "requests_per_second": 5.0,  # 每秒请求数上限，0 表示不限制
+    "tokens_per_minute": 0,  # 每分钟 token 上限，0 表示不限制
+    "image_token_estimate": 1000,  # 估算 token 时每张图片计入的 token 数
+    "timeout": 120,  # 单次请求超时（秒）
+    "max_retries": 4,  # 429/超时/连接错误/5xx 的最大重试次数
+    "backoff_base": 1.0,  # 指数退避的基础等待时间（秒）
+    "backoff_max": 30.0,  # 单次退避等待的上限（秒）
+    "breaker_failure_threshold": 5,  # 连续失败达到该次数后熔断，暂停所有请求
+    "breaker_cooldown": 30.0,  # 熔断后等待多久（秒）再放行一个探测请求
+}
+
+# 图片描述缓存配置
+# 以 图片内容哈希 + 模型 + prompt + max_tokens 为键，跨运行复用已生成的描述
+CACHE_CONFIG = {
+    "enabled": True,
+    "path": os.path.join(
+        os.path.expanduser("~"), ".cache", "link_content_ai", "image_descriptions.db"
+    ),
+    "max_entries": 100000,  # 超出后按最久未使用淘汰
+    "max_age_days": 90,  # 超过该天数的描述视为过期
+    # 会话内已完成文档的结果缓存（跨工作簿/常驻服务复用），超出任一上限时按最久未使用淘汰，0 表示不限制
+    "document_results_max_entries": 2000,
+    "document_results_max_bytes": 256 * 1024 * 1024,  # 按内容的 UTF-8 字节数估算
+}
+
+# 图片去重配置（在整个工作簿范围内合并相同/近似图片，只分析一次）
+DEDUP_CONFIG = {
+    "enabled": True,
+    "perceptual": True,  # 是否启用感知哈希近似去重（需要 Pillow）
+    "hash_size": 16,  # 差异哈希边长，哈希位数为 hash_size * hash_size
+    "max_distance": 4,  # 感知哈希汉明距离不超过该值视为同一张图片
+}
+
+# PDF 图片提取配置
+PDF_CONFIG = {
+    # "embedded": 只裁剪页面中嵌入的图片，没有文本层的页面（扫描页）才整页渲染
+    # "page": 每一页都整页渲染为图片（旧行为）
+    "image_mode": "embedded",
+    "min_image_size": 16,  # 宽或高小于该值（pt）的嵌入图片视为装饰元素，忽略
+    "crop_resolution": 150,  # 裁剪嵌入图片时的渲染分辨率（DPI）
+    "render_dpi": 200,  # 整页渲染的分辨率（DPI）
+    "render_format": "png",  # 整页渲染的输出格式：png / jpeg
+    "render_threads": 1,  # 每批整页渲染使用的 poppler 线程数
+    "max_pages_in_memory": 4,  # 整页渲染时每批最多渲染的页数，限制内存和临时文件占用
+    # 大型PDF按页码范围并行提取文本（使用解析进程池，每个子进程独立打开文件）
+    "text_workers": 4,  # 并行提取文本的进程数，1 表示始终单进程提取
+    "parallel_min_pages": 150,  # 页数达到该值时才并行提取
+    "pages_per_task": 25,  # 每个子任务提取的页数
+}
+
+# 链接的 XLSX 附件读取配置：按行流式读取，每个工作表超出上限的部分以截断标记代替
+XLSX_CONFIG = {
+    "max_rows_per_sheet": 2000,  # 每个工作表最多保留的非空行数，0 表示不限制
+    "max_bytes_per_sheet": 200000,  # 每个工作表最多保留的文本量（UTF-8 字节），0 表示不限制
+    "tail_rows": 0,  # 截断时额外保留的末尾行数（需要扫描整个工作表），0 表示读到上限即停止
+    "extract_images": True,  # 是否提取工作表中嵌入的图片并交给多模态模型分析，图表输出标题和系列名
+}
+
+# 上传前的图片规范化配置（需要 Pillow）
+IMAGE_CONFIG = {
+    "normalize": True,  # 是否在上传前缩放/重新压缩图片
+    "max_edge": 1600,  # 长边最大像素，超过时等比缩小
+    "format": "JPEG",  # 目标格式：JPEG / PNG / WEBP
+    "quality": 85,  # JPEG / WEBP 压缩质量
+}
+
+# 图片预筛配置（需要 NumPy 和 Pillow，未安装时跳过预筛）
+# 在调用多模态模型之前按缩略图统计特征识别图标、分隔线、纯色背景等简单图片，不再为它们调用模型
+TRIAGE_CONFIG = {
+    "enabled": False,  # 默认关闭：阈值需要按实际文档调整，误判会让有内容的图片得不到描述
+    "min_edge": 32,  # 长边小于该值（像素）视为图标、项目符号
+    "line_thickness": 6,  # 短边不超过该值（像素）视为分隔线
+    # 以下内容规则只用于长边不超过 max_trivial_edge 的小图；更大的图片（截图、图表、整页渲染）一律交给模型
+    "max_trivial_edge": 128,
+    "thumbnail_size": 128,  # 计算特征使用的缩略图边长（像素），不小于 max_trivial_edge 时小图按原始分辨率计算
+    "min_std": 6.0,  # 灰度标准差低于该值视为纯色
+    "edge_threshold": 32,  # 相邻像素灰度差超过该值计为边缘
+    "min_edge_density": 0.005,  # 边缘像素比例低于该值视为没有可描述的内容（空白、渐变背景）
+    "min_colors": 8,  # 颜色数（每通道量化为16级）少于该值……
+    "simple_edge_density": 0.05,  # ……且边缘像素比例低于该值时视为简单色块
+    "action": "describe",  # describe: 使用下面的固定描述；drop: 连同占位符一起删除
+    "description": "[装饰性图片（图标、分隔线或纯色背景），未调用模型分析]",
+}
+
+# 运行时处理配置
+PROCESSING_CONFIG = {
+    "parse_workers": 1,  # 并行解析文档（提取图片+转换Markdown）的进程数，1 表示在主进程串行处理
+    # 分阶段流水线：解析 → 图片预处理 → 图片分析 → 替换占位符 → 写回单元格，
+    # 各阶段由独立线程处理，分析上一个链接的图片时下一个链接已在解析
+    "pipeline": True,  # 关闭后按链接逐个完成全部步骤（旧行为）
+    "llm_workers": 2,  # 同时进行图片分析的文档数
+    "queue_size": 2,  # 相邻阶段之间最多排队的文档数，队列满时上游阶段等待，限制内存占用
+}
+
+
+# 断点续跑配置：长时间运行时崩溃、被杀或断电后可以从日志恢复
+CHECKPOINT_CONFIG = {
+    "journal": True,  # 每完成一个单元格就追加写入工作簿旁的 <工作簿名>.linkcontent.journal.jsonl
+    "save_every_links": 0,  # 每完成多少个链接原子地保存一次工作簿，0 表示不按数量保存
+    "save_every_seconds": 300,  # 距上次保存超过该秒数时原子地保存一次工作簿，0 表示不按时间保存
+}
+
+# 工作簿写入配置
+WORKBOOK_CONFIG = {
+    # 内容列的写入方式：
+    # "insert": 在每个链接列后插入新列（右侧已有单元格整体右移）
+    # "append": 内容列追加到工作表已用区域之后，不移动任何已有单元格
+    # "stream": 只读流式读取原工作簿，用 write_only 模式写出新文件（只保留单元格值和链接，适合超大工作簿）
+    "layout": "insert",
+    "auto_append_bytes": 0,  # 工作簿超过该字节数且 layout 为 insert 时自动改用 append，0 表示不自动切换
+    "stream_suffix": "_linkcontent",  # stream 模式下新文件名的后缀
+}
+
+# 超长内容的外置存储：超过单元格预算的内容压缩保存到工作簿旁的目录，单元格只保留预览和文件键
+SIDECAR_CONFIG = {
+    "enabled": True,
+    "cell_budget": 32000,  # 单元格最多写入的字符数（Excel 单元格上限为 32767）
+    "preview_chars": 2000,  # 外置时单元格中保留的预览字符数
+    "directory": None,  # 存储目录，None 表示工作簿旁的 <工作簿名>.linkcontent 目录
+    "compresslevel": 6,  # gzip 压缩级别
+}
+
+# 运行追踪配置：记录各阶段耗时，输出 JSONL 追踪文件和汇总表
+TRACE_CONFIG = {
+    "enabled": False,  # 是否记录各阶段（图片提取、Markdown转换、图片编码、LLM调用、占位符替换、保存）的耗时
+    "path": None,  # JSONL 追踪文件路径，None 表示写到工作簿旁的 <工作簿名>.trace.jsonl
+    "summary": True,  # 运行结束时打印各阶段汇总表
+    "profile_link": None,  # 对单个链接做性能剖析：填单元格坐标（如 "C5" 或 "Sheet1!C5"）或链接目标
+    "profile_tracemalloc": False,  # 剖析时同时用 tracemalloc 统计内存分配
+    "profile_top": 25,  # 剖析报告中列出的函数/内存分配点数量
+}
+
+# 常驻服务模式（--serve）：进程、API连接池、图片描述缓存和解析进程池常驻，通过本机HTTP接收任务
+SERVICE_CONFIG = {
+    "host": "127.0.0.1",  # 监听地址，默认只接受本机连接
+    "port": 8766,  # 监听端口
+    # 所有请求须带 X-LinkContent-Token 头；未设置时服务启动时生成随机令牌，
+    # 写入 token_dir 下仅当前用户可读的 service-<端口>.token，本机客户端自动读取
+    "token": os.getenv("LINKCONTENT_SERVICE_TOKEN"),
+    "token_dir": os.path.join(os.path.expanduser("~"), ".cache", "link_content_ai"),
+    # 任务中的文件路径（path、output_dir）必须位于这些目录之内，空列表表示不限制；
+    # 环境变量 LINKCONTENT_SERVICE_ROOTS 用系统路径分隔符分隔多个目录
+    "allowed_roots": [
+        root for root in os.getenv("LINKCONTENT_SERVICE_ROOTS", "").split(os.pathsep) if root
+    ],
+    "job_history": 200,  # 保留的已结束任务数量，超出时丢弃最早结束的任务
+    "poll_wait": 30,  # 客户端每次长轮询等待任务结束的秒数
+    "cache_evict_interval": 3600,  # 常驻期间每隔多少秒淘汰一次图片描述缓存的过期条目，0 表示只在退出时淘汰
 }
 
 
+# 插入到Excel中的内容列标题，增量模式据此识别已有的内容列
+CONTENT_HEADER = "链接文档内容"
+
+
 # 临时文件管理类
 class TempFileManager:
     """管理临时文件和目录的生命周期"""
 
-    def __init__(self):
-        self.temp_dir = None
+    def __init__(self, temp_dir: Optional[str] = None):
+        # 传入 temp_dir 时复用已有目录（例如子进程共享主进程的临时目录），退出时不删除
+        self.temp_dir = temp_dir
+        self.owns_temp_dir = temp_dir is None
         self.used_paths = set()
+        # 提取图片时顺带生成的Markdown（文档路径 -> 文本），供转换阶段直接使用，避免重复解析
+        self.parsed_documents: Dict[str, str] = {}
 
     def __enter__(self):
-        self.temp_dir = tempfile.mkdtemp(prefix="excel_img_proc_")
+        if self.owns_temp_dir:
+            self.temp_dir = tempfile.mkdtemp(prefix="excel_img_proc_")
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.temp_dir and os.path.exists(self.temp_dir):
+        if self.owns_temp_dir and self.temp_dir and os.path.exists(self.temp_dir):
             shutil.rmtree(self.temp_dir, ignore_errors=True)
 
     def get_temp_path(self, suffix="") -> str:
@@ -60,6 +258,193 @@ class TempFileManager:
         return os.path.join(self.temp_dir, filename)
 
 
+# --- 运行追踪 ---
+class RunTracer:
+    """
+    线程安全的轻量级阶段计时器。每个 span 记录阶段名、起止时间、耗时以及文件路径、
+    格式、字节数、图片数、token 数等附加属性；设置了 trace_path 时逐行写入 JSONL 文件。
+    """
+
+    def __init__(self, trace_path: Optional[str] = None):
+        self.trace_path = trace_path
+        self.records: List[Dict] = []
+        self._lock = threading.Lock()
+        self._file = open(trace_path, "w", encoding="utf-8") if trace_path else None
+
+    @contextmanager
+    def span(self, stage: str, **attrs) -> Iterator[Dict]:
+        """计时一个阶段；with 块内可以向返回的字典补充属性（例如统计结果）。"""
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            record = {
+                "stage": stage,
+                "start": round(started_at, 6),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                "pid": os.getpid(),
+                "thread": threading.current_thread().name,
+            }
+            record.update(attrs)
+            self.add(record)
+
+    def add(self, record: Dict):
+        with self._lock:
+            self.records.append(record)
+            if self._file is not None:
+                self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                self._file.flush()
+
+    def extend(self, records: List[Dict]):
+        """合并子进程中记录的 span。"""
+        for record in records:
+            self.add(record)
+
+    def summary(self) -> List[Dict]:
+        """按阶段汇总：次数、总耗时、平均、p95、最大耗时以及字节/图片/token 合计。"""
+        stages: Dict[str, List[Dict]] = {}
+        for record in self.records:
+            stages.setdefault(record["stage"], []).append(record)
+
+        rows = []
+        for stage, records in stages.items():
+            durations = sorted(record["duration_ms"] for record in records)
+            p95_index = max(0, int(round(len(durations) * 0.95 + 0.5)) - 1)
+            rows.append(
+                {
+                    "stage": stage,
+                    "count": len(records),
+                    "total_ms": sum(durations),
+                    "mean_ms": sum(durations) / len(durations),
+                    "p95_ms": durations[min(p95_index, len(durations) - 1)],
+                    "max_ms": durations[-1],
+                    "bytes": sum(record.get("bytes") or 0 for record in records),
+                    "images": sum(record.get("images") or 0 for record in records),
+                    "tokens": sum(record.get("total_tokens") or 0 for record in records),
+                    "errors": sum(1 for record in records if record.get("error")),
+                }
+            )
+        rows.sort(key=lambda row: row["total_ms"], reverse=True)
+        return rows
+
+    def print_summary(self):
+        rows = self.summary()
+        if not rows:
+            return
+        print("\n各阶段耗时汇总:")
+        print(
+            # 中文字符按双倍宽度显示，表头宽度相应减小以便与数据列对齐
+            f"  {'阶段':<20}{'次数':>4}{'总耗时(s)':>8}{'平均(ms)':>8}{'p95(ms)':>10}"
+            f"{'最大(ms)':>8}{'字节':>10}{'图片':>4}{'tokens':>9}{'错误':>3}"
+        )
+        for row in rows:
+            print(
+                f"  {row['stage']:<22}{row['count']:>6}{row['total_ms'] / 1000:>11.2f}"
+                f"{row['mean_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['max_ms']:>10.1f}"
+                f"{row['bytes']:>12}{row['images']:>6}{row['tokens']:>9}{row['errors']:>5}"
+            )
+        if self.trace_path:
+            print(f"追踪文件: {self.trace_path}")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# 当前运行的追踪器；为 None 时 trace_span 不做任何记录
+_active_tracer: Optional[RunTracer] = None
+
+
+@contextmanager
+def trace_span(stage: str, **attrs) -> Iterator[Dict]:
+    """在当前追踪器上记录一个阶段 span；未启用追踪时只返回属性字典，不计时。"""
+    tracer = _active_tracer
+    if tracer is None:
+        yield attrs
+        return
+    with tracer.span(stage, **attrs) as span_attrs:
+        yield span_attrs
+
+
+def _file_size(path: str) -> Optional[int]:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+@contextmanager
+def profile_section(label: str, output_path: str):
+    """
+    使用 cProfile（以及可选的 tracemalloc）剖析一段代码，统计结果写入 output_path
+    （可用 snakeviz / pstats 查看），并在控制台打印累计耗时最高的函数。
+    注意 cProfile 只统计当前线程，LLM 并发线程中的耗时体现为等待时间。
+    """
+    import cProfile
+    import pstats
+
+    top = TRACE_CONFIG.get("profile_top", 25)
+    use_tracemalloc = TRACE_CONFIG.get("profile_tracemalloc", False)
+    if use_tracemalloc:
+        import tracemalloc
+
+        tracemalloc.start()
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(output_path)
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(top)
+        print(f"\n性能剖析 {label}（完整结果: {output_path}）:")
+        print(stream.getvalue())
+
+        if use_tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"内存分配: 当前 {current / 1024 / 1024:.1f} MB，峰值 {peak / 1024 / 1024:.1f} MB"
+            )
+            for stat in snapshot.statistics("lineno")[:top]:
+                print(f"  {stat}")
+
+
+@contextmanager
+def tracing_session(excel_path: str):
+    """
+    按 TRACE_CONFIG 为一次工作簿处理启用追踪：退出时打印各阶段汇总表并关闭追踪文件。
+    未启用时不做任何事。
+    """
+    global _active_tracer
+    if not TRACE_CONFIG.get("enabled"):
+        yield None
+        return
+
+    trace_path = TRACE_CONFIG.get("path")
+    if not trace_path:
+        base, _ = os.path.splitext(os.path.abspath(excel_path))
+        trace_path = f"{base}.trace.jsonl"
+    tracer = RunTracer(trace_path)
+    previous, _active_tracer = _active_tracer, tracer
+    try:
+        yield tracer
+    finally:
+        _active_tracer = previous
+        tracer.close()
+        if TRACE_CONFIG.get("summary", True):
+            tracer.print_summary()
+
+
 # --- 模块化的内容读取区域 ---
 # TODO: 这里可以添加更多的文件类型支持
 # 未来若要添加对新文件类型（例如 .csv）的支持:
@@ -79,9 +464,8 @@ def read_txt_content(file_path: str) -> str:
 def read_docx_content(file_path: str) -> str:
     """从 .docx 文件中读取内容。"""
     try:
-        doc = docx.Document(file_path)
-        full_text = [para.text for para in doc.paragraphs]
-        return "\n".join(full_text)
+        markdown_text, _ = parse_docx_archive(file_path)
+        return markdown_text
     except Exception as e:
         return f"读取 DOCX 文件 '{file_path}' 时出错: {e}"
 
@@ -89,36 +473,11 @@ def read_docx_content(file_path: str) -> str:
 def read_xlsx_content(file_path: str) -> str:
     """
     从 .xlsx 文件中的所有工作表读取可见的文本内容。
+    每个工作表按 XLSX_CONFIG 限制行数和字节数，只输出文本（图表摘要除外，不插入图片占位符）。
     """
     try:
-        # 以只读模式加载工作簿，这样性能更好，且不会意外修改文件
-        workbook = openpyxl.load_workbook(file_path, read_only=True)
-
-        all_sheets_text = []
-
-        # 遍历工作簿中的每一个工作表
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            sheet_text = []
-
-            # 添加工作表标题，以便区分不同工作表的内容
-            sheet_text.append(f"--- 工作表: {sheet.title} ---")
-
-            # 遍历工作表中的每一行
-            for row in sheet.iter_rows():
-                # 获取行中每个单元格的值，并转换为字符串，忽略空单元格
-                # str(cell.value) 可以安全地处理数字、日期等不同类型
-                row_values = [str(cell.value) for cell in row if cell.value is not None]
-
-                # 如果行中有内容，则将它们用制表符连接起来
-                if row_values:
-                    sheet_text.append("\t".join(row_values))
-
-            # 将当前工作表的所有文本行用换行符连接起来
-            all_sheets_text.append("\n".join(sheet_text))
-
-        # 将所有工作表的内容用两个换行符隔开，使其更清晰
-        return "\n\n".join(all_sheets_text)
+        markdown_text, _ = parse_xlsx_archive(file_path)
+        return markdown_text
 
     except FileNotFoundError:
         return f"错误：Excel 文件未找到 '{file_path}'"
@@ -157,94 +516,99 @@ def read_pptx_content(file_path: str) -> str:
         return f"读取 PPTX 文件 '{file_path}' 时出错: {error_msg}"
 
 
-def read_xmind_content(file_path: str) -> str:
+def parse_xmind_archive(
+    xmind_path: str, temp_manager: Optional[TempFileManager] = None
+) -> Tuple[str, List[str]]:
     """
-    从 .xmind 文件中读取文本内容。
-    直接解析 content.json 和 manifest.json，实现节点与图片的精确映射。
+    单次遍历XMind压缩包：读取一次 content.json，遍历一次主题树生成文本，
+    被引用的 resources/* 图片直接从压缩包读入内存后写入临时文件。
+    返回 (markdown_text, image_paths)。
+    temp_manager 为 None 时只生成文本，图片位置保留 [[IMAGE_PLACEHOLDER_hash]] 标记。
     """
-    try:
-        import zipfile
-        import json
-        import os
-        import re
+    image_paths = []
+    resource_paths: Dict[str, str] = {}
+
+    with zipfile.ZipFile(xmind_path, "r") as zip_ref:
+        content_data = json.loads(zip_ref.read("content.json").decode("utf-8"))
+        members = set(zip_ref.namelist())
+
+        def image_placeholder(image_src: str) -> Optional[str]:
+            resource_name = image_src.replace("xap:", "", 1)
+            file_name = os.path.basename(resource_name)
+            if temp_manager is None:
+                hash_name = os.path.splitext(file_name)[0]
+                return f"[[IMAGE_PLACEHOLDER_{hash_name[:16]}]]"
+
+            # 同一资源被多个节点引用时只读取一次，多个占位符指向同一张图片
+            if resource_name not in resource_paths:
+                if resource_name not in members:
+                    return None
+                temp_path = temp_manager.get_temp_path(suffix=f"_{file_name}")
+                with open(temp_path, "wb") as image_file:
+                    image_file.write(zip_ref.read(resource_name))
+                resource_paths[resource_name] = temp_path
+                image_paths.append(temp_path)
+            return f"![placeholder]({resource_paths[resource_name]})"
 
         def extract_text_recursive(topic_data, level=0):
             all_text = []
-            if isinstance(topic_data, dict):
-                if "title" in topic_data:
-                    indent = "  " * level
-                    title = topic_data["title"]
-                    if title and title.strip():
-                        all_text.append(f"{indent}- {title.strip()}")
-
-                        if "image" in topic_data and isinstance(
-                            topic_data["image"], dict
-                        ):
-                            image_src = topic_data["image"].get("src", "")
-                            if image_src and "resources/" in image_src:
-                                file_path = image_src.replace("xap:resources/", "")
-                                match = re.search(r"\.([a-zA-Z0-9]+)$", file_path)
-                                if match:
-                                    extension = match.group(1)
-                                    hash_name = file_path[: -len(extension) - 1]
-                                    resource_id = f"{hash_name}.{extension}"
-                                    placeholder = (
-                                        f"[[IMAGE_PLACEHOLDER_{hash_name[:16]}]]"
-                                    )
-                                    all_text.append(f"{indent}  {placeholder}")
-
-                if "note" in topic_data and topic_data["note"]:
-                    indent = "  " * level
-                    note = topic_data["note"]
-                    if note.strip():
-                        all_text.append(f"{indent}  注释: {note.strip()}")
-
-                if "labels" in topic_data and topic_data["labels"]:
-                    indent = "  " * level
-                    labels = topic_data["labels"]
-                    if labels:
-                        all_text.append(f"{indent}  标签: {', '.join(labels)}")
-
-                if "link" in topic_data and topic_data["link"]:
-                    indent = "  " * level
-                    link = topic_data["link"]
-                    if link.strip():
-                        all_text.append(f"{indent}  链接: {link.strip()}")
-
-                if "children" in topic_data and isinstance(
-                    topic_data["children"], dict
-                ):
-                    if "attached" in topic_data["children"]:
-                        for sub_topic in topic_data["children"]["attached"]:
-                            sub_text = extract_text_recursive(sub_topic, level + 1)
-                            all_text.extend(sub_text)
+            if not isinstance(topic_data, dict):
+                return all_text
+
+            indent = "  " * level
+            title = topic_data.get("title")
+            if title and title.strip():
+                all_text.append(f"{indent}- {title.strip()}")
+
+            image = topic_data.get("image")
+            if isinstance(image, dict):
+                image_src = image.get("src", "")
+                if image_src and "resources/" in image_src:
+                    placeholder = image_placeholder(image_src)
+                    if placeholder:
+                        all_text.append(f"{indent}  {placeholder}")
+
+            note = topic_data.get("note")
+            if isinstance(note, str) and note.strip():
+                all_text.append(f"{indent}  注释: {note.strip()}")
+
+            labels = topic_data.get("labels")
+            if labels:
+                all_text.append(f"{indent}  标签: {', '.join(labels)}")
+
+            link = topic_data.get("link")
+            if isinstance(link, str) and link.strip():
+                all_text.append(f"{indent}  链接: {link.strip()}")
+
+            children = topic_data.get("children")
+            if isinstance(children, dict):
+                for sub_topic in children.get("attached", []):
+                    all_text.extend(extract_text_recursive(sub_topic, level + 1))
 
             return all_text
 
-        with zipfile.ZipFile(file_path, "r") as zip_ref:
-            content_json = zip_ref.read("content.json").decode("utf-8")
-            content_data = json.loads(content_json)
-
-            try:
-                manifest_json = zip_ref.read("manifest.json").decode("utf-8")
-                manifest_data = json.loads(manifest_json)
-            except:
-                manifest_data = {}
+        all_text = []
+        if isinstance(content_data, list):
+            for sheet in content_data:
+                if "title" in sheet and sheet["title"]:
+                    all_text.append(f"# {sheet['title']} #\n")
+                else:
+                    all_text.append(f"\n=== 工作表 ===\n")
 
-            all_text = []
+                if "rootTopic" in sheet:
+                    all_text.extend(extract_text_recursive(sheet["rootTopic"]))
 
-            if isinstance(content_data, list):
-                for sheet in content_data:
-                    if "title" in sheet and sheet["title"]:
-                        all_text.append(f"# {sheet['title']} #\n")
-                    else:
-                        all_text.append(f"\n=== 工作表 ===\n")
+    return "\n".join(all_text), image_paths
 
-                    if "rootTopic" in sheet:
-                        topic_text = extract_text_recursive(sheet["rootTopic"])
-                        all_text.extend(topic_text)
 
-            return "\n".join(all_text) if all_text else "无法解析XMind文件内容"
+def read_xmind_content(file_path: str) -> str:
+    """
+    从 .xmind 文件中读取文本内容。
+    直接解析 content.json，实现节点与图片的精确映射。
+    """
+    try:
+        markdown_text, _ = parse_xmind_archive(file_path)
+        return markdown_text if markdown_text else "无法解析XMind文件内容"
 
     except FileNotFoundError:
         return f"错误：XMind 文件未找到 '{file_path}'"
@@ -257,18 +621,12 @@ def read_pdf_content(file_path: str) -> str:
     从 .pdf 文件中读取文本内容。
     """
     try:
-        import pdfplumber
-
-        # 抑制PDF字体警告
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            all_text = []
-            with pdfplumber.open(file_path) as pdf:
-                for page_num, page in enumerate(pdf.pages, 1):
-                    page_text = page.extract_text()
-                    if page_text:
-                        all_text.append(f"--- 第 {page_num} 页 ---\n{page_text}")
-
+        # 与 Markdown 转换共用页面数据，转换失败后回退到纯文本时不会再次提取
+        all_text = [
+            f"--- 第 {page_num} 页 ---\n{page_text}"
+            for page_num, page_text, _, _, _ in extract_pdf_pages(file_path)
+            if page_text
+        ]
         return "\n\n".join(all_text)
 
     except ImportError:
@@ -279,372 +637,1042 @@ def read_pdf_content(file_path: str) -> str:
         return f"读取 PDF 文件 '{file_path}' 时出错: {e}"
 
 
-# --- 图片提取功能 ---
-def extract_images_from_docx(
-    docx_path: str, temp_manager: TempFileManager
-) -> List[str]:
+# --- DOCX 单次解析引擎 ---
+# WordprocessingML 相关命名空间（使用 ElementTree 的 {uri}tag 形式）
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_A_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+_R_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_V_NS = "{urn:schemas-microsoft-com:vml}"
+_MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+_PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# 可以发送给多模态模型的图片格式
+DOCX_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp")
+
+
+def _read_part_relationships(
+    zip_ref: zipfile.ZipFile, part_name: str, include_external: bool = False
+) -> Dict[str, str]:
     """
-    从 DOCX 文件中提取所有嵌入的图片。
-    返回提取的图片路径列表。
+    读取 OPC 部件的关系文件（例如 word/_rels/document.xml.rels），
+    返回 {rId: 压缩包内的成员路径}。外部链接默认忽略，include_external=True 时原样返回其 Target。
     """
+    part_dir, part_file = posixpath.split(part_name)
+    rels_name = posixpath.join(part_dir, "_rels", f"{part_file}.rels")
     try:
-        import zipfile
-        import os
+        rels_root = ET.fromstring(zip_ref.read(rels_name))
+    except KeyError:
+        return {}
 
-        image_paths = []
-        docx_dir = tempfile.mkdtemp(prefix="docx_extract_")
+    relationships = {}
+    for rel in rels_root.iter(f"{_PKG_REL_NS}Relationship"):
+        target = rel.get("Target", "")
+        if rel.get("TargetMode") == "External":
+            if include_external:
+                relationships[rel.get("Id")] = target
+            continue
+        if target.startswith("/"):
+            member = target.lstrip("/")
+        else:
+            member = posixpath.normpath(posixpath.join(part_dir, target))
+        relationships[rel.get("Id")] = member
+    return relationships
+
+
+def _read_docx_heading_styles(zip_ref: zipfile.ZipFile) -> Dict[str, int]:
+    """从 word/styles.xml 中找出标题样式，返回 {styleId: 标题级别}。"""
+    try:
+        styles_root = ET.fromstring(zip_ref.read("word/styles.xml"))
+    except KeyError:
+        return {}
 
-        # DOCX 实际上是一个ZIP文件
-        with zipfile.ZipFile(docx_path, "r") as zip_ref:
-            zip_ref.extractall(docx_dir)
-            media_dir = os.path.join(docx_dir, "word", "media")
+    heading_styles = {}
+    for style in styles_root.iter(f"{_W_NS}style"):
+        name_elem = style.find(f"{_W_NS}name")
+        if name_elem is None:
+            continue
+        match = re.fullmatch(r"heading\s*(\d)", name_elem.get(f"{_W_NS}val", ""), re.I)
+        if match:
+            heading_styles[style.get(f"{_W_NS}styleId")] = int(match.group(1))
+    return heading_styles
 
-            if os.path.exists(media_dir):
-                for filename in os.listdir(media_dir):
-                    if any(
-                        filename.lower().endswith(ext)
-                        for ext in [".png", ".jpg", ".jpeg", ".gif", ".bmp"]
+
+def _render_markdown_table(rows: List[List[str]]) -> List[str]:
+    """把表格行渲染为Markdown表格，第一行作为表头。"""
+    if not rows:
+        return []
+    width = max(len(row) for row in rows)
+    if width == 0:
+        return []
+    lines = []
+    for row_idx, row in enumerate(rows):
+        cells = [cell.replace("|", "\\|") for cell in row] + [""] * (width - len(row))
+        lines.append("| " + " | ".join(cells) + " |")
+        if row_idx == 0:
+            lines.append("|" + " --- |" * width)
+    return lines
+
+
+def parse_docx_archive(
+    docx_path: str, temp_manager: Optional[TempFileManager] = None
+) -> Tuple[str, List[str]]:
+    """
+    单次流式解析 DOCX：用 iterparse 遍历一次 word/document.xml，按文档顺序输出标题、段落和表格。
+    图片通过 a:blip r:embed（以及旧式 v:imagedata r:id）经 document.xml.rels 解析到具体的媒体部件，
+    媒体字节在首次引用时才从压缩包读取；同一媒体被多次引用时只写出一份临时文件。
+    返回 (markdown_text, image_paths)。temp_manager 为 None 时只输出文本，不插入占位符。
+    """
+    markdown_lines = []
+    image_paths = []
+    media_paths: Dict[str, Optional[str]] = {}
+
+    with zipfile.ZipFile(docx_path, "r") as zip_ref:
+        relationships = _read_part_relationships(zip_ref, "word/document.xml")
+        heading_styles = _read_docx_heading_styles(zip_ref)
+
+        def resolve_image(rel_id: str) -> Optional[str]:
+            member = relationships.get(rel_id)
+            if member is None:
+                return None
+            if member not in media_paths:
+                media_paths[member] = None
+                filename = posixpath.basename(member)
+                if filename.lower().endswith(DOCX_IMAGE_EXTENSIONS):
+                    try:
+                        image_bytes = zip_ref.read(member)
+                    except KeyError:
+                        return None
+                    temp_path = temp_manager.get_temp_path(suffix=f"_{filename}")
+                    with open(temp_path, "wb") as image_file:
+                        image_file.write(image_bytes)
+                    media_paths[member] = temp_path
+                    image_paths.append(temp_path)
+            return media_paths[member]
+
+        def emit(kind: str, payload: Dict):
+            """把完成的段落/表格交给上一级容器；没有上一级时输出到Markdown。"""
+            if containers:
+                parent_kind, parent = containers[-1]
+                if parent_kind == "p":
+                    parent["text"].append(payload["text"])
+                    parent["images"].extend(payload["images"])
+                elif parent["cell"] is not None:
+                    parent["cell"].append(payload["text"])
+                    parent["images"].extend(payload["images"])
+                return
+
+            if kind == "p":
+                text = payload["text"]
+                if text:
+                    level = payload["heading"]
+                    if level:
+                        markdown_lines.append(f"{'#' * level} {text}\n")
+                    else:
+                        markdown_lines.append(text + "\n")
+            else:
+                table_lines = _render_markdown_table(payload["rows"])
+                if table_lines:
+                    markdown_lines.append("\n".join(table_lines) + "\n")
+            for image_path in payload["images"]:
+                markdown_lines.append(f"![placeholder]({image_path})\n")
+
+        # 容器栈：("p", 段落状态) 或 ("tbl", 表格状态)，用于处理表格和文本框中的嵌套段落
+        containers: List[Tuple[str, Dict]] = []
+        fallback_depth = 0
+
+        with zip_ref.open("word/document.xml") as document_xml:
+            for event, elem in ET.iterparse(document_xml, events=("start", "end")):
+                tag = elem.tag
+                if event == "start":
+                    if tag == _MC_FALLBACK:
+                        # 兼容性回退内容与 mc:Choice 重复，跳过以免图片被计算两次
+                        fallback_depth += 1
+                    elif tag == f"{_W_NS}p":
+                        containers.append(
+                            ("p", {"text": [], "images": [], "heading": 0})
+                        )
+                    elif tag == f"{_W_NS}tbl":
+                        containers.append(
+                            ("tbl", {"rows": [], "row": None, "cell": None, "images": []})
+                        )
+                    elif tag == f"{_W_NS}tr" and containers and containers[-1][0] == "tbl":
+                        containers[-1][1]["row"] = []
+                    elif tag == f"{_W_NS}tc" and containers and containers[-1][0] == "tbl":
+                        containers[-1][1]["cell"] = []
+                    elif fallback_depth == 0 and temp_manager is not None and (
+                        tag == f"{_A_NS}blip" or tag == f"{_V_NS}imagedata"
                     ):
-                        src_path = os.path.join(media_dir, filename)
-                        # 复制到临时目录
-                        temp_path = temp_manager.get_temp_path(suffix=f"_{filename}")
-                        shutil.copy2(src_path, temp_path)
-                        image_paths.append(temp_path)
+                        rel_id = elem.get(f"{_R_NS}embed") or elem.get(f"{_R_NS}id")
+                        image_path = resolve_image(rel_id) if rel_id else None
+                        if image_path and containers and containers[-1][0] == "p":
+                            containers[-1][1]["images"].append(image_path)
+                    continue
 
-        # 清理临时目录
-        shutil.rmtree(docx_dir, ignore_errors=True)
-        return image_paths
+                # end 事件
+                if tag == _MC_FALLBACK:
+                    fallback_depth -= 1
+                elif fallback_depth:
+                    continue
+                elif tag == f"{_W_NS}t":
+                    if elem.text and containers and containers[-1][0] == "p":
+                        containers[-1][1]["text"].append(elem.text)
+                elif tag == f"{_W_NS}tab":
+                    if containers and containers[-1][0] == "p":
+                        containers[-1][1]["text"].append("\t")
+                elif tag in (f"{_W_NS}br", f"{_W_NS}cr"):
+                    if containers and containers[-1][0] == "p":
+                        containers[-1][1]["text"].append("\n")
+                elif tag == f"{_W_NS}pStyle":
+                    if containers and containers[-1][0] == "p":
+                        containers[-1][1]["heading"] = heading_styles.get(
+                            elem.get(f"{_W_NS}val"), 0
+                        )
+                elif tag == f"{_W_NS}p":
+                    _, para = containers.pop()
+                    emit(
+                        "p",
+                        {
+                            "text": "".join(para["text"]).strip(),
+                            "images": para["images"],
+                            "heading": para["heading"],
+                        },
+                    )
+                    if not containers:
+                        elem.clear()
+                elif tag == f"{_W_NS}tc" and containers[-1][0] == "tbl":
+                    table = containers[-1][1]
+                    cell_text = " ".join(t for t in table["cell"] if t)
+                    table["row"].append(cell_text.replace("\n", " "))
+                    table["cell"] = None
+                elif tag == f"{_W_NS}tr" and containers[-1][0] == "tbl":
+                    table = containers[-1][1]
+                    table["rows"].append(table["row"])
+                    table["row"] = None
+                elif tag == f"{_W_NS}tbl":
+                    _, table = containers.pop()
+                    if containers:
+                        # 嵌套表格展开为纯文本放入上一级容器
+                        flat_text = "; ".join(
+                            " ".join(cell for cell in row if cell)
+                            for row in table["rows"]
+                        )
+                        emit("p", {"text": flat_text, "images": table["images"], "heading": 0})
+                    else:
+                        emit("tbl", table)
+                        elem.clear()
 
-    except Exception as e:
-        print(f"从DOCX提取图片时出错: {e}")
-        return []
+    return "\n".join(markdown_lines), image_paths
 
 
-def extract_images_from_pdf(pdf_path: str, temp_manager: TempFileManager) -> List[str]:
+# --- XLSX 流式解析 ---
+# SpreadsheetML 绘图和图表的命名空间
+_XDR_NS = "{http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing}"
+_C_NS = "{http://schemas.openxmlformats.org/drawingml/2006/chart}"
+
+
+def _read_xlsx_sheet_rows(sheet) -> List[str]:
     """
-    从 PDF 文件中提取图片。
-    返回提取的图片路径列表。
+    按行流式读取工作表（values_only，不创建单元格对象），每个非空行的值用制表符连接。
+    行数或 UTF-8 字节数达到 XLSX_CONFIG 的上限后不再保留：tail_rows 为 0 时立即停止读取，
+    否则继续扫描并保留最后 tail_rows 行。被省略的部分用截断标记代替。
     """
-    try:
-        # 尝试使用 pdf2image 将PDF转换为图片
-        from pdf2image import convert_from_path
+    max_rows = XLSX_CONFIG.get("max_rows_per_sheet") or 0
+    max_bytes = XLSX_CONFIG.get("max_bytes_per_sheet") or 0
+    tail_rows = max(0, XLSX_CONFIG.get("tail_rows") or 0)
+
+    head_lines: List[str] = []
+    tail_lines = deque(maxlen=tail_rows)
+    head_bytes = 0
+    truncated = False
+    skipped_rows = 0
+
+    for values in sheet.iter_rows(values_only=True):
+        # str() 可以安全地处理数字、日期等不同类型，空单元格忽略
+        row_values = [str(value) for value in values if value is not None]
+        if not row_values:
+            continue
+        line = "\t".join(row_values)
+
+        if not truncated:
+            line_bytes = len(line.encode("utf-8")) + 1
+            if (max_rows and len(head_lines) >= max_rows) or (
+                max_bytes and head_bytes + line_bytes > max_bytes
+            ):
+                truncated = True
+            else:
+                head_lines.append(line)
+                head_bytes += line_bytes
+                continue
 
-        images = convert_from_path(pdf_path)
-        image_paths = []
+        if not tail_rows:
+            break
+        if len(tail_lines) == tail_rows:
+            skipped_rows += 1
+        tail_lines.append(line)
 
-        for idx, img in enumerate(images):
-            temp_path = temp_manager.get_temp_path(suffix=f"_page_{idx+1}.png")
-            img.save(temp_path, "PNG")
-            image_paths.append(temp_path)
+    if not truncated:
+        return head_lines
 
-        return image_paths
+    if tail_rows:
+        marker = f"……（已截断：省略中间 {skipped_rows} 行）"
+    else:
+        # 只读模式下 max_row 来自工作表的 dimension 记录，可能缺失或包含空行
+        total_rows = sheet.max_row
+        marker = f"……（已截断：仅保留前 {len(head_lines)} 行"
+        marker += f"，工作表共约 {total_rows} 行）" if total_rows else "）"
+    return head_lines + [marker] + list(tail_lines)
 
-    except ImportError:
-        print("警告：需要安装 pdf2image 来处理PDF图片: pip install pdf2image")
-        print(
-            "     还需要安装 Poppler: https://pdf2image.readthedocs.io/en/latest/installation.html"
+
+def _read_xlsx_chart_summary(zip_ref: zipfile.ZipFile, chart_member: str) -> str:
+    """读取图表部件（xl/charts/chartN.xml）的标题和系列名，作为图表的文字摘要。"""
+    try:
+        chart_root = ET.fromstring(zip_ref.read(chart_member))
+    except (KeyError, ET.ParseError):
+        return ""
+
+    title = ""
+    title_elem = chart_root.find(f"{_C_NS}chart/{_C_NS}title")
+    if title_elem is not None:
+        title = "".join(t.text or "" for t in title_elem.iter(f"{_A_NS}t")).strip()
+
+    series_names = []
+    for series in chart_root.iter(f"{_C_NS}ser"):
+        tx_elem = series.find(f"{_C_NS}tx")
+        if tx_elem is None:
+            continue
+        name = "".join(v.text or "" for v in tx_elem.iter(f"{_C_NS}v")) or "".join(
+            t.text or "" for t in tx_elem.iter(f"{_A_NS}t")
         )
-        return []
-    except Exception as e:
-        print(f"从PDF提取图片时出错: {e}")
-        return []
+        if name.strip():
+            series_names.append(name.strip())
 
+    summary = title or "无标题"
+    if series_names:
+        summary += f" — 系列：{'、'.join(series_names)}"
+    return summary
 
-def extract_images_from_pptx(
-    pptx_path: str, temp_manager: TempFileManager
-) -> List[str]:
+
+def _iter_drawing_elements(elem: ET.Element) -> Iterator[ET.Element]:
+    """遍历绘图锚点下的元素，跳过 mc:Fallback（与 mc:Choice 重复）。"""
+    for child in elem:
+        if child.tag == _MC_FALLBACK:
+            continue
+        yield child
+        yield from _iter_drawing_elements(child)
+
+
+def _read_xlsx_drawings(
+    zip_ref: zipfile.ZipFile, temp_manager: Optional[TempFileManager] = None
+) -> Tuple[Dict[str, List[str]], List[str]]:
     """
-    从 PPTX 文件中提取所有嵌入的图片。
-    返回提取的图片路径列表。
+    按 workbook.xml → 工作表关系 → xl/drawings/drawingN.xml 的引用链，找出每个工作表中嵌入的图片和图表，
+    按锚点位置（先行后列）输出 Markdown 行：图片为位置说明加占位符（temp_manager 为 None 时只输出位置说明），
+    图表为标题和系列名摘要。同一媒体被多次引用时只写出一份临时文件。
+    返回 ({工作表名: [Markdown 行]}, image_paths)。
     """
+    from openpyxl.utils import get_column_letter
+
     try:
-        import zipfile
-        import os
+        workbook_root = ET.fromstring(zip_ref.read("xl/workbook.xml"))
+    except KeyError:
+        return {}, []
+    workbook_rels = _read_part_relationships(zip_ref, "xl/workbook.xml")
+
+    sheet_items: Dict[str, List[str]] = {}
+    image_paths: List[str] = []
+    media_paths: Dict[str, Optional[str]] = {}
+
+    def resolve_image(member: str) -> Optional[str]:
+        if member not in media_paths:
+            media_paths[member] = None
+            filename = posixpath.basename(member)
+            if temp_manager is not None and filename.lower().endswith(DOCX_IMAGE_EXTENSIONS):
+                try:
+                    image_bytes = zip_ref.read(member)
+                except KeyError:
+                    return None
+                temp_path = temp_manager.get_temp_path(suffix=f"_{filename}")
+                with open(temp_path, "wb") as image_file:
+                    image_file.write(image_bytes)
+                media_paths[member] = temp_path
+                image_paths.append(temp_path)
+        return media_paths[member]
+
+    for sheet_elem in workbook_root.iter(f"{_SHEET_NS}sheet"):
+        sheet_member = workbook_rels.get(sheet_elem.get(f"{_R_NS}id"))
+        if not sheet_member:
+            continue
+
+        anchored_items: List[Tuple[int, int, str]] = []
+        for drawing_member in _read_part_relationships(zip_ref, sheet_member).values():
+            # 批注使用的 vmlDrawing 也在 xl/drawings/ 下，但扩展名是 .vml
+            if not (drawing_member.startswith("xl/drawings/") and drawing_member.endswith(".xml")):
+                continue
+            try:
+                drawing_root = ET.fromstring(zip_ref.read(drawing_member))
+            except (KeyError, ET.ParseError):
+                continue
+            drawing_rels = _read_part_relationships(zip_ref, drawing_member)
+
+            for anchor in drawing_root:
+                position = anchor.find(f"{_XDR_NS}from")
+                row = int(position.findtext(f"{_XDR_NS}row", "0")) if position is not None else 0
+                col = int(position.findtext(f"{_XDR_NS}col", "0")) if position is not None else 0
+                cell = f"{get_column_letter(col + 1)}{row + 1}"
+
+                for elem in _iter_drawing_elements(anchor):
+                    if elem.tag == f"{_A_NS}blip":
+                        member = drawing_rels.get(elem.get(f"{_R_NS}embed"))
+                        if not member:
+                            continue
+                        image_path = resolve_image(member)
+                        if image_path:
+                            line = f"（图片位于 {cell}）\n![placeholder]({image_path})\n"
+                        else:
+                            line = f"[图片（位于 {cell}）]"
+                        anchored_items.append((row, col, line))
+                    elif elem.tag == f"{_C_NS}chart":
+                        member = drawing_rels.get(elem.get(f"{_R_NS}id"))
+                        if member:
+                            summary = _read_xlsx_chart_summary(zip_ref, member)
+                            anchored_items.append((row, col, f"[图表（位于 {cell}）：{summary}]"))
 
-        image_paths = []
-        pptx_dir = tempfile.mkdtemp(prefix="pptx_extract_")
+        if anchored_items:
+            anchored_items.sort(key=lambda item: (item[0], item[1]))
+            sheet_items[sheet_elem.get("name")] = [line for _, _, line in anchored_items]
 
-        # PPTX 实际上是一个ZIP文件
-        with zipfile.ZipFile(pptx_path, "r") as zip_ref:
-            zip_ref.extractall(pptx_dir)
-            media_dir = os.path.join(pptx_dir, "ppt", "media")
+    return sheet_items, image_paths
 
-            if os.path.exists(media_dir):
-                for filename in os.listdir(media_dir):
-                    if any(
-                        filename.lower().endswith(ext)
-                        for ext in [".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tiff"]
-                    ):
-                        src_path = os.path.join(media_dir, filename)
-                        # 复制到临时目录
-                        temp_path = temp_manager.get_temp_path(suffix=f"_{filename}")
-                        shutil.copy2(src_path, temp_path)
-                        image_paths.append(temp_path)
 
-        # 清理临时目录
-        shutil.rmtree(pptx_dir, ignore_errors=True)
-        return image_paths
+def parse_xlsx_archive(
+    xlsx_path: str, temp_manager: Optional[TempFileManager] = None
+) -> Tuple[str, List[str]]:
+    """
+    解析 XLSX 附件：每个工作表按 XLSX_CONFIG 流式读取单元格文本，
+    然后按位置列出工作表中嵌入的图片和图表（XLSX_CONFIG["extract_images"] 关闭时跳过）。
+    返回 (markdown_text, image_paths)。temp_manager 为 None 时只输出文本，不插入占位符。
+    """
+    import openpyxl
 
-    except Exception as e:
-        print(f"从PPTX提取图片时出错: {e}")
-        return []
+    sheet_items: Dict[str, List[str]] = {}
+    image_paths: List[str] = []
+    if XLSX_CONFIG.get("extract_images", True):
+        try:
+            with zipfile.ZipFile(xlsx_path, "r") as zip_ref:
+                sheet_items, image_paths = _read_xlsx_drawings(zip_ref, temp_manager)
+        except (zipfile.BadZipFile, ET.ParseError, ValueError) as e:
+            print(f"读取XLSX中的图片和图表时出错: {e}")
+
+    # 以只读模式加载工作簿，这样性能更好，且不会意外修改文件
+    workbook = openpyxl.load_workbook(xlsx_path, read_only=True)
+    try:
+        all_sheets_text = []
+        for sheet_name in workbook.sheetnames:
+            sheet = workbook[sheet_name]
+            # 添加工作表标题，以便区分不同工作表的内容
+            sheet_text = [f"--- 工作表: {sheet.title} ---"]
+            # 图表工作表（chartsheet）没有单元格
+            if hasattr(sheet, "iter_rows"):
+                sheet_text.extend(_read_xlsx_sheet_rows(sheet))
+            sheet_text.extend(sheet_items.get(sheet_name, []))
+            all_sheets_text.append("\n".join(sheet_text))
+    finally:
+        workbook.close()
 
+    # 将所有工作表的内容用两个换行符隔开，使其更清晰
+    return "\n\n".join(all_sheets_text), image_paths
 
-def extract_images_from_xmind(
-    xmind_path: str, temp_manager: TempFileManager
+
+# --- 图片提取功能 ---
+def extract_images_from_docx(
+    docx_path: str, temp_manager: TempFileManager
 ) -> List[str]:
     """
-    从 XMind 文件中提取嵌入的图片。
-    根据 content.json 中的节点信息，精确提取对应位置的图片。
+    从 DOCX 文件中提取正文引用的图片。
+    解析时同时生成带占位符的Markdown，暂存到 temp_manager 中供转换阶段使用。
     返回提取的图片路径列表。
     """
     try:
-        import zipfile
-        import json
-        import re
-        import os
-        import tempfile
+        markdown_text, image_paths = parse_docx_archive(docx_path, temp_manager)
+        temp_manager.parsed_documents[docx_path] = markdown_text
+        return image_paths
 
-        image_paths = []
-        temp_dir = tempfile.mkdtemp(prefix="xmind_images_")
+    except Exception as e:
+        print(f"从DOCX提取图片时出错: {e}")
+        return []
 
-        try:
-            with zipfile.ZipFile(xmind_path, "r") as zip_ref:
-                zip_ref.extractall(temp_dir)
 
-                try:
-                    content_json_path = os.path.join(temp_dir, "content.json")
-                    if os.path.exists(content_json_path):
-                        with open(content_json_path, "r", encoding="utf-8") as f:
-                            content_data = json.load(f)
-
-                        image_resources = set()
-
-                        def collect_images(topic_data):
-                            if isinstance(topic_data, dict):
-                                if "image" in topic_data and isinstance(
-                                    topic_data["image"], dict
-                                ):
-                                    image_src = topic_data["image"].get("src", "")
-                                    if image_src and "resources/" in image_src:
-                                        resource_path = image_src.replace(
-                                            "xap:resources/", ""
-                                        )
-                                        image_resources.add(resource_path)
-
-                                if "children" in topic_data and isinstance(
-                                    topic_data["children"], dict
-                                ):
-                                    if "attached" in topic_data["children"]:
-                                        for sub_topic in topic_data["children"][
-                                            "attached"
-                                        ]:
-                                            collect_images(sub_topic)
-
-                        if isinstance(content_data, list):
-                            for sheet in content_data:
-                                if "rootTopic" in sheet:
-                                    collect_images(sheet["rootTopic"])
-
-                        for resource_path in image_resources:
-                            full_path = os.path.join(
-                                temp_dir, "resources", os.path.basename(resource_path)
-                            )
-                            if os.path.exists(full_path):
-                                filename = os.path.basename(resource_path)
-                                temp_path = temp_manager.get_temp_path(
-                                    suffix=f"_{filename}"
-                                )
-                                shutil.copy2(full_path, temp_path)
-                                image_paths.append(temp_path)
-                    else:
-                        print("警告：content.json 未找到，使用传统方法提取所有图片")
+# PDF 图片文件名中编码了页码和页内序号，转换Markdown时据此定位占位符
+# 整页渲染: <uuid>_page_3.png；嵌入图片: <uuid>_page_3_img_2.png
+PDF_IMAGE_NAME_PATTERN = re.compile(
+    r"_page_(\d+)(?:_img_(\d+))?\.(?:png|jpg|jpeg|tif|tiff|ppm)$"
+)
 
-                except Exception as e:
-                    print(f"解析 content.json 时出错: {e}")
-                    print("回退到传统方法...")
-
-                    for root, dirs, files in os.walk(temp_dir):
-                        for filename in files:
-                            if any(
-                                filename.lower().endswith(ext)
-                                for ext in [
-                                    ".png",
-                                    ".jpg",
-                                    ".jpeg",
-                                    ".gif",
-                                    ".bmp",
-                                    ".tiff",
-                                    ".svg",
-                                ]
-                            ):
-                                src_path = os.path.join(root, filename)
-                                temp_path = temp_manager.get_temp_path(
-                                    suffix=f"_{filename}"
-                                )
-                                shutil.copy2(src_path, temp_path)
-                                image_paths.append(temp_path)
+# pdftoppm 输出文件名末尾的页码，例如 <uuid>-07.png
+_POPPLER_PAGE_NUMBER_PATTERN = re.compile(r"-(\d+)\.\w+$")
 
-        finally:
-            shutil.rmtree(temp_dir, ignore_errors=True)
 
-        return image_paths
+def _get_pdf_page_count(pdf_path: str) -> int:
+    """获取PDF页数，优先使用 poppler 的 pdfinfo，失败时回退到 pdfplumber。"""
+    try:
+        from pdf2image import pdfinfo_from_path
 
-    except Exception as e:
-        print(f"从XMind提取图片时出错: {e}")
-        return []
+        return int(pdfinfo_from_path(pdf_path)["Pages"])
+    except Exception:
+        import pdfplumber
 
+        with pdfplumber.open(pdf_path) as pdf:
+            return len(pdf.pages)
 
-def extract_images_from_document(
-    file_path: str, temp_manager: TempFileManager
-) -> List[str]:
+
+def iter_pdf_page_images(
+    pdf_path: str,
+    temp_manager: TempFileManager,
+    dpi: Optional[int] = None,
+    fmt: Optional[str] = None,
+    thread_count: Optional[int] = None,
+    max_pages_in_memory: Optional[int] = None,
+    page_numbers: Optional[List[int]] = None,
+) -> Iterator[Tuple[int, str]]:
     """
-    从任何支持的文档中提取图片。
+    按页码范围分批整页渲染PDF，逐页产出 (page_num, image_path)。
+    每批最多 max_pages_in_memory 页，poppler 直接把结果写入临时目录，
+    不会把整本PDF的页面同时加载为内存中的图片。
+    指定 page_numbers 时只渲染这些页，连续的页码合并为同一批。
     """
-    _, extension = os.path.splitext(file_path.lower())
-
-    if extension == ".docx":
-        return extract_images_from_docx(file_path, temp_manager)
-    elif extension == ".pdf":
-        return extract_images_from_pdf(file_path, temp_manager)
-    elif extension == ".pptx":
-        return extract_images_from_pptx(file_path, temp_manager)
-    elif extension == ".xmind":
-        return extract_images_from_xmind(file_path, temp_manager)
+    from pdf2image import convert_from_path
+
+    dpi = dpi or PDF_CONFIG.get("render_dpi", 200)
+    fmt = (fmt or PDF_CONFIG.get("render_format", "png")).lower()
+    thread_count = thread_count or PDF_CONFIG.get("render_threads", 1)
+    batch_size = max(1, max_pages_in_memory or PDF_CONFIG.get("max_pages_in_memory", 4))
+    extension = "jpg" if fmt in ("jpeg", "jpg") else fmt
+
+    if page_numbers is None:
+        page_count = _get_pdf_page_count(pdf_path)
+        batches = [
+            (first_page, min(first_page + batch_size - 1, page_count))
+            for first_page in range(1, page_count + 1, batch_size)
+        ]
     else:
-        return []
-
+        batches = []
+        for page_num in sorted(set(page_numbers)):
+            if batches and batches[-1][1] == page_num - 1 and page_num - batches[-1][0] < batch_size:
+                batches[-1] = (batches[-1][0], page_num)
+            else:
+                batches.append((page_num, page_num))
 
-# --- 文档转Markdown功能 ---
-def convert_docx_to_markdown_with_placeholders(
-    docx_path: str, image_paths: List[str], temp_manager: TempFileManager
-) -> str:
+    for first_page, last_page in batches:
+        batch_dir = tempfile.mkdtemp(prefix="pdf_pages_", dir=temp_manager.temp_dir)
+        try:
+            rendered_paths = convert_from_path(
+                pdf_path,
+                dpi=dpi,
+                fmt=fmt,
+                first_page=first_page,
+                last_page=last_page,
+                thread_count=thread_count,
+                output_folder=batch_dir,
+                paths_only=True,
+            )
+            for offset, rendered_path in enumerate(rendered_paths):
+                match = _POPPLER_PAGE_NUMBER_PATTERN.search(rendered_path)
+                page_num = int(match.group(1)) if match else first_page + offset
+                temp_path = temp_manager.get_temp_path(
+                    suffix=f"_page_{page_num}.{extension}"
+                )
+                os.replace(rendered_path, temp_path)
+                yield page_num, temp_path
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+
+def _pdf_page_image_boxes(page) -> List[Tuple[float, float, float, float]]:
     """
-    将DOCX转换为带占位符的Markdown。
-    通过XML解析检测图片在文档中的精确位置并插入占位符。
+    返回页面中嵌入图片的边界框 (x0, top, x1, bottom)。
+    边界框裁剪到页面范围内，忽略过小的图片，并按从上到下、从左到右排序。
+    """
+    min_size = PDF_CONFIG.get("min_image_size", 0)
+    page_x0, page_top, page_x1, page_bottom = page.bbox
+    boxes = []
+    for image in page.images or []:
+        x0 = max(float(image["x0"]), page_x0)
+        top = max(float(image["top"]), page_top)
+        x1 = min(float(image["x1"]), page_x1)
+        bottom = min(float(image["bottom"]), page_bottom)
+        if x1 - x0 < min_size or bottom - top < min_size:
+            continue
+        boxes.append((x0, top, x1, bottom))
+    return sorted(boxes, key=lambda box: (box[1], box[0]))
+
+
+def _pdf_page_is_scanned(page) -> bool:
+    """没有文本层的页面视为扫描页，需要整页渲染。"""
+    return not page.chars
+
+
+# --- PDF 页面文本提取 ---
+# 单页数据：(页码, 页面文本, 嵌入图片边界框, 文本行, 是否扫描页)
+# 文本行为 (top, text) 列表，只在页面有嵌入图片时提取，用于把占位符插入到对应位置
+PdfPageData = Tuple[
+    int, str, List[Tuple[float, float, float, float]], List[Tuple[float, str]], bool
+]
+
+# 最近提取过的PDF页面数据，键为 (绝对路径, 大小, 修改时间)
+_pdf_pages_cache: Dict[Tuple, List[PdfPageData]] = {}
+_PDF_PAGES_CACHE_SIZE = 2
+# 流水线中解析阶段和写回阶段（出错回退为纯文本时）可能同时访问缓存
+_pdf_pages_cache_lock = threading.Lock()
+
+# 当前进程是否为解析子进程（子进程中不再嵌套并行提取）
+_in_parse_worker = False
+
+
+def _extract_pdf_page_range(pdf_path: str, first_page: int, last_page: int) -> List[PdfPageData]:
+    """提取 first_page 到 last_page（含）各页的文本和图片位置，可在解析子进程中运行。"""
+    import pdfplumber
+
+    pages = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        with pdfplumber.open(pdf_path) as pdf:
+            for page_num in range(first_page, last_page + 1):
+                page = pdf.pages[page_num - 1]
+                boxes = _pdf_page_image_boxes(page)
+                text_lines = (
+                    [(float(line["top"]), line["text"]) for line in page.extract_text_lines()]
+                    if boxes
+                    else []
+                )
+                pages.append(
+                    (
+                        page_num,
+                        page.extract_text() or "",
+                        boxes,
+                        text_lines,
+                        _pdf_page_is_scanned(page),
+                    )
+                )
+                _release_pdf_page(page)
+    return pages
+
+
+def _release_pdf_page(page):
+    """
+    释放页面解析出的字符、版面对象和文本布局缓存，长文档不会把所有页面都留在内存中。
+    pdfplumber 的 flush_cache 不清理 extract_text 使用的 get_textmap 缓存，需要单独清空。
+    """
+    page.flush_cache()
+    get_textmap = getattr(page, "get_textmap", None)
+    if hasattr(get_textmap, "cache_clear"):
+        get_textmap.cache_clear()
+
+
+def _get_pdf_text_workers(page_count: int) -> int:
+    """
+    页面文本提取使用的进程数：页数未达阈值、禁用并行、已在解析子进程中，
+    或配置为单进程解析（parse_workers 为 1）且没有已创建的解析进程池时为 1。
+    """
+    workers = PDF_CONFIG.get("text_workers", 1)
+    if workers <= 1 or _in_parse_worker:
+        return 1
+    if _parse_pool is None and PROCESSING_CONFIG.get("parse_workers", 1) <= 1:
+        return 1
+    if page_count < PDF_CONFIG.get("parallel_min_pages", 150):
+        return 1
+    pages_per_task = max(1, PDF_CONFIG.get("pages_per_task", 25))
+    return min(workers, -(-page_count // pages_per_task))
+
+
+def is_page_parallel_pdf(file_path: str) -> bool:
+    """
+    文档是否为需要按页码范围并行提取的大型PDF。多进程解析工作簿时，这类文档在主进程中解析，
+    由 extract_pdf_pages 把页码范围分发给解析进程池，而不是整本交给一个子进程串行提取。
     """
+    if not file_path.lower().endswith(".pdf") or PDF_CONFIG.get("text_workers", 1) <= 1:
+        return False
     try:
-        import zipfile
-        import xml.etree.ElementTree as ET
+        return _get_pdf_page_count(file_path) >= PDF_CONFIG.get("parallel_min_pages", 150)
+    except Exception:
+        return False
 
-        # 使用python-docx读取文档
-        doc = docx.Document(docx_path)
 
-        markdown_lines = []
-        image_idx = 0
+def extract_pdf_pages(pdf_path: str) -> List[PdfPageData]:
+    """
+    提取PDF每一页的文本和嵌入图片位置，按页码顺序返回。
+    页数达到 PDF_CONFIG["parallel_min_pages"] 时按 pages_per_task 切分页码范围，
+    交给解析进程池并行提取，每个子进程独立打开文件；并行失败时回退为单进程提取。
+    结果按文件指纹缓存，Markdown 转换和纯文本读取共用同一份页面数据。
+    """
+    fingerprint = get_file_fingerprint(pdf_path)
+    cache_key = (
+        (fingerprint["path"], fingerprint["size"], fingerprint["mtime_ns"])
+        if fingerprint
+        else None
+    )
+    if cache_key is not None:
+        with _pdf_pages_cache_lock:
+            cached = _pdf_pages_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    page_count = _get_pdf_page_count(pdf_path)
+    workers = _get_pdf_text_workers(page_count)
+    with trace_span("extract_pdf_text", file=pdf_path, pages=page_count, workers=workers):
+        pages = None
+        if workers > 1:
+            pages_per_task = max(1, PDF_CONFIG.get("pages_per_task", 25))
+            try:
+                executor = get_parse_pool(workers)
+                futures = [
+                    executor.submit(
+                        _extract_pdf_page_range,
+                        pdf_path,
+                        first_page,
+                        min(first_page + pages_per_task - 1, page_count),
+                    )
+                    for first_page in range(1, page_count + 1, pages_per_task)
+                ]
+                pages = [page for future in futures for page in future.result()]
+            except Exception as e:
+                print(f"    并行提取PDF文本失败，改为单进程提取: {e}")
+        if pages is None:
+            pages = _extract_pdf_page_range(pdf_path, 1, page_count)
+
+    if cache_key is not None:
+        with _pdf_pages_cache_lock:
+            _pdf_pages_cache.pop(cache_key, None)
+            while len(_pdf_pages_cache) >= _PDF_PAGES_CACHE_SIZE:
+                _pdf_pages_cache.pop(next(iter(_pdf_pages_cache)))
+            _pdf_pages_cache[cache_key] = pages
+    return pages
+
+
+def _render_pdf_pages_with_pdfplumber(
+    pdf_path: str, temp_manager: TempFileManager, page_numbers: List[int]
+) -> Iterator[Tuple[int, str]]:
+    """用 pdfplumber 逐页整页渲染指定页，产出 (page_num, image_path)；每页渲染后立即释放页面缓存。"""
+    import pdfplumber
+
+    render_dpi = PDF_CONFIG.get("render_dpi", 200)
+    fmt = PDF_CONFIG.get("render_format", "png").lower()
+    extension = "jpg" if fmt in ("jpeg", "jpg") else fmt
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        with pdfplumber.open(pdf_path) as pdf:
+            for page_num in page_numbers:
+                page = pdf.pages[page_num - 1]
+                try:
+                    temp_path = temp_manager.get_temp_path(suffix=f"_page_{page_num}.{extension}")
+                    image = page.to_image(resolution=render_dpi).original
+                    if extension == "jpg":
+                        image = image.convert("RGB")
+                    image.save(temp_path, "JPEG" if extension == "jpg" else extension.upper())
+                    yield page_num, temp_path
+                except Exception as e:
+                    print(f"渲染PDF第 {page_num} 页时出错: {e}")
+                finally:
+                    _release_pdf_page(page)
 
-        # 通过XML解析来精确检测图片位置
-        docx_zip = zipfile.ZipFile(docx_path)
-        document_xml = docx_zip.read("word/document.xml")
-        root = ET.fromstring(document_xml)
-
-        # 定义命名空间
-        ns = {
-            "w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main",
-            "wp": "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing",
-            "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
-            "pic": "http://schemas.openxmlformats.org/drawingml/2006/picture",
-        }
 
-        # 查找所有图片及其位置
-        image_positions = []
-        for idx, para in enumerate(root.findall(".//w:p", ns)):
-            # 检查此段落是否包含图片 - 使用多种方式检测
-            # 方式1: 检查wp:docPr (drawing properties)
-            has_image1 = para.find(".//wp:docPr", ns) is not None
-            # 方式2: 检查a:blip (bitmap image)
-            has_image2 = para.find(".//a:blip", ns) is not None
-            # 方式3: 检查pic:pic (picture)
-            has_image3 = para.find(".//pic:pic", ns) is not None
-
-            has_image = has_image1 or has_image2 or has_image3
-
-            if has_image:
-                image_positions.append(idx)
-
-        docx_zip.close()
-
-        # 使用精确插入
-        for para_idx, para in enumerate(doc.paragraphs):
-            text = para.text.strip()
-            if text:
-                if para.style.name.startswith("Heading"):
-                    level = para.style.name.replace("Heading ", "")
-                    markdown_lines.append(f"{'#' * int(level)} {text}\n")
-                else:
-                    markdown_lines.append(text + "\n")
+def extract_embedded_images_from_pdf(
+    pdf_path: str, temp_manager: TempFileManager
+) -> List[str]:
+    """
+    从 PDF 文件中裁剪嵌入的图片对象；没有文本层的扫描页整页渲染。
+    图片位置和扫描页标记取自 extract_pdf_pages 的页面数据（与Markdown转换共用），
+    这里只重新打开需要裁剪的页面；扫描页交给 iter_pdf_page_images 分批渲染，
+    与 page 模式一样遵循 render_format、render_threads 和 max_pages_in_memory。
+    返回提取的图片路径列表（按页码排序）。
+    """
+    import pdfplumber
 
-            # 如果当前段落有图片，插入占位符
-            if para_idx in image_positions and image_idx < len(image_paths):
-                markdown_lines.append(f"![placeholder]({image_paths[image_idx]})\n")
-                image_idx += 1
+    crop_resolution = PDF_CONFIG.get("crop_resolution", 150)
+    images_by_page: Dict[int, List[str]] = {}
 
-        # 如果还有剩余图片，追加到末尾
-        while image_idx < len(image_paths):
-            markdown_lines.append(f"![placeholder]({image_paths[image_idx]})\n")
-            image_idx += 1
+    pages = extract_pdf_pages(pdf_path)
+    crop_pages = [(page_num, boxes) for page_num, _, boxes, _, scanned in pages if boxes and not scanned]
+    scanned_pages = [page_num for page_num, _, _, _, scanned in pages if scanned]
 
-        return "\n".join(markdown_lines)
+    if crop_pages:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            with pdfplumber.open(pdf_path) as pdf:
+                for page_num, boxes in crop_pages:
+                    page = pdf.pages[page_num - 1]
+                    try:
+                        for img_idx, bbox in enumerate(boxes, 1):
+                            try:
+                                cropped = page.crop(bbox).to_image(resolution=crop_resolution)
+                                temp_path = temp_manager.get_temp_path(
+                                    suffix=f"_page_{page_num}_img_{img_idx}.png"
+                                )
+                                cropped.original.save(temp_path, "PNG")
+                                images_by_page.setdefault(page_num, []).append(temp_path)
+                            except Exception as e:
+                                print(f"裁剪PDF第 {page_num} 页图片 {img_idx} 时出错: {e}")
+                    finally:
+                        _release_pdf_page(page)
+
+    if scanned_pages:
+        try:
+            for page_num, temp_path in iter_pdf_page_images(
+                pdf_path, temp_manager, page_numbers=scanned_pages
+            ):
+                images_by_page.setdefault(page_num, []).append(temp_path)
+        except Exception as e:
+            # 没有 pdf2image/poppler 时退回 pdfplumber 逐页渲染尚未得到的扫描页
+            remaining = [page_num for page_num in scanned_pages if page_num not in images_by_page]
+            print(f"分批渲染PDF扫描页失败，改用 pdfplumber 渲染 {len(remaining)} 页: {e}")
+            for page_num, temp_path in _render_pdf_pages_with_pdfplumber(
+                pdf_path, temp_manager, remaining
+            ):
+                images_by_page.setdefault(page_num, []).append(temp_path)
+
+    return [path for page_num in sorted(images_by_page) for path in images_by_page[page_num]]
+
+
+def extract_images_from_pdf(pdf_path: str, temp_manager: TempFileManager) -> List[str]:
+    """
+    从 PDF 文件中提取图片。
+    返回提取的图片路径列表。
+    PDF_CONFIG["image_mode"] 为 "embedded" 时只提取嵌入图片，为 "page" 时整页渲染。
+    """
+    try:
+        if PDF_CONFIG.get("image_mode") == "embedded":
+            return extract_embedded_images_from_pdf(pdf_path, temp_manager)
+
+        # 尝试使用 pdf2image 将PDF分批转换为图片。prepare_document 需要完整的图片列表来生成占位符，
+        # 这里收集全部页面后再返回：分批只限制渲染时的内存，所有页面图片仍会同时留在临时目录中
+        return [
+            image_path
+            for _, image_path in iter_pdf_page_images(pdf_path, temp_manager)
+        ]
 
+    except ImportError:
+        print("警告：需要安装 pdf2image 来处理PDF图片: pip install pdf2image")
+        print(
+            "     还需要安装 Poppler: https://pdf2image.readthedocs.io/en/latest/installation.html"
+        )
+        return []
     except Exception as e:
-        return f"转换DOCX时出错: {e}"
+        print(f"从PDF提取图片时出错: {e}")
+        return []
 
 
-def convert_pdf_to_markdown_with_placeholders(
-    pdf_path: str, image_paths: List[str]
-) -> str:
+def extract_images_from_pptx(
+    pptx_path: str, temp_manager: TempFileManager
+) -> List[str]:
     """
-    将PDF转换为带占位符的Markdown。
-    通过页面图片检测功能检测页面中的图片位置并插入占位符。
+    从 PPTX 文件中提取所有嵌入的图片。
+    返回提取的图片路径列表。
     """
     try:
-        import pdfplumber
+        image_paths = []
+        pptx_dir = tempfile.mkdtemp(prefix="pptx_extract_")
 
-        # 抑制PDF字体警告
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            markdown_lines = []
-            image_idx = 0
+        # PPTX 实际上是一个ZIP文件
+        with zipfile.ZipFile(pptx_path, "r") as zip_ref:
+            zip_ref.extractall(pptx_dir)
+            media_dir = os.path.join(pptx_dir, "ppt", "media")
 
-            with pdfplumber.open(pdf_path) as pdf:
-                page_texts = []
-                page_image_counts = []
+            if os.path.exists(media_dir):
+                for filename in os.listdir(media_dir):
+                    if any(
+                        filename.lower().endswith(ext)
+                        for ext in [".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tiff"]
+                    ):
+                        src_path = os.path.join(media_dir, filename)
+                        # 复制到临时目录
+                        temp_path = temp_manager.get_temp_path(suffix=f"_{filename}")
+                        shutil.copy2(src_path, temp_path)
+                        image_paths.append(temp_path)
 
-                # 提取所有页面的文本和图片信息
-                for page_num, page in enumerate(pdf.pages, 1):
-                    page_text = page.extract_text()
-                    page_texts.append(page_text if page_text else "")
+        # 清理临时目录
+        shutil.rmtree(pptx_dir, ignore_errors=True)
+        return image_paths
 
-                    # 检测页面中的图片数量
-                    image_count = 0
-                    if hasattr(page, "images") and page.images:
-                        image_count = len(page.images)
+    except Exception as e:
+        print(f"从PPTX提取图片时出错: {e}")
+        return []
 
-                    page_image_counts.append(image_count)
 
-                # 生成Markdown，按检测到的图片位置插入
-                for page_num, (page_text, image_count) in enumerate(
-                    zip(page_texts, page_image_counts), 1
-                ):
-                    markdown_lines.append(f"--- 第 {page_num} 页 ---\n")
-                    if page_text:
-                        markdown_lines.append(page_text)
-
-                    # 如果检测到页面有图片，插入相应数量的占位符
-                    if image_count > 0 and image_idx < len(image_paths):
-                        for _ in range(image_count):
-                            if image_idx < len(image_paths):
-                                markdown_lines.append(
-                                    f"\n![placeholder]({image_paths[image_idx]})\n"
-                                )
-                                image_idx += 1
+def extract_images_from_xmind(
+    xmind_path: str, temp_manager: TempFileManager
+) -> List[str]:
+    """
+    从 XMind 文件中提取嵌入的图片。
+    根据 content.json 中的节点信息，精确提取对应位置的图片，
+    同时生成的Markdown暂存到 temp_manager 中供转换阶段使用。
+    返回提取的图片路径列表。
+    """
+    try:
+        try:
+            markdown_text, image_paths = parse_xmind_archive(xmind_path, temp_manager)
+            temp_manager.parsed_documents[xmind_path] = markdown_text
+            return image_paths
+
+        except (KeyError, ValueError) as e:
+            print(f"解析 content.json 时出错: {e}")
+            print("回退到传统方法...")
+
+            # 直接从压缩包中读取所有图片
+            image_paths = []
+            with zipfile.ZipFile(xmind_path, "r") as zip_ref:
+                for member in zip_ref.namelist():
+                    filename = os.path.basename(member)
+                    if filename and any(
+                        filename.lower().endswith(ext)
+                        for ext in [
+                            ".png",
+                            ".jpg",
+                            ".jpeg",
+                            ".gif",
+                            ".bmp",
+                            ".tiff",
+                            ".svg",
+                        ]
+                    ):
+                        temp_path = temp_manager.get_temp_path(suffix=f"_{filename}")
+                        with open(temp_path, "wb") as image_file:
+                            image_file.write(zip_ref.read(member))
+                        image_paths.append(temp_path)
+            return image_paths
+
+    except Exception as e:
+        print(f"从XMind提取图片时出错: {e}")
+        return []
 
-                # 如果还有剩余图片，追加到最后一页
-                while image_idx < len(image_paths):
-                    markdown_lines.append(
-                        f"\n![placeholder]({image_paths[image_idx]})\n"
-                    )
-                    image_idx += 1
+
+def extract_images_from_xlsx(
+    xlsx_path: str, temp_manager: TempFileManager
+) -> List[str]:
+    """
+    从 XLSX 文件中提取工作表里嵌入的图片。
+    解析时同时生成带占位符的Markdown，暂存到 temp_manager 中供转换阶段使用。
+    返回提取的图片路径列表。
+    """
+    try:
+        markdown_text, image_paths = parse_xlsx_archive(xlsx_path, temp_manager)
+        temp_manager.parsed_documents[xlsx_path] = markdown_text
+        return image_paths
+
+    except Exception as e:
+        print(f"从XLSX提取图片时出错: {e}")
+        return []
+
+
+def extract_images_from_document(
+    file_path: str, temp_manager: TempFileManager
+) -> List[str]:
+    """
+    从任何支持的文档中提取图片。
+    """
+    _, extension = os.path.splitext(file_path.lower())
+
+    if extension == ".docx":
+        return extract_images_from_docx(file_path, temp_manager)
+    elif extension == ".pdf":
+        return extract_images_from_pdf(file_path, temp_manager)
+    elif extension == ".pptx":
+        return extract_images_from_pptx(file_path, temp_manager)
+    elif extension == ".xmind":
+        return extract_images_from_xmind(file_path, temp_manager)
+    elif extension == ".xlsx":
+        return extract_images_from_xlsx(file_path, temp_manager)
+    else:
+        return []
+
+
+# --- 文档转Markdown功能 ---
+def convert_docx_to_markdown_with_placeholders(
+    docx_path: str, image_paths: List[str], temp_manager: TempFileManager
+) -> str:
+    """
+    将DOCX转换为带占位符的Markdown。
+    占位符已在提取图片时按关系映射插入到图片所在段落之后，这里直接复用解析结果。
+    """
+    try:
+        markdown_text = temp_manager.parsed_documents.pop(docx_path, None)
+        if markdown_text is not None:
+            return markdown_text
+
+        # 没有缓存的解析结果时，只解析文本并把图片追加到末尾
+        markdown_text, _ = parse_docx_archive(docx_path)
+        markdown_lines = [markdown_text] if markdown_text else []
+        for image_path in image_paths:
+            markdown_lines.append(f"![placeholder]({image_path})\n")
+        return "\n".join(markdown_lines)
+
+    except Exception as e:
+        return f"转换DOCX时出错: {e}"
+
+
+def convert_pdf_to_markdown_with_placeholders(
+    pdf_path: str, image_paths: List[str]
+) -> str:
+    """
+    将PDF转换为带占位符的Markdown。
+    根据图片文件名中的页码把占位符放到对应页面：
+    嵌入图片按其在页面上的纵向位置插入到文本行之间，整页渲染图放在该页开头。
+    """
+    try:
+        # 按页码归类图片
+        page_images: Dict[int, List[Tuple[Optional[int], str]]] = {}
+        unmatched_images = []
+        for image_path in image_paths:
+            match = PDF_IMAGE_NAME_PATTERN.search(os.path.basename(image_path))
+            if match:
+                img_idx = int(match.group(2)) if match.group(2) else None
+                page_images.setdefault(int(match.group(1)), []).append(
+                    (img_idx, image_path)
+                )
+            else:
+                unmatched_images.append(image_path)
+
+        markdown_lines = []
+        for page_num, page_text, boxes, text_lines, _ in extract_pdf_pages(pdf_path):
+            markdown_lines.append(f"--- 第 {page_num} 页 ---\n")
+            images = page_images.pop(page_num, [])
+
+            # 整页渲染图放在页首
+            for img_idx, image_path in images:
+                if img_idx is None:
+                    markdown_lines.append(f"\n![placeholder]({image_path})\n")
+
+            embedded = [(i, path) for i, path in images if i is not None]
+            if not embedded:
+                if page_text:
+                    markdown_lines.append(page_text)
+                continue
+
+            # 嵌入图片按纵向位置插入到文本行之间
+            positioned = sorted(
+                (
+                    boxes[i - 1][1] if i <= len(boxes) else float("inf"),
+                    path,
+                )
+                for i, path in embedded
+            )
+            text_block = []
+            for top, line_text in text_lines:
+                while positioned and positioned[0][0] <= top:
+                    if text_block:
+                        markdown_lines.append("\n".join(text_block))
+                        text_block = []
+                    markdown_lines.append(f"\n![placeholder]({positioned.pop(0)[1]})\n")
+                text_block.append(line_text)
+            if text_block:
+                markdown_lines.append("\n".join(text_block))
+            elif not text_lines and page_text:
+                markdown_lines.append(page_text)
+            for _, image_path in positioned:
+                markdown_lines.append(f"\n![placeholder]({image_path})\n")
+
+        # 无法定位页码的图片追加到最后
+        leftovers = [path for images in page_images.values() for _, path in images]
+        for image_path in leftovers + unmatched_images:
+            markdown_lines.append(f"\n![placeholder]({image_path})\n")
 
         return "\n\n".join(markdown_lines)
 
@@ -711,15 +1739,17 @@ def convert_xmind_to_markdown_with_placeholders(
 ) -> str:
     """
     将XMind转换为带占位符的Markdown。
-    直接使用 read_xmind_content 返回的内容，保留占位符在正确位置。
+    优先使用提取图片时已生成的内容（占位符已在正确位置），无需再次解析压缩包。
     """
     try:
-        # 直接调用 read_xmind_content 获取已经包含占位符的内容
+        markdown_text = temp_manager.parsed_documents.pop(xmind_path, None)
+        if markdown_text is not None:
+            return markdown_text
+
+        # 没有缓存的解析结果时，重新读取并按顺序映射占位符
         markdown_text = read_xmind_content(xmind_path)
 
         # 只需要将 [[IMAGE_PLACEHOLDER_hash]] 格式转换为 ![placeholder](path) 格式
-        import re
-
         placeholder_pattern = r"\[\[IMAGE_PLACEHOLDER_([a-fA-F0-9]+)\]\]"
 
         # 按顺序替换每个占位符
@@ -741,12 +1771,39 @@ def convert_xmind_to_markdown_with_placeholders(
         # 执行替换（保持占位符在原位置）
         result = re.sub(placeholder_pattern, replace_placeholder, markdown_text)
 
+        # 如果还有剩余图片，追加到末尾
+        for image_path in image_paths[image_idx:]:
+            result += f"\n![placeholder]({image_path})\n"
+
         return result
 
     except Exception as e:
         return f"转换XMind时出错: {e}"
 
 
+def convert_xlsx_to_markdown_with_placeholders(
+    xlsx_path: str, image_paths: List[str], temp_manager: TempFileManager
+) -> str:
+    """
+    将XLSX转换为带占位符的Markdown。
+    占位符已在提取图片时按锚点位置插入到所在工作表的内容之后，这里直接复用解析结果。
+    """
+    try:
+        markdown_text = temp_manager.parsed_documents.pop(xlsx_path, None)
+        if markdown_text is not None:
+            return markdown_text
+
+        # 没有缓存的解析结果时，只解析文本并把图片追加到末尾
+        markdown_text, _ = parse_xlsx_archive(xlsx_path)
+        markdown_lines = [markdown_text] if markdown_text else []
+        for image_path in image_paths:
+            markdown_lines.append(f"![placeholder]({image_path})\n")
+        return "\n".join(markdown_lines)
+
+    except Exception as e:
+        return f"转换XLSX时出错: {e}"
+
+
 def convert_to_markdown_with_placeholders(
     file_path: str, image_paths: List[str], temp_manager: TempFileManager
 ) -> str:
@@ -769,6 +1826,10 @@ def convert_to_markdown_with_placeholders(
         return convert_xmind_to_markdown_with_placeholders(
             file_path, image_paths, temp_manager
         )
+    elif extension == ".xlsx":
+        return convert_xlsx_to_markdown_with_placeholders(
+            file_path, image_paths, temp_manager
+        )
     else:
         # 对于其他类型，使用原始文本（暂时不支持图片占位符）
         return get_content_from_file(file_path)
@@ -786,121 +1847,1297 @@ FILE_READERS = {
 }
 
 
-# --- 多模态LLM调用功能 ---
-def encode_image_to_base64(image_path: str) -> str:
+# --- 图片描述缓存 ---
+class ImageDescriptionCache:
     """
-    将图片文件编码为base64字符串。
+    基于SQLite的图片描述持久化缓存。
+    键为 图片字节哈希 + 模型名 + prompt + max_tokens，支持按条数/时间淘汰并统计命中率。
     """
-    try:
-        with open(image_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
-            return encoded_string
-    except Exception as e:
-        print(f"编码图片时出错 {image_path}: {e}")
-        return ""
 
+    def __init__(
+        self,
+        db_path: str,
+        max_entries: Optional[int] = None,
+        max_age_days: Optional[float] = None,
+    ):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 86400 if max_age_days else None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # 命中时的最近使用时间先记在内存中，淘汰或关闭时一次性写入，查询不触发写事务
+        self._pending_last_used: Dict[str, float] = {}
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        # 允许多个分析线程共用同一连接，访问由 self._lock 串行化
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS image_descriptions ("
+            " key TEXT PRIMARY KEY,"
+            " description TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_image_descriptions_last_used"
+            " ON image_descriptions (last_used)"
+        )
+        self._conn.commit()
 
-def analyze_images_with_qwen_vl(image_paths: List[str]) -> Dict[str, str]:
-    """
-    使用qwen-vl模型分析图片并返回描述结果。
-    返回字典: {image_path: description}
-    策略：为每张图片单独调用LLM，确保每张图片都能正确解析
-    """
-    try:
-        # 检查API配置
-        if (
-            QWEN_VL_CONFIG["api_key"] == "YOUR_API_KEY_HERE"
-            or not QWEN_VL_CONFIG["api_key"]
-        ):
-            print("警告：请先配置QWEN_VL_CONFIG中的API密钥")
-            return {}
+    @staticmethod
+    def image_digest(image_path: str) -> Optional[bytes]:
+        """分块读取图片文件并返回其 SHA-256 摘要，读取失败返回 None。"""
+        digest = hashlib.sha256()
+        try:
+            with open(image_path, "rb") as image_file:
+                for chunk in iter(lambda: image_file.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        except OSError:
+            return None
+        return digest.digest()
+
+    @staticmethod
+    def make_key(image_digest: bytes, model: str, prompt: str, max_tokens: int) -> str:
+        """根据图片内容摘要和请求参数生成缓存键。"""
+        digest = hashlib.sha256()
+        digest.update(image_digest)
+        digest.update(f"\0{model}\0{max_tokens}\0{prompt}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def key_for_digest(self, image_digest: bytes, prompt: Optional[str] = None) -> str:
+        """
+        生成当前 QWEN_VL_CONFIG 下的缓存键。同一张图片需要多个键时先用 image_digest 求一次摘要。
+        prompt 为实际发送的提示词，默认为单图 prompt；批量请求得到的描述使用 batch_prompt 生成的键。
+        """
+        return self.make_key(
+            image_digest,
+            QWEN_VL_CONFIG["model"],
+            prompt if prompt is not None else QWEN_VL_CONFIG["prompt"],
+            QWEN_VL_CONFIG["max_tokens"],
+        )
 
-        # 初始化OpenAI客户端（使用通义千问的base_url）
-        client = OpenAI(
-            api_key=QWEN_VL_CONFIG["api_key"], base_url=QWEN_VL_CONFIG["base_url"]
+    def get(self, key: str) -> Optional[str]:
+        """查询缓存，命中时记录最近使用时间（在 flush / evict / close 时批量写入）。"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT description, created_at FROM image_descriptions WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None or (
+                self.max_age_seconds and now - row[1] > self.max_age_seconds
+            ):
+                self.misses += 1
+                return None
+            self._pending_last_used[key] = now
+            self.hits += 1
+            return row[0]
+
+    def _flush_last_used_locked(self):
+        if not self._pending_last_used:
+            return
+        self._conn.executemany(
+            "UPDATE image_descriptions SET last_used = ? WHERE key = ?",
+            [(used, key) for key, used in self._pending_last_used.items()],
         )
+        self._pending_last_used.clear()
+
+    def flush(self):
+        """把内存中记录的最近使用时间写入数据库。"""
+        with self._lock:
+            self._flush_last_used_locked()
+            self._conn.commit()
+
+    def put(self, key: str, description: str):
+        """写入一条描述。"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO image_descriptions"
+                " (key, description, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, description, now, now),
+            )
+            self._conn.commit()
+
+    def evict(self) -> int:
+        """删除过期条目，并按最久未使用淘汰超出 max_entries 的条目。返回删除条数。"""
+        removed = 0
+        with self._lock:
+            # 先写入最近使用时间，按最久未使用淘汰时不会误删刚命中的条目
+            self._flush_last_used_locked()
+            if self.max_age_seconds:
+                cursor = self._conn.execute(
+                    "DELETE FROM image_descriptions WHERE created_at < ?",
+                    (time.time() - self.max_age_seconds,),
+                )
+                removed += cursor.rowcount
+            if self.max_entries:
+                cursor = self._conn.execute(
+                    "DELETE FROM image_descriptions WHERE key IN ("
+                    " SELECT key FROM image_descriptions"
+                    " ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                removed += cursor.rowcount
+            self._conn.commit()
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        """返回命中/未命中次数和当前条目数。"""
+        with self._lock:
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM image_descriptions"
+            ).fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self):
+        with self._lock:
+            try:
+                self._flush_last_used_locked()
+                self._conn.commit()
+            finally:
+                self._conn.close()
 
-        image_descriptions = {}
 
-        print(f"开始分析 {len(image_paths)} 张图片...")
+_description_cache: Optional[ImageDescriptionCache] = None
+_description_cache_lock = threading.Lock()
 
-        # 为每张图片单独调用LLM，确保准确性
-        for idx, img_path in enumerate(image_paths, 1):
-            print(
-                f" [LLM] 正在分析图片 {idx}/{len(image_paths)}: {os.path.basename(img_path)}"
-            )
 
+def get_description_cache() -> Optional[ImageDescriptionCache]:
+    """
+    获取全局图片描述缓存（按 CACHE_CONFIG 惰性创建）。
+    缓存被禁用或无法打开时返回 None。
+    """
+    global _description_cache
+    if not CACHE_CONFIG.get("enabled"):
+        return None
+    with _description_cache_lock:
+        if _description_cache is None:
             try:
-                # 编码图片
-                base64_img = encode_image_to_base64(img_path)
-                if not base64_img:
-                    print(f" [X] 编码失败")
-                    image_descriptions[img_path] = "[图片编码失败]"
-                    continue
-
-                # 构建单张图片的分析请求
-                content = [
-                    {
-                        "type": "text",
-                        "text": "请详细描述这张图片的内容，包括文字、图表、布局等所有可见信息。请用中文回答。",
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"},
-                    },
-                ]
+                _description_cache = ImageDescriptionCache(
+                    CACHE_CONFIG["path"],
+                    max_entries=CACHE_CONFIG.get("max_entries"),
+                    max_age_days=CACHE_CONFIG.get("max_age_days"),
+                )
+            except Exception as e:
+                print(f"警告：无法打开图片描述缓存 '{CACHE_CONFIG['path']}': {e}")
+                return None
+        return _description_cache
+
+
+def close_description_cache():
+    """淘汰过期条目、输出统计并关闭全局缓存。"""
+    global _description_cache
+    with _description_cache_lock:
+        cache = _description_cache
+        _description_cache = None
+    if cache is None:
+        return
+    try:
+        removed = cache.evict()
+        stats = cache.stats()
+        print(
+            f"图片描述缓存: 命中 {stats['hits']} 次，未命中 {stats['misses']} 次，"
+            f"当前 {stats['entries']} 条（本次淘汰 {removed} 条）"
+        )
+    except Exception as e:
+        print(f"整理图片描述缓存时出错: {e}")
+    finally:
+        cache.close()
+
+
+# --- 视觉模型API客户端层（限流、重试、熔断） ---
+class TokenBucket:
+    """线程安全的令牌桶限流器。rate 为每秒补充的令牌数，capacity 为桶容量。"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, amount: float = 1.0):
+        """阻塞直到取得 amount 个令牌（超过桶容量时按容量计）。"""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def consume(self, amount: float):
+        """不等待地扣除令牌（可为负），用于按实际用量补记。"""
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败达到阈值后进入 open 状态，所有请求在此期间等待；
+    冷却结束后只放行一个探测请求（half_open），成功则恢复，失败则重新熔断。
+    """
 
-                # 调用qwen-vl模型
-                response = client.chat.completions.create(
-                    model=QWEN_VL_CONFIG["model"],
-                    messages=[{"role": "user", "content": content}],
-                    max_tokens=1500,
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._condition = threading.Condition()
+
+    def before_call(self):
+        """请求前调用；熔断期间阻塞等待。"""
+        with self._condition:
+            while True:
+                if self.state == "closed":
+                    return
+                if self.state == "open":
+                    remaining = self.opened_at + self.cooldown - time.monotonic()
+                    if remaining <= 0:
+                        self.state = "half_open"
+                        return
+                    self._condition.wait(remaining)
+                else:
+                    # 等待探测请求的结果
+                    self._condition.wait()
+
+    def record_success(self):
+        with self._condition:
+            if self.state != "closed":
+                print(" [API] 服务已恢复，解除熔断")
+            self.state = "closed"
+            self.failures = 0
+            self._condition.notify_all()
+
+    def record_failure(self):
+        with self._condition:
+            self.failures += 1
+            if self.state == "half_open" or (
+                self.state == "closed" and self.failures >= self.failure_threshold
+            ):
+                print(
+                    f" [API] 连续失败 {self.failures} 次，熔断 {self.cooldown:.0f} 秒后再试"
                 )
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._condition.notify_all()
+
+
+_api_guards: Optional[Tuple[Optional[TokenBucket], Optional[TokenBucket], CircuitBreaker]] = None
+_api_guards_lock = threading.Lock()
+
+
+def get_api_guards() -> Tuple[Optional[TokenBucket], Optional[TokenBucket], CircuitBreaker]:
+    """获取全局共享的 (每秒请求限流器, 每分钟token限流器, 熔断器)，按 API_LIMIT_CONFIG 惰性创建。"""
+    global _api_guards
+    with _api_guards_lock:
+        if _api_guards is None:
+            rps = API_LIMIT_CONFIG.get("requests_per_second") or 0
+            tpm = API_LIMIT_CONFIG.get("tokens_per_minute") or 0
+            _api_guards = (
+                TokenBucket(rps, max(1.0, rps)) if rps > 0 else None,
+                TokenBucket(tpm / 60.0, tpm) if tpm > 0 else None,
+                CircuitBreaker(
+                    API_LIMIT_CONFIG.get("breaker_failure_threshold", 5),
+                    API_LIMIT_CONFIG.get("breaker_cooldown", 30.0),
+                ),
+            )
+        return _api_guards
 
-                # 获取响应
-                response_text = response.choices[0].message.content
-                image_descriptions[img_path] = response_text.strip()
 
-                # 显示描述长度作为成功标志
-                desc_len = len(response_text)
-                print(f" [LLM] 分析完成 (描述长度: {desc_len} 字符)")
+def _is_retryable_api_error(error: Exception) -> bool:
+    """429、超时、连接错误和 5xx 视为可重试错误。"""
+    import openai
 
-            except Exception as e:
-                error_msg = f"[图片分析失败: {str(e)}]"
-                print(f" [LLM] 分析失败: {str(e)[:50]}...")
-                image_descriptions[img_path] = error_msg
+    if isinstance(
+        error,
+        (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError),
+    ):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
 
-        print(
-            f"图片分析完成！成功分析 {len([v for v in image_descriptions.values() if not v.startswith('[')])} / {len(image_paths)} 张图片"
-        )
-        return image_descriptions
 
-    except Exception as e:
-        print(f" [LLM] 分析图片时出错: {e}")
-        return {}
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """读取服务端返回的 Retry-After 头（秒）。"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class VisionAPIClient:
+    """
+    包装 OpenAI 兼容客户端的 chat.completions.create 调用：
+    令牌桶限流（请求数/token数）、单次请求超时、指数退避+抖动重试以及全局熔断。
+    """
+
+    def __init__(self, client: "OpenAI"):
+        self.client = client
+
+    def create(self, **kwargs):
+        """发送一次 chat completion 请求，可重试错误按配置重试，最终失败时抛出最后一次的异常。"""
+        request_limiter, token_limiter, breaker = get_api_guards()
+        max_retries = API_LIMIT_CONFIG.get("max_retries", 0)
+        image_count = sum(
+            1
+            for message in kwargs.get("messages", [])
+            if isinstance(message.get("content"), list)
+            for part in message["content"]
+            if part.get("type") == "image_url"
+        )
+        estimated_tokens = kwargs.get("max_tokens", 0) + image_count * API_LIMIT_CONFIG.get(
+            "image_token_estimate", 1000
+        )
+        kwargs.setdefault("timeout", API_LIMIT_CONFIG.get("timeout"))
+
+        with trace_span(
+            "llm_call", model=kwargs.get("model"), images=image_count, attempts=0
+        ) as span:
+            for attempt in range(max_retries + 1):
+                span["attempts"] = attempt + 1
+                breaker.before_call()
+                if request_limiter is not None:
+                    request_limiter.acquire()
+                if token_limiter is not None:
+                    token_limiter.acquire(estimated_tokens)
+
+                try:
+                    response = self.client.chat.completions.create(**kwargs)
+                except Exception as e:
+                    if not _is_retryable_api_error(e):
+                        # 服务端已正常响应（例如参数错误），不计入熔断
+                        breaker.record_success()
+                        raise
+                    breaker.record_failure()
+                    if attempt >= max_retries:
+                        raise
+
+                    delay = min(
+                        API_LIMIT_CONFIG.get("backoff_max", 30.0),
+                        API_LIMIT_CONFIG.get("backoff_base", 1.0) * (2**attempt),
+                    )
+                    delay = delay / 2 + random.uniform(0, delay / 2)
+                    retry_after = _retry_after_seconds(e)
+                    if retry_after is not None:
+                        delay = max(delay, retry_after)
+                    print(
+                        f" [API] 请求失败（{type(e).__name__}），{delay:.1f} 秒后重试 "
+                        f"({attempt + 1}/{max_retries})"
+                    )
+                    time.sleep(delay)
+                    continue
+
+                breaker.record_success()
+                usage = getattr(response, "usage", None)
+                total_tokens = getattr(usage, "total_tokens", None)
+                span.update(
+                    prompt_tokens=getattr(usage, "prompt_tokens", None),
+                    completion_tokens=getattr(usage, "completion_tokens", None),
+                    total_tokens=total_tokens,
+                )
+                if token_limiter is not None and isinstance(total_tokens, int):
+                    if total_tokens > estimated_tokens:
+                        token_limiter.consume(total_tokens - estimated_tokens)
+                return response
+
+
+_vision_client: Optional[VisionAPIClient] = None
+_vision_client_lock = threading.Lock()
+
+
+def get_vision_client() -> VisionAPIClient:
+    """
+    获取整次运行共享的视觉模型客户端（惰性创建）。
+    底层使用 openai 自带的带连接池 HTTP 客户端，所有文档和并发线程复用同一组长连接。
+    """
+    global _vision_client
+    with _vision_client_lock:
+        if _vision_client is None:
+            from openai import DEFAULT_CONNECTION_LIMITS, DefaultHttpxClient, OpenAI
+
+            # 连接池参数类型取自 openai 自带的默认值，不直接依赖 openai 底层使用的 HTTP 库
+            limits_type = type(DEFAULT_CONNECTION_LIMITS)
+            http_client = DefaultHttpxClient(
+                limits=limits_type(
+                    max_connections=QWEN_VL_CONFIG.get("max_connections", 16),
+                    max_keepalive_connections=QWEN_VL_CONFIG.get(
+                        "max_keepalive_connections", 8
+                    ),
+                    keepalive_expiry=QWEN_VL_CONFIG.get("keepalive_expiry", 60.0),
+                ),
+            )
+            # 使用通义千问的base_url，重试由 VisionAPIClient 统一负责
+            _vision_client = VisionAPIClient(
+                OpenAI(
+                    api_key=QWEN_VL_CONFIG["api_key"],
+                    base_url=QWEN_VL_CONFIG["base_url"],
+                    max_retries=0,
+                    http_client=http_client,
+                )
+            )
+        return _vision_client
+
+
+def close_vision_client():
+    """关闭共享客户端及其连接池。"""
+    global _vision_client
+    with _vision_client_lock:
+        client = _vision_client
+        _vision_client = None
+    if client is not None:
+        try:
+            client.client.close()
+        except Exception as e:
+            print(f"关闭API客户端时出错: {e}")
+
+
+_shared_session_depth = 0
+_shared_session_lock = threading.Lock()
+
+
+@contextmanager
+def shared_resources_session():
+    """
+    在多次 process_excel_in_place 调用之间共享API客户端、图片描述缓存、解析进程池
+    以及已完成文档的结果（多个工作簿链接同一文件时只处理一次）。
+    会话内的单次调用结束时不会关闭这些资源，最外层会话退出时统一关闭。
+    """
+    global _shared_session_depth
+    with _shared_session_lock:
+        _shared_session_depth += 1
+    try:
+        yield
+    finally:
+        with _shared_session_lock:
+            _shared_session_depth -= 1
+        close_shared_resources()
+
+
+def close_shared_resources():
+    """
+    关闭共享的API客户端、图片描述缓存和解析进程池，并清空已完成文档的结果和PDF页面数据；
+    处于 shared_resources_session 内时不做任何事。
+    """
+    with _shared_session_lock:
+        if _shared_session_depth > 0:
+            return
+    close_vision_client()
+    close_description_cache()
+    close_parse_pool()
+    _document_results.clear()
+    with _pdf_pages_cache_lock:
+        _pdf_pages_cache.clear()
+
+
+# --- 多模态LLM调用功能 ---
+def encode_image_to_base64(image_path: str) -> str:
+    """
+    将图片文件编码为base64字符串。
+    """
+    try:
+        with open(image_path, "rb") as image_file:
+            encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
+            return encoded_string
+    except Exception as e:
+        print(f"编码图片时出错 {image_path}: {e}")
+        return ""
+
+
+def _guess_image_mime(image_path: str, image_format: Optional[str] = None) -> str:
+    """根据 Pillow 识别的格式或文件扩展名推断 MIME 类型。"""
+    if image_format:
+        mime = {"JPEG": "image/jpeg", "MPO": "image/jpeg"}.get(
+            image_format.upper(), f"image/{image_format.lower()}"
+        )
+        return mime
+    mime, _ = mimetypes.guess_type(image_path)
+    return mime if mime and mime.startswith("image/") else "image/jpeg"
+
+
+def normalize_image_for_upload(image_path: str) -> Tuple[bytes, str, Dict[str, int]]:
+    """
+    上传前规范化图片：长边超过 max_edge 时等比缩小，BMP/TIFF/GIF（取第一帧）等格式
+    转换为目标格式并重新压缩，同时给出正确的 MIME 类型。
+    返回 (图片字节, MIME类型, {"original_bytes", "upload_bytes", "saved_bytes"})。
+    规范化后反而变大、或无法用 Pillow 处理时，保留原始字节。
+    """
+    with open(image_path, "rb") as image_file:
+        raw_bytes = image_file.read()
+
+    original_size = len(raw_bytes)
+    result_bytes, mime = raw_bytes, _guess_image_mime(image_path)
+
+    if IMAGE_CONFIG.get("normalize", True):
+        try:
+            from PIL import Image
+
+            with Image.open(io.BytesIO(raw_bytes)) as img:
+                source_format = (img.format or "").upper()
+                mime = _guess_image_mime(image_path, img.format)
+                img.seek(0)  # 多帧图片（GIF/TIFF）只取第一帧
+
+                target_format = IMAGE_CONFIG.get("format", "JPEG").upper()
+                max_edge = IMAGE_CONFIG.get("max_edge") or 0
+                needs_resize = max_edge and max(img.size) > max_edge
+                needs_convert = source_format != target_format
+
+                if needs_resize or needs_convert:
+                    frame = img.copy()
+                    if needs_resize:
+                        frame.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+                    if target_format == "JPEG":
+                        # JPEG 不支持透明通道，透明区域铺白底
+                        if frame.mode in ("RGBA", "LA", "P"):
+                            frame = frame.convert("RGBA")
+                            background = Image.new("RGB", frame.size, (255, 255, 255))
+                            background.paste(frame, mask=frame.getchannel("A"))
+                            frame = background
+                        elif frame.mode != "RGB":
+                            frame = frame.convert("RGB")
+                    elif frame.mode not in ("RGB", "RGBA", "L", "LA"):
+                        frame = frame.convert("RGBA")
+
+                    buffer = io.BytesIO()
+                    save_kwargs = {"optimize": True}
+                    if target_format in ("JPEG", "WEBP"):
+                        save_kwargs["quality"] = IMAGE_CONFIG.get("quality", 85)
+                    frame.save(buffer, format=target_format, **save_kwargs)
+                    converted = buffer.getvalue()
+
+                    # 只缩放时才强制使用新结果；单纯转换格式但体积变大时保留原图
+                    if needs_resize or len(converted) < original_size or source_format not in (
+                        "JPEG",
+                        "PNG",
+                        "WEBP",
+                    ):
+                        result_bytes = converted
+                        mime = _guess_image_mime(image_path, target_format)
+        except Exception as e:
+            print(f" [图片] 规范化失败，使用原始图片 {os.path.basename(image_path)}: {e}")
+
+    stats = {
+        "original_bytes": original_size,
+        "upload_bytes": len(result_bytes),
+        "saved_bytes": original_size - len(result_bytes),
+    }
+    return result_bytes, mime, stats
+
+
+def _build_image_content(img_path: str) -> Optional[Dict]:
+    """
+    规范化并编码图片，返回 chat 消息中的 image_url 内容块。
+    编码失败时返回 None。
+    """
+    with trace_span("encode_image", file=img_path, images=1) as span:
+        try:
+            image_bytes, mime, stats = normalize_image_for_upload(img_path)
+        except Exception as e:
+            print(f"编码图片时出错 {img_path}: {e}")
+            span["error"] = type(e).__name__
+            return None
+        span.update(bytes=stats["upload_bytes"], original_bytes=stats["original_bytes"])
+        base64_img = base64.b64encode(image_bytes).decode("utf-8") if image_bytes else ""
+    if not base64_img:
+        return None
+    if stats["saved_bytes"] > 0:
+        print(
+            f" [图片] {stats['original_bytes'] / 1024:.1f} KB -> "
+            f"{stats['upload_bytes'] / 1024:.1f} KB "
+            f"(节省 {stats['saved_bytes'] / 1024:.1f} KB)"
+        )
+    return {
+        "type": "image_url",
+        "image_url": {"url": f"data:{mime};base64,{base64_img}"},
+    }
+
+
+def _analyze_single_image(
+    client: VisionAPIClient, img_path: str, idx: int, total: int
+) -> str:
+    """
+    调用LLM分析单张图片。
+    返回图片描述；失败时返回以 "[" 开头的错误信息字符串。
+    """
+    print(f" [LLM] 正在分析图片 {idx}/{total}: {os.path.basename(img_path)}")
+
+    try:
+        # 规范化并编码图片
+        image_content = _build_image_content(img_path)
+        if image_content is None:
+            print(f" [X] 编码失败")
+            return "[图片编码失败]"
+
+        # 构建单张图片的分析请求
+        content = [
+            {
+                "type": "text",
+                "text": QWEN_VL_CONFIG["prompt"],
+            },
+            image_content,
+        ]
+
+        # 调用qwen-vl模型
+        response = client.create(
+            model=QWEN_VL_CONFIG["model"],
+            messages=[{"role": "user", "content": content}],
+            max_tokens=QWEN_VL_CONFIG["max_tokens"],
+        )
+
+        # 获取响应
+        response_text = response.choices[0].message.content
+
+        # 显示描述长度作为成功标志
+        desc_len = len(response_text)
+        print(f" [LLM] 分析完成 (描述长度: {desc_len} 字符)")
+        return response_text.strip()
+
+    except Exception as e:
+        print(f" [LLM] 分析失败: {str(e)[:50]}...")
+        return f"[图片分析失败: {str(e)}]"
+
+
+def _estimate_upload_size(img_path: str) -> Tuple[int, int]:
+    """
+    估算图片上传时的 (像素数, 字节数)，用于组建批次。
+    只读取图片头信息，按 IMAGE_CONFIG["max_edge"] 折算缩放后的尺寸。
+    """
+    try:
+        file_size = os.path.getsize(img_path)
+    except OSError:
+        return 0, 0
+    try:
+        from PIL import Image
+
+        with Image.open(img_path) as img:
+            width, height = img.size
+    except Exception:
+        return 0, file_size
+
+    max_edge = IMAGE_CONFIG.get("max_edge") or 0
+    if IMAGE_CONFIG.get("normalize", True) and max_edge and max(width, height) > max_edge:
+        scale = max_edge / max(width, height)
+        width, height = int(width * scale), int(height * scale)
+    return width * height, file_size
+
+
+def _make_image_batches(
+    pending: List[Tuple[int, str]],
+    batch_size: int,
+    max_pixels: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+) -> List[List[Tuple[int, str]]]:
+    """按数量、总像素和总字节上限把待分析图片切分为批次（保持原顺序）。"""
+    if batch_size <= 1:
+        return [[item] for item in pending]
+
+    batches = []
+    current, current_pixels, current_bytes = [], 0, 0
+    for item in pending:
+        pixels, size = _estimate_upload_size(item[1])
+        if current and (
+            len(current) >= batch_size
+            or (max_pixels and current_pixels + pixels > max_pixels)
+            or (max_bytes and current_bytes + size > max_bytes)
+        ):
+            batches.append(current)
+            current, current_pixels, current_bytes = [], 0, 0
+        current.append(item)
+        current_pixels += pixels
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _parse_batch_response(response_text: str, count: int) -> Optional[List[str]]:
+    """
+    解析批量请求返回的JSON数组，返回按图片顺序排列的描述列表。
+    格式不符（不是数组、数量不一致、描述为空等）时返回 None。
+    """
+    start = response_text.find("[")
+    end = response_text.rfind("]")
+    if start < 0 or end <= start:
+        return None
+    try:
+        items = json.loads(response_text[start : end + 1])
+    except ValueError:
+        return None
+    if not isinstance(items, list) or len(items) != count:
+        return None
+
+    descriptions: List[Optional[str]] = [None] * count
+    for position, item in enumerate(items):
+        if isinstance(item, str):
+            index, description = position + 1, item
+        elif isinstance(item, dict):
+            index, description = item.get("index", position + 1), item.get("description")
+        else:
+            return None
+        if (
+            not isinstance(index, int)
+            or not 1 <= index <= count
+            or not isinstance(description, str)
+            or not description.strip()
+            or descriptions[index - 1] is not None
+        ):
+            return None
+        descriptions[index - 1] = description.strip()
+    return descriptions
+
+
+def _analyze_image_batch(
+    client: VisionAPIClient, batch: List[Tuple[int, str]], total: int
+) -> List[Tuple[str, str]]:
+    """
+    在一次请求中分析多张图片，按序号把结构化结果拆分回每张图片。
+    批次只有一张图片、编码失败或结果无法解析时，回退为逐张单独请求。
+    返回 [(image_path, description, prompt), ...]，prompt 为得到该描述时实际使用的提示词
+    （QWEN_VL_CONFIG 中的 prompt 或 batch_prompt），用于生成缓存键。
+    """
+    single_prompt = QWEN_VL_CONFIG["prompt"]
+    if len(batch) == 1:
+        idx, img_path = batch[0]
+        return [(img_path, _analyze_single_image(client, img_path, idx, total), single_prompt)]
+
+    first_idx, last_idx = batch[0][0], batch[-1][0]
+    print(f" [LLM] 正在批量分析图片 {first_idx}-{last_idx}/{total} (共 {len(batch)} 张)")
+
+    try:
+        content = [
+            {
+                "type": "text",
+                "text": QWEN_VL_CONFIG["batch_prompt"].format(count=len(batch)),
+            }
+        ]
+        for position, (_, img_path) in enumerate(batch, 1):
+            image_content = _build_image_content(img_path)
+            if image_content is None:
+                raise ValueError(f"图片编码失败: {os.path.basename(img_path)}")
+            content.append({"type": "text", "text": f"图片{position}:"})
+            content.append(image_content)
+
+        response = client.create(
+            model=QWEN_VL_CONFIG["model"],
+            messages=[{"role": "user", "content": content}],
+            max_tokens=QWEN_VL_CONFIG["max_tokens"] * len(batch),
+        )
+        descriptions = _parse_batch_response(
+            response.choices[0].message.content or "", len(batch)
+        )
+        if descriptions is None:
+            raise ValueError("批量结果格式无法解析")
+
+        print(f" [LLM] 批量分析完成 ({len(batch)} 张)")
+        batch_prompt = QWEN_VL_CONFIG["batch_prompt"]
+        return [
+            (img_path, desc, batch_prompt) for (_, img_path), desc in zip(batch, descriptions)
+        ]
+
+    except Exception as e:
+        print(f" [LLM] 批量分析失败，回退为逐张分析: {str(e)[:50]}")
+        return [
+            (img_path, _analyze_single_image(client, img_path, idx, total), single_prompt)
+            for idx, img_path in batch
+        ]
+
+
+def analyze_images_with_qwen_vl(
+    image_paths: List[str], max_concurrency: Optional[int] = None
+) -> Dict[str, str]:
+    """
+    使用qwen-vl模型分析图片并返回描述结果。
+    返回字典: {image_path: description}
+    策略：默认为每张图片单独调用LLM，确保每张图片都能正确解析；
+    QWEN_VL_CONFIG["batch_size"] > 1 时把多张图片打包到一次请求，解析失败时回退为逐张请求；
+    max_concurrency > 1 时使用线程池并发请求（默认取 QWEN_VL_CONFIG["max_concurrency"]）。
+    调用API前先查询图片描述缓存，只有未命中的图片才会发送给模型。
+    缓存键包含实际发送的提示词：批量请求的描述和单图请求的描述分开缓存；
+    批量模式下两种描述都可复用，单图模式只复用单图请求的描述。
+    """
+    try:
+        image_descriptions = dict.fromkeys(image_paths)
+        total = len(image_descriptions)
+
+        # 先查询持久化缓存
+        cache = get_description_cache()
+        cache_prompts = [QWEN_VL_CONFIG["prompt"]]
+        if QWEN_VL_CONFIG.get("batch_size", 1) > 1:
+            cache_prompts.append(QWEN_VL_CONFIG["batch_prompt"])
+        cache_keys: Dict[str, Dict[str, str]] = {}
+        if cache is not None:
+            for img_path in image_descriptions:
+                # 每张图片只读取并哈希一次，各提示词的缓存键都由同一个摘要生成
+                image_digest = cache.image_digest(img_path)
+                if image_digest is None:
+                    continue
+                for prompt in cache_prompts:
+                    key = cache.key_for_digest(image_digest, prompt)
+                    cache_keys.setdefault(img_path, {})[prompt] = key
+                    cached = cache.get(key)
+                    if cached is not None:
+                        image_descriptions[img_path] = cached
+                        break
+
+        pending = [
+            (idx, img_path)
+            for idx, img_path in enumerate(image_descriptions, 1)
+            if image_descriptions[img_path] is None
+        ]
+        if cache is not None and len(pending) < total:
+            print(f" [缓存] 命中 {total - len(pending)} / {total} 张图片")
+
+        if pending:
+            # 检查API配置
+            if (
+                QWEN_VL_CONFIG["api_key"] == "YOUR_API_KEY_HERE"
+                or not QWEN_VL_CONFIG["api_key"]
+            ):
+                print("警告：请先配置QWEN_VL_CONFIG中的API密钥")
+                return {
+                    path: desc
+                    for path, desc in image_descriptions.items()
+                    if desc is not None
+                }
+
+            # 复用整次运行共享的客户端和连接池
+            client = get_vision_client()
+
+            # 按 batch_size 把图片打包，每个批次是一个并发调度单位
+            batches = _make_image_batches(
+                pending,
+                QWEN_VL_CONFIG.get("batch_size", 1),
+                QWEN_VL_CONFIG.get("batch_max_pixels"),
+                QWEN_VL_CONFIG.get("batch_max_bytes"),
+            )
+
+            if max_concurrency is None:
+                max_concurrency = QWEN_VL_CONFIG.get("max_concurrency", 1)
+            max_concurrency = max(1, min(int(max_concurrency), len(batches)))
+
+            batch_note = f"，{len(batches)} 个请求" if len(batches) < len(pending) else ""
+            print(
+                f"开始分析 {len(pending)} 张图片... (并发数: {max_concurrency}{batch_note})"
+            )
+
+            results = []
+            if max_concurrency == 1:
+                # 逐个请求调用LLM，确保准确性
+                for batch in batches:
+                    results.extend(_analyze_image_batch(client, batch, total))
+            else:
+                # 有界线程池并发调用，结果按原图片顺序写回
+                with ThreadPoolExecutor(
+                    max_workers=max_concurrency, thread_name_prefix="qwen_vl"
+                ) as executor:
+                    futures = [
+                        executor.submit(_analyze_image_batch, client, batch, total)
+                        for batch in batches
+                    ]
+                    for future in futures:
+                        results.extend(future.result())
+
+            for img_path, description, prompt in results:
+                image_descriptions[img_path] = description
+                # 只缓存成功的描述，失败信息下次运行时重新请求；按实际使用的提示词选择缓存键
+                key = cache_keys.get(img_path, {}).get(prompt)
+                if cache is not None and key is not None:
+                    if not description.startswith("["):
+                        cache.put(key, description)
+
+        print(
+            f"图片分析完成！成功分析 {len([v for v in image_descriptions.values() if not v.startswith('[')])} / {total} 张图片"
+        )
+        return image_descriptions
+
+    except Exception as e:
+        print(f" [LLM] 分析图片时出错: {e}")
+        return {}
+
+
+# --- 图片预筛 ---
+# 预筛原因 -> 日志中的说明
+TRIAGE_REASONS = {
+    "small": "尺寸过小",
+    "line": "分隔线",
+    "flat": "纯色",
+    "blank": "无明显内容",
+    "simple": "简单色块",
+}
+# 每批堆叠的缩略图数量，限制预筛时的内存占用
+_TRIAGE_BATCH_SIZE = 256
+
+_triage_totals = {"scored": 0, "skipped": 0}
+_triage_totals_lock = threading.Lock()
+
+
+def _load_triage_thumbnail(image_path: str, size: int, max_edge: int):
+    """
+    读取图片尺寸；长边不超过 max_edge 的小图同时缩放为 size x size 的 RGB 缩略图
+    （放大时使用最近邻，保留原始像素的边缘），返回 ((原始宽, 原始高), uint8 数组或 None)。
+    透明背景按白色合成。无法读取时返回 None。
+    """
+    import numpy as np
+    from PIL import Image
+
+    try:
+        with Image.open(image_path) as img:
+            original_size = img.size
+            if max(original_size) > max_edge:
+                return original_size, None
+            if img.mode in ("RGBA", "LA", "P", "PA"):
+                rgba = img.convert("RGBA")
+                background = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+                img = Image.alpha_composite(background, rgba)
+            resample = Image.NEAREST if max(original_size) <= size else Image.BILINEAR
+            thumbnail = img.convert("RGB").resize((size, size), resample)
+            return original_size, np.asarray(thumbnail, dtype=np.uint8)
+    except Exception:
+        return None
+
+
+def score_image_thumbnails(thumbnails) -> Dict[str, "np.ndarray"]:
+    """
+    对一批缩略图（形状为 N x S x S x 3 的 uint8 数组）向量化计算预筛特征：
+    灰度标准差、边缘密度（相邻像素灰度差超过 edge_threshold 的比例）和颜色数（每通道量化为16级）。
+    """
+    import numpy as np
+
+    gray = thumbnails.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    threshold = TRIAGE_CONFIG.get("edge_threshold", 32)
+    horizontal = np.abs(np.diff(gray, axis=2)) > threshold
+    vertical = np.abs(np.diff(gray, axis=1)) > threshold
+    edge_density = (horizontal.mean(axis=(1, 2)) + vertical.mean(axis=(1, 2))) / 2
+
+    quantized = (thumbnails >> 4).astype(np.uint16)
+    codes = (quantized[..., 0] << 8 | quantized[..., 1] << 4 | quantized[..., 2]).reshape(
+        len(thumbnails), -1
+    )
+    colors = np.count_nonzero(np.diff(np.sort(codes, axis=1), axis=1), axis=1) + 1
+
+    return {"std": gray.std(axis=(1, 2)), "edge_density": edge_density, "colors": colors}
+
+
+def classify_trivial_images(image_paths: List[str]) -> Dict[str, str]:
+    """
+    按 TRIAGE_CONFIG 的阈值找出不值得调用模型的简单图片，返回 {image_path: 原因}。
+    图标和分隔线按原图尺寸判断；纯色、空白、简单色块只在长边不超过 max_trivial_edge 的小图上判断，
+    特征按批堆叠缩略图后一次性计算。PDF 整页渲染图和无法读取的图片不参与预筛。
+    """
+    import numpy as np
+
+    size = TRIAGE_CONFIG.get("thumbnail_size", 128)
+    max_trivial_edge = TRIAGE_CONFIG.get("max_trivial_edge", 128)
+    min_edge = TRIAGE_CONFIG.get("min_edge", 0)
+    line_thickness = TRIAGE_CONFIG.get("line_thickness", 0)
+    trivial: Dict[str, str] = {}
+
+    for start in range(0, len(image_paths), _TRIAGE_BATCH_SIZE):
+        batch_paths = []
+        batch_thumbnails = []
+        for image_path in image_paths[start:start + _TRIAGE_BATCH_SIZE]:
+            # 整页渲染图（<uuid>_page_3.png）是扫描页或 page 模式的页面，始终交给模型
+            page_match = PDF_IMAGE_NAME_PATTERN.search(os.path.basename(image_path))
+            if page_match and page_match.group(2) is None:
+                continue
+            loaded = _load_triage_thumbnail(image_path, size, max_trivial_edge)
+            if loaded is None:
+                continue
+            (width, height), thumbnail = loaded
+            if max(width, height) < min_edge:
+                trivial[image_path] = "small"
+                continue
+            if min(width, height) <= line_thickness:
+                trivial[image_path] = "line"
+                continue
+            if thumbnail is None:
+                continue
+            batch_paths.append(image_path)
+            batch_thumbnails.append(thumbnail)
+        if not batch_paths:
+            continue
+
+        scores = score_image_thumbnails(np.stack(batch_thumbnails))
+        flat = scores["std"] < TRIAGE_CONFIG.get("min_std", 0)
+        blank = scores["edge_density"] < TRIAGE_CONFIG.get("min_edge_density", 0)
+        simple = (scores["colors"] < TRIAGE_CONFIG.get("min_colors", 0)) & (
+            scores["edge_density"] < TRIAGE_CONFIG.get("simple_edge_density", 0)
+        )
+        for index, image_path in enumerate(batch_paths):
+            if flat[index]:
+                trivial[image_path] = "flat"
+            elif blank[index]:
+                trivial[image_path] = "blank"
+            elif simple[index]:
+                trivial[image_path] = "simple"
+    return trivial
+
+
+def triage_images(image_paths: List[str]) -> Dict[str, str]:
+    """
+    调用多模态模型前的本地预筛。返回简单图片的固定描述 {image_path: description}，
+    action 为 drop 时描述为空字符串（替换占位符时连同占位符一起删除）。
+    预筛被禁用或缺少 NumPy / Pillow 时返回空字典，所有图片照常分析。
+    """
+    if not image_paths or not TRIAGE_CONFIG.get("enabled"):
+        return {}
+    try:
+        import numpy  # noqa: F401
+        import PIL  # noqa: F401
+    except ImportError:
+        return {}
+
+    with trace_span("triage_images", images=len(image_paths)) as span:
+        trivial = classify_trivial_images(image_paths)
+        span["skipped"] = len(trivial)
+
+    with _triage_totals_lock:
+        _triage_totals["scored"] += len(image_paths)
+        _triage_totals["skipped"] += len(trivial)
+
+    if not trivial:
+        return {}
+    reason_counts: Dict[str, int] = {}
+    for reason in trivial.values():
+        reason_counts[reason] = reason_counts.get(reason, 0) + 1
+    details = "，".join(
+        f"{TRIAGE_REASONS[reason]} {count} 张" for reason, count in reason_counts.items()
+    )
+    print(
+        f"    预筛: {len(image_paths)} 张图片中有 {len(trivial)} 张为简单图片（{details}），"
+        f"跳过这些图片的模型分析"
+    )
+
+    description = "" if TRIAGE_CONFIG.get("action") == "drop" else TRIAGE_CONFIG.get("description", "")
+    return {image_path: description for image_path in trivial}
+
+
+# --- 图片去重 ---
+def compute_dhash(image_path: str, hash_size: int = 16) -> Optional[int]:
+    """
+    计算图片的差异哈希（dHash），用于识别视觉上近似的图片。
+    无法读取图片或未安装 Pillow 时返回 None。
+    """
+    try:
+        from PIL import Image
+
+        with Image.open(image_path) as img:
+            gray = img.convert("L").resize((hash_size + 1, hash_size))
+            pixels = list(gray.getdata())
+    except Exception:
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+class ImageDeduplicator:
+    """
+    跨文档的图片去重索引。
+    按字节哈希（完全相同）和感知哈希（视觉近似）将图片分组，
+    每组只选一张代表图片送去分析，其描述复用到组内所有占位符。
+    流水线中多个线程共用同一个索引，所有状态都在锁内读写；正在分析的代表图片登记在案，
+    其他文档遇到同一代表图片时等待其结果，而不是再调用一次模型。
+    """
+
+    def __init__(
+        self,
+        perceptual: bool = True,
+        hash_size: int = 16,
+        max_distance: int = 4,
+    ):
+        self.perceptual = perceptual
+        self.hash_size = hash_size
+        self.max_distance = max_distance
+        self.representatives: Dict[str, str] = {}  # image_path -> 代表图片路径
+        self.descriptions: Dict[str, str] = {}  # 代表图片路径 -> 描述
+        self._by_digest: Dict[str, str] = {}
+        self._perceptual_index: List[Tuple[int, str]] = []
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        self._in_flight: Dict[str, threading.Event] = {}  # 代表图片路径 -> 分析完成事件
+        self._lock = threading.Lock()
+
+    def assign(self, image_path: str) -> str:
+        """为图片找到代表图片，首次出现的图片成为新组的代表。"""
+        with self._lock:
+            return self._assign_locked(image_path)
+
+    def _assign_locked(self, image_path: str) -> str:
+        if image_path in self.representatives:
+            return self.representatives[image_path]
+
+        try:
+            with open(image_path, "rb") as image_file:
+                digest = hashlib.sha256(image_file.read()).hexdigest()
+        except OSError:
+            # 无法读取的图片单独成组，交给后续步骤报告错误
+            self.representatives[image_path] = image_path
+            return image_path
+
+        representative = self._by_digest.get(digest)
+        if representative is not None:
+            self.exact_duplicates += 1
+        elif self.perceptual:
+            dhash = compute_dhash(image_path, self.hash_size)
+            if dhash is not None:
+                for known_hash, known_path in self._perceptual_index:
+                    if bin(known_hash ^ dhash).count("1") <= self.max_distance:
+                        representative = known_path
+                        self.near_duplicates += 1
+                        break
+                else:
+                    self._perceptual_index.append((dhash, image_path))
+
+        if representative is None:
+            representative = image_path
+        self._by_digest.setdefault(digest, representative)
+        self.representatives[image_path] = representative
+        return representative
+
+    def claim(self, representatives: List[str]) -> Tuple[List[str], List[threading.Event]]:
+        """
+        登记要分析的代表图片。返回 (由调用方负责分析的代表图片, 需要等待的其他线程的分析完成事件)；
+        已有描述的代表图片两者都不包含。调用方分析完成后必须用 record(..., claimed=...) 释放登记。
+        """
+        claimed: List[str] = []
+        waits: List[threading.Event] = []
+        with self._lock:
+            for representative in representatives:
+                if representative in self.descriptions:
+                    continue
+                event = self._in_flight.get(representative)
+                if event is None:
+                    self._in_flight[representative] = threading.Event()
+                    claimed.append(representative)
+                else:
+                    waits.append(event)
+        return claimed, waits
+
+    def record(self, image_descriptions: Dict[str, str], claimed: List[str] = ()):
+        """记录代表图片的分析结果，失败的结果不复用，以便后续重新分析；同时释放 claimed 的登记。"""
+        with self._lock:
+            for image_path, description in image_descriptions.items():
+                if description and not description.startswith("["):
+                    self.descriptions[image_path] = description
+            for representative in claimed:
+                event = self._in_flight.pop(representative, None)
+                if event is not None:
+                    event.set()
+
+    def lookup(self, representative: str) -> Optional[str]:
+        """返回代表图片已记录的描述。"""
+        with self._lock:
+            return self.descriptions.get(representative)
+
+
+def analyze_images_with_dedup(
+    image_paths: List[str], deduplicator: Optional[ImageDeduplicator] = None
+) -> Dict[str, str]:
+    """
+    先对图片去重，再调用 analyze_images_with_qwen_vl 只分析每组的代表图片，
+    最后把描述展开回每一张原始图片，返回 {image_path: description}。
+    """
+    if deduplicator is None:
+        return analyze_images_with_qwen_vl(image_paths)
+
+    groups = {path: deduplicator.assign(path) for path in image_paths}
+    representatives = list(dict.fromkeys(groups.values()))
+    to_analyze, waits = deduplicator.claim(representatives)
+    skipped = len(groups) - len(to_analyze)
+    if skipped:
+        print(f"    去重: {len(groups)} 张图片中有 {skipped} 张复用已有描述或其他文档正在分析的结果")
+
+    fresh: Dict[str, str] = {}
+    try:
+        if to_analyze:
+            fresh = analyze_images_with_qwen_vl(to_analyze)
+    finally:
+        deduplicator.record(fresh, claimed=to_analyze)
+
+    # 等待其他文档中同一代表图片的分析结果；对方分析失败时由本文档再分析一次
+    for event in waits:
+        event.wait()
+    missing = [
+        rep for rep in representatives
+        if rep not in fresh and deduplicator.lookup(rep) is None
+    ]
+    if missing:
+        retried = analyze_images_with_qwen_vl(missing)
+        deduplicator.record(retried)
+        fresh.update(retried)
+
+    image_descriptions = {}
+    for path, rep in groups.items():
+        description = deduplicator.lookup(rep) or fresh.get(rep)
+        if description is not None:
+            image_descriptions[path] = description
+    return image_descriptions
+
+
+def create_image_deduplicator() -> Optional[ImageDeduplicator]:
+    """根据 DEDUP_CONFIG 创建一次运行使用的去重索引，禁用时返回 None。"""
+    if not DEDUP_CONFIG.get("enabled"):
+        return None
+    return ImageDeduplicator(
+        perceptual=DEDUP_CONFIG.get("perceptual", True),
+        hash_size=DEDUP_CONFIG.get("hash_size", 16),
+        max_distance=DEDUP_CONFIG.get("max_distance", 4),
+    )
+
+
+# --- 占位符替换功能 ---
+# 图片占位符 ![placeholder](image_path)，image_path 指向本次运行的临时文件
+IMAGE_PLACEHOLDER_PATTERN = re.compile(r"!\[placeholder\]\(([^)]+)\)")
+
+
+def has_unresolved_placeholders(content: Optional[str]) -> bool:
+    """内容中仍有图片占位符（指向运行结束后即被删除的临时文件）时返回 True。"""
+    return bool(content) and IMAGE_PLACEHOLDER_PATTERN.search(content) is not None
 
 
-# --- 占位符替换功能 ---
 def replace_placeholders(markdown_text: str, image_descriptions: Dict[str, str]) -> str:
     """
     将Markdown中的图片占位符替换为实际的图片描述。
     """
     try:
-        # 使用正则表达式匹配 ![placeholder](image_path) 格式
-        placeholder_pattern = r"!\[placeholder\]\(([^)]+)\)"
-
         def replace_match(match):
             image_path = match.group(1)
             # 查找对应的描述
             if image_path in image_descriptions:
                 description = image_descriptions[image_path]
+                # 预筛时丢弃的图片描述为空，连同占位符一起删除
+                if not description:
+                    return ""
                 # 格式化为Markdown代码块，添加长横线分隔符
                 return f"\n================\n**图片描述:**\n{description}\n================\n"
             else:
                 return f"\n================\n[未找到图片 {image_path} 的描述]\n================\n"
 
         # 执行替换
-        result = re.sub(placeholder_pattern, replace_match, markdown_text)
+        result = IMAGE_PLACEHOLDER_PATTERN.sub(replace_match, markdown_text)
         return result
 
     except Exception as e:
@@ -950,138 +3187,2412 @@ def format_as_markdown(content: str, file_extension: str) -> str:
 # --- 主 Excel 处理逻辑 ---
 
 
-def process_excel_in_place(excel_path: str):
+def prepare_document(full_path: str, temp_manager: TempFileManager) -> Tuple[str, List[str]]:
     """
-    自动查找链接列，在其后插入一个新列，
-    用链接文档的内容填充它，并直接在原文件上保存更改。
-    新版本支持图片提取和多模态LLM分析。
+    文档解析阶段：提取图片并转换为带占位符的Markdown。
+    返回 (markdown_with_placeholders, image_paths)。
     """
-    try:
-        workbook = openpyxl.load_workbook(excel_path)
-        sheet = workbook.active
-        print(f"成功加载文件: '{excel_path}'")
-    except FileNotFoundError:
-        print(f"错误：Excel 文件 '{excel_path}' 不存在。请检查路径是否正确。")
-        return
-    except Exception as e:
-        print(f"加载 Excel 文件 '{excel_path}' 时出错: {e}")
-        return
+    file_format = os.path.splitext(full_path)[1].lower().lstrip(".")
+
+    # 步骤1: 从文档中提取图片
+    print(f"    提取图片中...")
+    with trace_span(
+        "extract_images", file=full_path, format=file_format, bytes=_file_size(full_path)
+    ) as span:
+        image_paths = extract_images_from_document(full_path, temp_manager)
+        span["images"] = len(image_paths)
+
+    if image_paths:
+        print(f"    提取到 {len(image_paths)} 张图片")
+    else:
+        print(f"    未检测到图片")
+
+    # 步骤2: 转换为带占位符的Markdown
+    print(f"    转换为Markdown格式...")
+    with trace_span(
+        "convert_markdown", file=full_path, format=file_format, images=len(image_paths)
+    ) as span:
+        markdown_with_placeholders = convert_to_markdown_with_placeholders(
+            full_path, image_paths, temp_manager
+        )
+        span["chars"] = len(markdown_with_placeholders)
+    return markdown_with_placeholders, image_paths
 
-    # 获取Excel文件所在的绝对目录
-    excel_base_dir = os.path.dirname(os.path.abspath(excel_path))
-    print(f"将基于此目录解析相对路径: '{excel_base_dir}'")
 
-    all_links = [
-        {"cell": cell, "target": cell.hyperlink.target}
-        for row in sheet.iter_rows()
-        for cell in row
-        if cell.hyperlink
-    ]
+def prepare_images(
+    image_paths: List[str], deduplicator: Optional[ImageDeduplicator] = None
+) -> Tuple[Dict[str, str], List[str]]:
+    """
+    图片预处理阶段：本地预筛简单图片，其余图片在去重索引中分组（计算字节哈希和感知哈希）。
+    返回 (预筛得到的固定描述, 需要调用模型分析的图片路径)。
+    """
+    image_descriptions = triage_images(image_paths)
+    to_analyze = [path for path in image_paths if path not in image_descriptions]
+    if deduplicator is not None:
+        for image_path in to_analyze:
+            deduplicator.assign(image_path)
+    return image_descriptions, to_analyze
+
+
+def describe_images(
+    image_descriptions: Dict[str, str],
+    to_analyze: List[str],
+    deduplicator: Optional[ImageDeduplicator] = None,
+) -> Dict[str, str]:
+    """
+    图片分析阶段：调用多模态LLM分析 to_analyze 中的图片，与预筛描述合并后返回；
+    需要分析的图片全部失败时返回空字典。
+    """
+    if not to_analyze:
+        return image_descriptions
+    print(f"    使用多模态LLM分析图片...")
+    analyzed = analyze_images_with_dedup(to_analyze, deduplicator)
+    return {**image_descriptions, **analyzed} if analyzed else {}
 
-    if not all_links:
-        print("在此文件中未找到任何超链接。未做任何更改。")
-        return
 
-    print(f"找到了 {len(all_links)} 个超链接。")
+def apply_image_descriptions(
+    markdown_with_placeholders: str, image_paths: List[str], image_descriptions: Dict[str, str]
+) -> str:
+    """替换占位符阶段：用图片描述替换占位符，返回最终Markdown；图片分析失败时返回原始内容。"""
+    if not image_paths:
+        return markdown_with_placeholders
+    if not image_descriptions:
+        print(f"    图片分析失败，使用原始内容")
+        return markdown_with_placeholders
 
-    first_link_col_idx = all_links[0]["cell"].column
-    content_col_idx = first_link_col_idx + 1
+    print(f"    替换占位符...")
+    with trace_span("replace_placeholders", images=len(image_descriptions)) as span:
+        final_markdown = replace_placeholders(markdown_with_placeholders, image_descriptions)
+        span["chars"] = len(final_markdown)
+    return final_markdown
 
-    print(
-        f"检测到链接列为 {get_column_letter(first_link_col_idx)} 列。 "
-        f"将在 {get_column_letter(content_col_idx)} 列插入新内容。"
-    )
 
-    sheet.insert_cols(content_col_idx)
+# 图片分析失败时描述的前缀（预筛的固定描述不算失败）
+_FAILED_DESCRIPTION_PREFIXES = ("[图片分析失败", "[图片编码失败")
 
-    header_cell = sheet.cell(row=1, column=content_col_idx)
-    header_cell.value = "链接文档内容"
-    header_cell.font = openpyxl.styles.Font(bold=True)
 
-    # 使用临时文件管理器来管理提取的图片
-    with TempFileManager() as temp_manager:
-        for link_info in all_links:
-            link_cell = link_info["cell"]
-            # 这是从Excel中读取的原始路径，可能是相对的
-            relative_or_absolute_path = link_info["target"]
-
-            # 解析路径，将相对路径转换为绝对路径
-            if os.path.isabs(relative_or_absolute_path):
-                # 如果路径已经是绝对路径 (例如 "C:\...")，则直接使用
-                full_path = relative_or_absolute_path
-            else:
-                # 如果是相对路径，则与Excel文件所在目录进行拼接
-                full_path = os.path.join(excel_base_dir, relative_or_absolute_path)
+def images_fully_described(image_paths: List[str], image_descriptions: Dict[str, str]) -> bool:
+    """
+    每张图片都得到了描述（包括预筛的固定描述和丢弃）时返回 True。
+    否则结果中留有占位符或失败信息，不应记录指纹、日志或缓存，下次运行时重试。
+    """
+    return all(
+        image_path in image_descriptions
+        and not image_descriptions[image_path].startswith(_FAILED_DESCRIPTION_PREFIXES)
+        for image_path in image_paths
+    )
 
-            print(
-                f"  - 正在处理 {link_cell.coordinate}: '{relative_or_absolute_path}' -> 解析为 '{full_path}'"
-            )
 
-            try:
-                # 步骤1: 从文档中提取图片
-                print(f"    提取图片中...")
-                image_paths = extract_images_from_document(full_path, temp_manager)
+def enrich_document_checked(
+    markdown_with_placeholders: str,
+    image_paths: List[str],
+    deduplicator: Optional[ImageDeduplicator] = None,
+) -> Tuple[str, bool]:
+    """
+    图片分析阶段：本地预筛简单图片，调用多模态LLM分析其余图片并替换占位符。
+    返回 (最终Markdown, 是否所有图片都得到了描述)。
+    """
+    # 步骤3: 本地预筛简单图片，其余图片使用LLM分析
+    image_descriptions, to_analyze = prepare_images(image_paths, deduplicator)
+    image_descriptions = describe_images(image_descriptions, to_analyze, deduplicator)
+    # 步骤4: 替换占位符
+    final_markdown = apply_image_descriptions(
+        markdown_with_placeholders, image_paths, image_descriptions
+    )
+    return final_markdown, images_fully_described(image_paths, image_descriptions)
 
-                if image_paths:
-                    print(f"    提取到 {len(image_paths)} 张图片")
-                else:
-                    print(f"    未检测到图片")
 
-                # 步骤2: 转换为带占位符的Markdown
-                print(f"    转换为Markdown格式...")
-                markdown_with_placeholders = convert_to_markdown_with_placeholders(
-                    full_path, image_paths, temp_manager
-                )
+def enrich_document(
+    markdown_with_placeholders: str,
+    image_paths: List[str],
+    deduplicator: Optional[ImageDeduplicator] = None,
+) -> str:
+    """
+    图片分析阶段：本地预筛简单图片，调用多模态LLM分析其余图片并替换占位符，返回最终Markdown。
+    """
+    return enrich_document_checked(markdown_with_placeholders, image_paths, deduplicator)[0]
 
-                # 步骤3: 使用LLM分析图片
-                final_markdown = markdown_with_placeholders
-                if image_paths:
-                    print(f"    使用多模态LLM分析图片...")
-                    image_descriptions = analyze_images_with_qwen_vl(image_paths)
-
-                    if image_descriptions:
-                        print(f"    替换占位符...")
-                        # 步骤4: 替换占位符
-                        final_markdown = replace_placeholders(
-                            markdown_with_placeholders, image_descriptions
-                        )
-                    else:
-                        print(f"    图片分析失败，使用原始内容")
 
-                # 步骤5: 插入到Excel单元格
-                content_cell = sheet.cell(row=link_cell.row, column=content_col_idx)
-                content_cell.value = final_markdown
+def get_fallback_content(full_path: str) -> str:
+    """处理出错时使用原始文本内容作为单元格内容。"""
+    raw_content = get_content_from_file(full_path)
+    _, extension = os.path.splitext(full_path)
+    return format_as_markdown(raw_content, extension)
 
-                print(f"    完成")
 
-            except Exception as e:
-                print(f"    处理出错: {e}")
-                # 出错时使用原始文本
-                raw_content = get_content_from_file(full_path)
-                _, extension = os.path.splitext(full_path)
-                md_content = format_as_markdown(raw_content, extension)
-                content_cell = sheet.cell(row=link_cell.row, column=content_col_idx)
-                content_cell.value = md_content
+# 需要同步到解析子进程中的配置字典名称
+_WORKER_CONFIG_NAMES = (
+    "QWEN_VL_CONFIG", "PDF_CONFIG", "XLSX_CONFIG", "PROCESSING_CONFIG", "TRACE_CONFIG"
+)
 
-    try:
-        print(f"\n正在将更改保存到原始文件: '{excel_path}'...")
-        workbook.save(excel_path)
-        print("处理完成！原始文件已更新。")
-    except PermissionError:
-        print(
-            f"\n错误：无法保存文件。请确保 '{excel_path}' 没有被其他程序（如Excel）打开。"
-        )
-    except Exception as e:
-        print(f"\n保存文件 '{excel_path}' 时发生未知错误: {e}")
 
+def _snapshot_configs() -> Dict[str, Dict]:
+    """复制当前配置，供子进程初始化时使用（spawn 模式下子进程不会继承运行时修改）。"""
+    return {name: dict(globals()[name]) for name in _WORKER_CONFIG_NAMES}
 
-# --- 脚本主入口 ---
-if __name__ == "__main__":
-    # --- 警告 ---
-    # 此脚本将直接修改您的原始文件。
-    # 强烈建议在运行前对您的 Excel 文件进行备份。
 
-    # --- 请在这里提供您的 Excel 文件的完整路径 ---
-    excel_file_path = "C:\\Users\\Admin\\Desktop\\text\\任务管理.xlsx"
+def _init_parse_worker(config_snapshot: Dict[str, Dict]):
+    """解析子进程初始化：同步主进程的配置。"""
+    global _in_parse_worker
+    _in_parse_worker = True
+    for name, values in config_snapshot.items():
+        globals()[name].update(values)
 
-    process_excel_in_place(excel_file_path)
+
+def _prepare_document_in_worker(
+    full_path: str, temp_dir: str
+) -> Tuple[str, List[str], List[Dict]]:
+    """
+    在子进程中执行文档解析阶段，图片写入主进程的临时目录。
+    启用追踪时额外返回子进程中记录的 span，由主进程合并。
+    """
+    global _active_tracer
+    tracer = RunTracer() if TRACE_CONFIG.get("enabled") else None
+    _active_tracer = tracer
+    try:
+        with TempFileManager(temp_dir=temp_dir) as temp_manager:
+            markdown_with_placeholders, image_paths = prepare_document(
+                full_path, temp_manager
+            )
+    finally:
+        _active_tracer = None
+    return markdown_with_placeholders, image_paths, tracer.records if tracer else []
+
+
+_parse_pool: Optional["ProcessPoolExecutor"] = None
+
+
+def get_parse_pool(workers: int) -> "ProcessPoolExecutor":
+    """
+    获取解析进程池（惰性创建）。在 shared_resources_session 内多个工作簿复用同一个进程池；
+    已有进程池即使进程数与 workers 不同也直接复用（它可能正被其他调用方使用，不能中途关闭），
+    只在进程池因子进程异常退出而损坏时重新创建。
+    子进程的配置在创建进程池时同步，之后对配置的修改不会传给已有的进程池。
+    """
+    # 进程池会连带导入 multiprocessing，只在真正并行解析时才需要
+    from concurrent.futures import ProcessPoolExecutor
+
+    global _parse_pool
+    if _parse_pool is not None and getattr(_parse_pool, "_broken", False):
+        close_parse_pool()
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_parse_worker,
+            initargs=(_snapshot_configs(),),
+        )
+        # fork 方式下子进程在第一次提交任务时才创建。立即创建，避免之后某个线程提交任务时
+        # 恰好另一个线程在启动 poppler 子进程：fork 出的解析进程会继承 subprocess 的管道，
+        # 使该线程一直等待到解析进程退出
+        _parse_pool.submit(int).result()
+    return _parse_pool
+
+
+def close_parse_pool():
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown()
+        _parse_pool = None
+
+
+# 流水线队列中的结束标记
+_PIPELINE_DONE = object()
+
+
+class StagePipeline:
+    """
+    分阶段流水线：相邻阶段之间用有界队列连接，每个阶段有自己的线程数。
+    每个条目是一个字典，阶段函数直接在字典上补充结果；某个阶段出错时把异常记录在 item["error"]，
+    后续阶段跳过该条目，由 sink 统一处理。sink 在调用 run() 的线程中执行（openpyxl 只在该线程访问），
+    队列满时上游阶段阻塞等待，内存中同时存在的条目数因此有上限。
+    """
+
+    def __init__(self, stages: List[Tuple[str, Callable[[Dict], None], int]], queue_size: int = 2):
+        self.stages = [(name, func, max(1, int(workers))) for name, func, workers in stages]
+        self.queue_size = max(1, int(queue_size))
+        self.busy_seconds: Dict[str, float] = {name: 0.0 for name, _, _ in self.stages}
+        self._lock = threading.Lock()
+        # sink 出错后置位：不再投入新条目，各阶段跳过剩余条目，尽快排空队列
+        self._cancelled = threading.Event()
+        # 阶段函数抛出的非 Exception 异常（例如 KeyboardInterrupt），由 run() 在线程退出后重新抛出
+        self._stage_error: Optional[BaseException] = None
+
+    def _run_stage(
+        self,
+        name: str,
+        func: Callable[[Dict], None],
+        inbox: "queue.Queue",
+        outbox: "queue.Queue",
+        running: List[int],
+        downstream_workers: int,
+    ):
+        try:
+            while True:
+                item = inbox.get()
+                if item is _PIPELINE_DONE:
+                    break
+                try:
+                    if item.get("error") is None and not self._cancelled.is_set():
+                        started = time.perf_counter()
+                        try:
+                            func(item)
+                        except Exception as e:
+                            item["error"] = e
+                        except BaseException as e:
+                            # 不能让线程就此退出，否则下游和 run() 会永远等待；取消流水线并继续排空
+                            item["error"] = e
+                            with self._lock:
+                                if self._stage_error is None:
+                                    self._stage_error = e
+                            self._cancelled.set()
+                        with self._lock:
+                            self.busy_seconds[name] += time.perf_counter() - started
+                finally:
+                    outbox.put(item)
+        finally:
+            # 本阶段最后一个退出的线程负责通知下游的每个线程结束
+            with self._lock:
+                running[0] -= 1
+                last = running[0] == 0
+            if last:
+                for _ in range(downstream_workers):
+                    outbox.put(_PIPELINE_DONE)
+
+    def _feed(self, items: List[Dict], inbox: "queue.Queue", workers: int):
+        for item in items:
+            if self._cancelled.is_set():
+                break
+            item.setdefault("error", None)
+            inbox.put(item)
+        for _ in range(workers):
+            inbox.put(_PIPELINE_DONE)
+
+    def run(self, items: List[Dict], sink: Callable[[Dict], None], sink_name: str = "sink"):
+        """
+        依次让条目流过各阶段，完成的条目按完成顺序交给 sink。
+        sink 或阶段函数抛出异常（阶段函数只限非 Exception 的异常，例如 KeyboardInterrupt）时
+        停止投入新条目并继续排空队列，等所有阶段线程退出后再抛出该异常，
+        保证返回时没有线程还在使用调用方的资源（例如临时目录）。
+        """
+        self._cancelled.clear()
+        self._stage_error = None
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [
+            threading.Thread(
+                target=self._feed,
+                args=(items, queues[0], self.stages[0][2]),
+                name="pipeline-feed",
+                daemon=True,
+            )
+        ]
+        for index, (name, func, workers) in enumerate(self.stages):
+            downstream_workers = self.stages[index + 1][2] if index + 1 < len(self.stages) else 1
+            running = [workers]
+            for worker_index in range(workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._run_stage,
+                        args=(name, func, queues[index], queues[index + 1], running, downstream_workers),
+                        name=f"pipeline-{name}-{worker_index}",
+                        daemon=True,
+                    )
+                )
+        for thread in threads:
+            thread.start()
+
+        self.busy_seconds[sink_name] = 0.0
+        error: Optional[BaseException] = None
+        drained = False
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _PIPELINE_DONE:
+                    drained = True
+                    break
+                if error is None and self._stage_error is not None:
+                    error = self._stage_error
+                if error is not None:
+                    continue
+                started = time.perf_counter()
+                try:
+                    sink(item)
+                except BaseException as e:
+                    error = e
+                    self._cancelled.set()
+                self.busy_seconds[sink_name] += time.perf_counter() - started
+        finally:
+            if not drained:
+                # 等待结果时被中断（例如 Ctrl+C）：同样取消并排空，避免阶段线程阻塞在有界队列上
+                self._cancelled.set()
+                while queues[-1].get() is not _PIPELINE_DONE:
+                    pass
+            for thread in threads:
+                thread.join()
+        if error is None:
+            error = self._stage_error
+        if error is not None:
+            raise error
+
+
+class DocumentResultCache:
+    """
+    已完成文档最终内容的线程安全 LRU 缓存，按条目数和内容字节数限制大小，
+    避免常驻服务长时间运行时无限增长。
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[Tuple, Tuple[str, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Tuple) -> Optional[str]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key: Tuple, content: str):
+        size = len(content.encode("utf-8"))
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            # 单个结果就超过字节上限时不缓存
+            if self.max_bytes and size > self.max_bytes:
+                return
+            self._items[key] = (content, size)
+            self._bytes += size
+            while self._items and (
+                (self.max_entries and len(self._items) > self.max_entries)
+                or (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+
+# 已完成文档的最终内容，键为 (规范化文件键, 大小, 修改时间)；在 shared_resources_session 内跨工作簿复用
+_document_results = DocumentResultCache(
+    max_entries=CACHE_CONFIG.get("document_results_max_entries"),
+    max_bytes=CACHE_CONFIG.get("document_results_max_bytes"),
+)
+
+
+def get_document_result_key(file_key: Tuple, full_path: str) -> Optional[Tuple]:
+    """文档结果的缓存键，文件被修改后键随之变化；文件不存在时返回 None。"""
+    fingerprint = get_file_fingerprint(full_path)
+    if fingerprint is None:
+        return None
+    return (file_key, fingerprint["size"], fingerprint["mtime_ns"])
+
+
+def resolve_link_path(excel_base_dir: str, target: str) -> str:
+    """把超链接目标解析为绝对路径：相对路径基于工作簿所在目录。"""
+    if os.path.isabs(target):
+        # 如果路径已经是绝对路径 (例如 "C:\...")，则直接使用
+        return target
+    # 如果是相对路径，则与Excel文件所在目录进行拼接
+    return os.path.join(excel_base_dir, target)
+
+
+def get_file_fingerprint(file_path: str) -> Optional[Dict]:
+    """
+    获取链接文件的指纹（绝对路径、大小、修改时间），只需一次 stat 调用。
+    文件不存在时返回 None。
+    """
+    try:
+        stat_result = os.stat(file_path)
+    except OSError:
+        return None
+    return {
+        "path": os.path.abspath(file_path),
+        "size": stat_result.st_size,
+        "mtime_ns": stat_result.st_mtime_ns,
+    }
+
+
+def get_canonical_file_key(file_path: str) -> Tuple:
+    """
+    返回用于判断多个链接是否指向同一文件的键。
+    路径先规范化（解析 ..、符号链接，并按平台规则统一大小写）；文件存在时使用 (st_dev, st_ino)，
+    这样大小写不敏感的文件系统上大小写不同的路径、符号链接和硬链接也会被识别为同一文件。
+    """
+    canonical_path = os.path.normcase(os.path.realpath(file_path))
+    try:
+        stat_result = os.stat(canonical_path)
+    except OSError:
+        return ("path", canonical_path)
+    if stat_result.st_ino:
+        return ("inode", stat_result.st_dev, stat_result.st_ino)
+    return ("path", canonical_path)
+
+
+def get_fingerprint_store_path(excel_path: str) -> str:
+    """返回工作簿对应的指纹记录文件路径（与工作簿同目录）。"""
+    base, _ = os.path.splitext(os.path.abspath(excel_path))
+    return f"{base}.linkcontent.json"
+
+
+def load_fingerprints(store_path: str) -> Dict[str, Dict]:
+    """读取指纹记录，文件不存在或损坏时返回空字典。"""
+    try:
+        with open(store_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data.get("links", {}) if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"警告：读取指纹记录 '{store_path}' 失败，将重新处理所有链接: {e}")
+        return {}
+
+
+def save_fingerprints(store_path: str, fingerprints: Dict[str, Dict]):
+    """原子地写入指纹记录（先写临时文件再替换）。"""
+    temp_path = f"{store_path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "links": fingerprints}, f, ensure_ascii=False, indent=1)
+    os.replace(temp_path, store_path)
+
+
+def get_journal_path(excel_path: str) -> str:
+    """返回工作簿对应的断点续跑日志路径（与工作簿同目录）。"""
+    base, _ = os.path.splitext(os.path.abspath(excel_path))
+    return f"{base}.linkcontent.journal.jsonl"
+
+
+class CheckpointJournal:
+    """
+    预写日志：每个单元格的内容一生成就追加一行 JSON 并刷到磁盘，
+    进程崩溃、被杀或断电后，resume 模式可以从日志恢复已完成的单元格。
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.entries: Dict[str, Dict] = self._load() if resume else {}
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def _load(self) -> Dict[str, Dict]:
+        entries = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 崩溃时写了一半的最后一行
+                        continue
+                    if isinstance(entry, dict) and "key" in entry:
+                        entries[entry["key"]] = entry
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def find(self, task: Dict) -> Optional[Dict]:
+        """返回与任务匹配的日志记录：同一单元格、同一链接目标，且文件自记录后未变化。"""
+        entry = self.entries.get(task["fingerprint_key"])
+        if entry is None or entry.get("target") != task["target"]:
+            return None
+        if entry.get("fingerprint") != task["fingerprint"]:
+            return None
+        # 旧版本可能记录过图片分析失败、只含占位符的内容，这类记录重新处理
+        if has_unresolved_placeholders(entry.get("content")):
+            return None
+        return entry
+
+    def record(self, task: Dict, content: str):
+        entry = {
+            "key": task["fingerprint_key"],
+            "target": task["target"],
+            "fingerprint": task["fingerprint"],
+            "content": content,
+        }
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def remove(self):
+        """运行完整结束、工作簿已保存后删除日志。"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def save_workbook_atomically(workbook, path: str):
+    """先保存到同目录下的临时文件再替换目标文件，保存过程中崩溃不会留下损坏的工作簿。"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(
+        prefix=".~linkcontent_", suffix=os.path.splitext(path)[1], dir=directory
+    )
+    os.close(fd)
+    try:
+        workbook.save(temp_path)
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+# 外置内容在单元格中的标记，记录全文字数和相对于工作簿目录的文件键
+_SIDECAR_MARKER = "……（已截断：全文 {chars} 字，见 {key}）"
+_SIDECAR_MARKER_PATTERN = re.compile(r"……（已截断：全文 (\d+) 字，见 ([^）]+\.md\.gz)）\s*$")
+
+
+def get_sidecar_dir(workbook_path: str) -> str:
+    """超长内容的存储目录：SIDECAR_CONFIG["directory"]，默认为工作簿旁的 <工作簿名>.linkcontent。"""
+    configured = SIDECAR_CONFIG.get("directory")
+    if configured:
+        return os.path.abspath(configured)
+    base, _ = os.path.splitext(os.path.abspath(workbook_path))
+    return f"{base}.linkcontent"
+
+
+def store_oversized_content(content: str, workbook_path: str) -> str:
+    """
+    返回写入单元格的值：不超过 cell_budget 时原样返回；
+    否则把全文写入存储目录中的 <内容哈希>.md.gz（相同内容只写一次），返回预览加文件键。
+    文件先写入临时文件再替换，每个链接完成时立即落盘。
+    """
+    budget = SIDECAR_CONFIG.get("cell_budget", 32000)
+    if not SIDECAR_CONFIG.get("enabled", True) or len(content) <= budget:
+        return content
+
+    sidecar_dir = get_sidecar_dir(workbook_path)
+    digest = hashlib.sha1(content.encode("utf-8")).hexdigest()[:20]
+    sidecar_path = os.path.join(sidecar_dir, f"{digest}.md.gz")
+    with trace_span("store_sidecar", chars=len(content)) as span:
+        if not os.path.exists(sidecar_path):
+            os.makedirs(sidecar_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix=".~", suffix=".tmp", dir=sidecar_dir)
+            try:
+                with os.fdopen(fd, "wb") as raw, gzip.GzipFile(
+                    fileobj=raw,
+                    mode="wb",
+                    compresslevel=SIDECAR_CONFIG.get("compresslevel", 6),
+                    mtime=0,
+                ) as compressed:
+                    compressed.write(content.encode("utf-8"))
+                os.replace(temp_path, sidecar_path)
+            except BaseException:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+                raise
+        span["bytes"] = _file_size(sidecar_path)
+
+    key = os.path.relpath(sidecar_path, os.path.dirname(os.path.abspath(workbook_path)))
+    marker = _SIDECAR_MARKER.format(chars=len(content), key=key.replace(os.sep, "/"))
+    preview_chars = max(0, min(SIDECAR_CONFIG.get("preview_chars", 2000), budget - len(marker) - 2))
+    return f"{content[:preview_chars].rstrip()}\n\n{marker}"
+
+
+def read_full_cell_content(workbook_path: str, cell_value: Optional[str]) -> Optional[str]:
+    """读取内容单元格的全文：外置的内容从存储目录中读取，其余原样返回。"""
+    if not isinstance(cell_value, str):
+        return cell_value
+    match = _SIDECAR_MARKER_PATTERN.search(cell_value)
+    if match is None:
+        return cell_value
+    sidecar_path = os.path.join(
+        os.path.dirname(os.path.abspath(workbook_path)), *match.group(2).split("/")
+    )
+    with gzip.open(sidecar_path, "rt", encoding="utf-8") as f:
+        return f.read()
+
+
+def find_content_column(sheet, link_col_idx: int) -> Optional[int]:
+    """
+    查找紧跟在链接列之后、标题为 CONTENT_HEADER 的已有内容列。
+    找不到时返回 None。
+    """
+    header_value = sheet.cell(row=1, column=link_col_idx + 1).value
+    if isinstance(header_value, str) and header_value.strip() == CONTENT_HEADER:
+        return link_col_idx + 1
+    return None
+
+
+# SpreadsheetML 命名空间
+_SHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+# 在工作表 XML 的原始字节中定位根元素、dimension 和 hyperlinks（允许带命名空间前缀）
+_WORKSHEET_START_PATTERN = re.compile(rb"<(?:[\w.-]+:)?worksheet[\s>][^>]*>")
+_DIMENSION_PATTERN = re.compile(rb"<(?:[\w.-]+:)?dimension\s+ref=\"([^\"]+)\"")
+_HYPERLINKS_START_PATTERN = re.compile(rb"<(?:[\w.-]+:)?hyperlinks[\s/>]")
+_CELL_REF_PATTERN = re.compile(rb"<(?:[\w.-]+:)?c\s[^>]*?\br=\"([A-Z]{1,3})\d+\"")
+_SCAN_CHUNK_SIZE = 1024 * 1024
+
+
+def _scan_sheet_hyperlinks(sheet_file) -> Tuple[List[ET.Element], Optional[str]]:
+    """
+    只解析工作表 XML 中的 <hyperlinks> 部分，返回 (hyperlink 元素列表, dimension 的 ref)。
+    按块扫描原始字节找到 hyperlinks 元素的起点，只把根元素起始标签（含命名空间声明）
+    和此后的内容交给 XML 解析器，体积最大的 sheetData 不做解析。
+    """
+    head = sheet_file.read(_SCAN_CHUNK_SIZE)
+    root_match = _WORKSHEET_START_PATTERN.search(head)
+    if root_match is None or root_match.group().endswith(b"/>"):
+        return [], None
+    dimension_match = _DIMENSION_PATTERN.search(head, root_match.end())
+    dimension = dimension_match.group(1).decode("ascii") if dimension_match else None
+
+    buffer = head[root_match.end() :]
+    while True:
+        links_match = _HYPERLINKS_START_PATTERN.search(buffer)
+        if links_match is not None:
+            break
+        chunk = sheet_file.read(_SCAN_CHUNK_SIZE)
+        if not chunk:
+            return [], dimension
+        # 保留末尾少量字节，避免标签被切在两个块之间
+        buffer = buffer[-64:] + chunk
+
+    parser = ET.XMLPullParser(events=("end",))
+    parser.feed(head[: root_match.end()])
+    parser.feed(buffer[links_match.start() :])
+    hyperlinks = []
+    while True:
+        hyperlinks.extend(
+            element
+            for _, element in parser.read_events()
+            if element.tag == f"{_SHEET_NS}hyperlink"
+        )
+        chunk = sheet_file.read(_SCAN_CHUNK_SIZE)
+        if not chunk:
+            break
+        parser.feed(chunk)
+    parser.close()
+    hyperlinks.extend(
+        element for _, element in parser.read_events() if element.tag == f"{_SHEET_NS}hyperlink"
+    )
+    return hyperlinks, dimension
+
+
+def _scan_sheet_max_column(sheet_file) -> int:
+    """工作表缺少 dimension 时（例如 write_only 模式写出的文件），按块扫描单元格坐标求已用最大列。"""
+    from openpyxl.utils import column_index_from_string
+
+    max_letters = ""
+    tail = b""
+    while True:
+        chunk = sheet_file.read(_SCAN_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer = tail + chunk
+        for letters in _CELL_REF_PATTERN.findall(buffer):
+            if (len(letters), letters) > (len(max_letters), max_letters):
+                max_letters = letters
+        # 保留末尾少量字节，避免坐标被切在两个块之间
+        tail = buffer[-64:]
+    return column_index_from_string(max_letters.decode("ascii")) if max_letters else 0
+
+
+def build_hyperlink_index(excel_path: str) -> List[Dict]:
+    """
+    直接扫描压缩包中各工作表的 hyperlinks 元素和关系文件，一次性建立超链接索引，不读取单元格值。
+    返回按工作表顺序排列的列表（不含超链接的工作表被省略）：
+    [{"title": 工作表名, "max_column": 已用最大列号, "groups": {链接列号: [(行号, 链接目标), ...]},
+      "hyperlink_cells": [(行号, 列号), ...]}]
+    只在工作簿内部跳转的链接（没有外部目标）不进入 groups，但和外部链接一起记录在 hyperlink_cells 中，
+    插入内容列后据此修正超链接的坐标。
+    """
+    from openpyxl.utils import range_boundaries
+
+    index = []
+    with zipfile.ZipFile(excel_path) as zip_ref:
+        workbook_root = ET.fromstring(zip_ref.read("xl/workbook.xml"))
+        workbook_rels = _read_part_relationships(zip_ref, "xl/workbook.xml")
+
+        for sheet_element in workbook_root.iter(f"{_SHEET_NS}sheet"):
+            part_name = workbook_rels.get(sheet_element.get(f"{_R_NS}id"))
+            if not part_name or part_name not in zip_ref.NameToInfo:
+                continue
+            with zip_ref.open(part_name) as sheet_file:
+                hyperlinks, dimension = _scan_sheet_hyperlinks(sheet_file)
+            if not hyperlinks:
+                continue
+
+            sheet_rels = _read_part_relationships(zip_ref, part_name, include_external=True)
+            groups: Dict[int, Dict[int, str]] = {}
+            hyperlink_cells = set()
+            for element in hyperlinks:
+                target = sheet_rels.get(element.get(f"{_R_NS}id"))
+                ref = element.get("ref")
+                if not ref:
+                    continue
+                # ref 可以是单元格区域，区域内每个单元格都指向同一目标
+                min_col, min_row, max_col, max_row = range_boundaries(ref)
+                for column in range(min_col, max_col + 1):
+                    for row in range(min_row, max_row + 1):
+                        hyperlink_cells.add((row, column))
+                        if target:
+                            groups.setdefault(column, {}).setdefault(row, target)
+            if not groups:
+                continue
+
+            if dimension:
+                max_column = range_boundaries(dimension)[2] or 0
+            else:
+                with zip_ref.open(part_name) as sheet_file:
+                    max_column = _scan_sheet_max_column(sheet_file)
+
+            index.append(
+                {
+                    "title": sheet_element.get("name"),
+                    "max_column": max(max_column, max(groups)),
+                    "groups": {
+                        column: sorted(rows.items()) for column, rows in sorted(groups.items())
+                    },
+                    "hyperlink_cells": sorted(hyperlink_cells),
+                }
+            )
+    return index
+
+
+def find_appended_content_column(sheet, header: str) -> Optional[int]:
+    """在第一行中查找标题为 header 的追加内容列，找不到时返回 None。"""
+    for cell in next(sheet.iter_rows(min_row=1, max_row=1), ()):
+        if isinstance(cell.value, str) and cell.value.strip() == header:
+            return cell.column
+    return None
+
+
+def _shift_range_ref(ref: str, column: int) -> str:
+    """
+    返回在 column 处插入一列后区域引用的新坐标：整体位于插入列及其右侧的区域右移一列，
+    跨越插入列的区域向右扩展一列（与 Excel 插入列的行为一致），其余区域不变。
+    """
+    from openpyxl.utils import get_column_letter, range_boundaries
+
+    min_col, min_row, max_col, max_row = range_boundaries(ref)
+    if max_col is None or max_col < column:
+        return ref
+    if min_col >= column:
+        min_col += 1
+    max_col += 1
+    if min_row is None:
+        return f"{get_column_letter(min_col)}:{get_column_letter(max_col)}"
+    start = f"{get_column_letter(min_col)}{min_row}"
+    end = f"{get_column_letter(max_col)}{max_row}"
+    return start if start == end else f"{start}:{end}"
+
+
+def insert_column_keeping_hyperlinks(
+    sheet, column: int, hyperlink_cells: List[Tuple[int, int]]
+) -> List[Tuple[int, int]]:
+    """
+    用 insert_cols 插入一列，并修正 insert_cols 不会随单元格移动的内容：
+    被右移单元格上超链接的 ref、合并单元格区域、条件格式和数据验证的区域。
+    hyperlink_cells 为插入前所有超链接单元格的 (行号, 列号)（来自 build_hyperlink_index），
+    返回插入后的新坐标，连续插入多列时传给下一次调用。
+    """
+    from openpyxl.formatting.formatting import ConditionalFormattingList
+    from openpyxl.worksheet.cell_range import MultiCellRange
+
+    sheet.insert_cols(column)
+
+    # openpyxl 的 insert_cols 只移动单元格，超链接仍记录原坐标，保存后会错位到原来的位置
+    shifted_cells = []
+    for row, col in hyperlink_cells:
+        if col >= column:
+            col += 1
+            cell = sheet.cell(row=row, column=col)
+            if cell.hyperlink is not None:
+                cell.hyperlink.ref = cell.coordinate
+        shifted_cells.append((row, col))
+
+    # 区域对象的哈希随坐标变化，修改后重新构造集合
+    merged_ranges = list(sheet.merged_cells.ranges)
+    for merged_range in merged_ranges:
+        if merged_range.min_col >= column:
+            merged_range.shift(col_shift=1)
+        elif merged_range.max_col >= column:
+            merged_range.expand(right=1)
+    sheet.merged_cells = MultiCellRange(merged_ranges)
+
+    conditional_formatting = ConditionalFormattingList()
+    for formatting in sheet.conditional_formatting:
+        sqref = " ".join(_shift_range_ref(ref, column) for ref in str(formatting.sqref).split())
+        for rule in formatting.rules:
+            conditional_formatting.add(sqref, rule)
+    sheet.conditional_formatting = conditional_formatting
+
+    for validation in sheet.data_validations.dataValidation:
+        validation.sqref = MultiCellRange(
+            " ".join(_shift_range_ref(ref, column) for ref in str(validation.sqref).split())
+        )
+    return shifted_cells
+
+
+def assign_content_columns(
+    sheet, sheet_info: Dict, layout: str, incremental: bool
+) -> Dict[int, Tuple[int, int]]:
+    """
+    为工作表中的每个链接列确定内容列，返回 {原链接列号: (当前链接列号, 内容列号)}。
+    insert 模式从左到右逐列插入，插入导致的右移通过 offset 累计；
+    append / stream 模式把内容列依次追加到已用区域之后，已有单元格不移动。
+    sheet 为 None（stream 模式）时只计算列号，不修改工作表。
+    """
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    columns = {}
+    title = sheet_info["title"]
+
+    if layout == "insert":
+        offset = 0
+        hyperlink_cells = sheet_info.get("hyperlink_cells", [])
+        for link_col in sheet_info["groups"]:
+            current_col = link_col + offset
+            existing_col = find_content_column(sheet, current_col) if incremental else None
+            if existing_col is not None:
+                print(
+                    f"[{title}] 检测到链接列为 {get_column_letter(current_col)} 列。 "
+                    f"复用已有的 {get_column_letter(existing_col)} 列。"
+                )
+                columns[link_col] = (current_col, existing_col)
+                continue
+
+            content_col = current_col + 1
+            print(
+                f"[{title}] 检测到链接列为 {get_column_letter(current_col)} 列。 "
+                f"将在 {get_column_letter(content_col)} 列插入新内容。"
+            )
+            hyperlink_cells = insert_column_keeping_hyperlinks(sheet, content_col, hyperlink_cells)
+            header_cell = sheet.cell(row=1, column=content_col)
+            header_cell.value = CONTENT_HEADER
+            header_cell.font = Font(bold=True)
+            columns[link_col] = (current_col, content_col)
+            offset += 1
+        return columns
+
+    next_col = max(sheet_info["max_column"], sheet.max_column if sheet is not None else 0) + 1
+    for link_col in sheet_info["groups"]:
+        header = f"{CONTENT_HEADER}（{get_column_letter(link_col)}列）"
+        existing_col = (
+            find_appended_content_column(sheet, header)
+            if incremental and sheet is not None
+            else None
+        )
+        if existing_col is not None:
+            print(
+                f"[{title}] 检测到链接列为 {get_column_letter(link_col)} 列。 "
+                f"复用已有的 {get_column_letter(existing_col)} 列。"
+            )
+            columns[link_col] = (link_col, existing_col)
+            continue
+
+        print(
+            f"[{title}] 检测到链接列为 {get_column_letter(link_col)} 列。 "
+            f"内容追加到 {get_column_letter(next_col)} 列。"
+        )
+        if sheet is not None:
+            header_cell = sheet.cell(row=1, column=next_col)
+            header_cell.value = header
+            header_cell.font = Font(bold=True)
+        sheet_info.setdefault("headers", {})[next_col] = header
+        columns[link_col] = (link_col, next_col)
+        next_col += 1
+    return columns
+
+
+def save_streamed_workbook(
+    source_path: str,
+    output_path: str,
+    hyperlink_index: List[Dict],
+    contents: Dict[Tuple[str, int, int], str],
+):
+    """
+    stream 模式的写出：以只读模式逐行读取原工作簿，用 write_only 模式写出新文件，
+    同时补上追加的内容列和原有的超链接。只保留单元格值（样式、合并单元格等不复制）。
+    contents 的键为 (工作表名, 行号, 内容列号)。
+    """
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+
+    sheet_infos = {info["title"]: info for info in hyperlink_index}
+    rows_by_sheet: Dict[str, Dict[int, Dict[int, str]]] = {}
+    for (title, row, column), value in contents.items():
+        rows_by_sheet.setdefault(title, {}).setdefault(row, {})[column] = value
+
+    source = openpyxl.load_workbook(source_path, read_only=True)
+    target = openpyxl.Workbook(write_only=True)
+    try:
+        for source_sheet in source.worksheets:
+            target_sheet = target.create_sheet(source_sheet.title)
+            info = sheet_infos.get(source_sheet.title)
+            if info is None:
+                for values in source_sheet.iter_rows(values_only=True):
+                    target_sheet.append(values)
+                continue
+
+            headers = info.get("headers", {})
+            width = max([info["max_column"], *headers])
+            links_by_row: Dict[int, Dict[int, str]] = {}
+            for column, rows in info["groups"].items():
+                for row, link_target in rows:
+                    links_by_row.setdefault(row, {})[column] = link_target
+            extra_rows = rows_by_sheet.get(source_sheet.title, {})
+            last_row = max([0, *extra_rows, *links_by_row])
+
+            def build_row(row_idx: int, values) -> List:
+                row_values = list(values) + [None] * (width - len(values))
+                if row_idx == 1:
+                    for column, header in headers.items():
+                        row_values[column - 1] = header
+                for column, value in extra_rows.get(row_idx, {}).items():
+                    row_values[column - 1] = value
+                for column, link_target in links_by_row.get(row_idx, {}).items():
+                    cell = WriteOnlyCell(target_sheet, row_values[column - 1])
+                    cell.hyperlink = link_target
+                    row_values[column - 1] = cell
+                return row_values
+
+            row_idx = 0
+            for row_idx, values in enumerate(source_sheet.iter_rows(values_only=True), 1):
+                target_sheet.append(build_row(row_idx, values))
+            # 超链接所在的行在源数据中没有任何单元格值时补齐
+            for row_idx in range(row_idx + 1, last_row + 1):
+                target_sheet.append(build_row(row_idx, ()))
+        target.save(output_path)
+    finally:
+        source.close()
+
+
+def process_excel_in_place(
+    excel_path: str,
+    incremental: bool = False,
+    workers: Optional[int] = None,
+    layout: Optional[str] = None,
+    output_path: Optional[str] = None,
+    resume: bool = False,
+) -> Dict:
+    """
+    自动查找所有工作表中的链接列，为每个链接列添加一个内容列，
+    用链接文档的内容填充它，并直接在原文件上保存更改。
+    新版本支持图片提取和多模态LLM分析。
+
+    超链接通过直接扫描各工作表的 XML 关系建立索引，按 (工作表, 列) 分组，
+    每组对应一个内容列，所有链接进入同一个任务队列统一调度。
+    incremental=True 时启用增量模式：复用已有的内容列而不是新建，
+    并根据记录的文件指纹只重新处理新增或已变化的链接。文件指纹在每次成功保存工作簿时都会记录
+    （与是否增量无关），普通运行之后的第一次增量运行也能跳过未变化的链接。
+    workers > 1 时使用多进程并行解析各链接文档（默认取 PROCESSING_CONFIG["parse_workers"]），
+    图片分析和单元格写回始终在主进程中进行。PROCESSING_CONFIG["pipeline"] 开启时各步骤组成分阶段流水线，
+    解析下一个链接与分析上一个链接的图片同时进行。
+    layout 指定内容列的写入方式（insert / append / stream，默认取 WORKBOOK_CONFIG["layout"]）；
+    stream 模式不修改原文件，结果写入 output_path（默认在原文件名后加 stream_suffix）。
+    每个单元格完成后写入断点续跑日志，并按 CHECKPOINT_CONFIG 定期原子保存工作簿；
+    resume=True 时复用已有的内容列，并跳过日志中已完成的链接。
+
+    返回本次运行的汇总字典（status 为 ok / no_links / failed，以及各类链接计数和输出路径）。
+    """
+    import openpyxl
+    from openpyxl.utils import get_column_letter
+
+    started = time.monotonic()
+    summary = {
+        "workbook": os.path.abspath(excel_path),
+        "status": "failed",
+        "output": None,
+        "links": 0,
+        "processed": 0,
+        "skipped": 0,
+        "resumed": 0,
+        "duplicates": 0,
+        "reused": 0,
+        "missing": 0,
+        "failed": 0,
+        "seconds": 0.0,
+    }
+
+    def finish_summary(status: str) -> Dict:
+        summary["status"] = status
+        summary["seconds"] = round(time.monotonic() - started, 3)
+        return summary
+
+    if layout is None:
+        layout = WORKBOOK_CONFIG.get("layout", "insert")
+    auto_append_bytes = WORKBOOK_CONFIG.get("auto_append_bytes") or 0
+    if layout == "insert" and auto_append_bytes:
+        if (_file_size(excel_path) or 0) > auto_append_bytes:
+            print("工作簿较大，改用追加列模式（不移动已有单元格）。")
+            layout = "append"
+    if layout not in ("insert", "append", "stream"):
+        print(f"错误：不支持的写入方式 '{layout}'，可选 insert / append / stream。")
+        return finish_summary("failed")
+
+    try:
+        hyperlink_index = build_hyperlink_index(excel_path)
+        # stream 模式在保存时才以只读方式流式读取，不整体加载工作簿
+        workbook = None if layout == "stream" else openpyxl.load_workbook(excel_path)
+        print(f"成功加载文件: '{excel_path}'")
+    except FileNotFoundError:
+        print(f"错误：Excel 文件 '{excel_path}' 不存在。请检查路径是否正确。")
+        return finish_summary("failed")
+    except Exception as e:
+        print(f"加载 Excel 文件 '{excel_path}' 时出错: {e}")
+        return finish_summary("failed")
+
+    # 获取Excel文件所在的绝对目录
+    excel_base_dir = os.path.dirname(os.path.abspath(excel_path))
+    print(f"将基于此目录解析相对路径: '{excel_base_dir}'")
+
+    link_count = sum(
+        len(rows) for sheet_info in hyperlink_index for rows in sheet_info["groups"].values()
+    )
+    summary["links"] = link_count
+    if not link_count:
+        print("在此文件中未找到任何超链接。未做任何更改。")
+        return finish_summary("no_links")
+
+    group_count = sum(len(sheet_info["groups"]) for sheet_info in hyperlink_index)
+    print(
+        f"找到了 {link_count} 个超链接"
+        f"（{len(hyperlink_index)} 个工作表，{group_count} 个链接列）。"
+    )
+
+    if layout == "stream":
+        if output_path is None:
+            base, extension = os.path.splitext(excel_path)
+            output_path = f"{base}{WORKBOOK_CONFIG.get('stream_suffix', '_linkcontent')}{extension}"
+        if incremental:
+            print("提示：stream 模式写出新文件，不支持增量模式，将处理所有链接。")
+            incremental = False
+    else:
+        output_path = excel_path
+    summary["output"] = os.path.abspath(output_path)
+
+    # 增量模式：读取上次运行记录的文件指纹（只有内容列非空的链接才可能被跳过）；
+    # 本次完成的链接的指纹每次保存工作簿时都会写出
+    fingerprint_store_path = get_fingerprint_store_path(excel_path)
+    old_fingerprints = load_fingerprints(fingerprint_store_path) if incremental else {}
+    new_fingerprints = {}
+    skipped_count = 0
+    resumed_count = 0
+    # stream 模式的结果先按 (工作表, 行, 内容列) 暂存，保存时一次性流式写出
+    stream_contents: Dict[Tuple[str, int, int], str] = {}
+
+    # 断点续跑日志：resume 时读取已完成的单元格，否则重新开始记录
+    journal = None
+    if CHECKPOINT_CONFIG.get("journal", True):
+        journal_path = get_journal_path(excel_path)
+        if not resume and os.path.exists(journal_path):
+            print(f"提示：发现上次未完成的日志 '{journal_path}'，未指定 resume，将重新处理。")
+        journal = CheckpointJournal(journal_path, resume=resume)
+    elif resume:
+        print("提示：CHECKPOINT_CONFIG 未启用日志，resume 只会复用已有的内容列。")
+
+    def write_content(task: Dict, value: str):
+        if task["content_cell"] is not None:
+            task["content_cell"].value = value
+        else:
+            stream_contents[(task["sheet"], task["row"], task["content_col"])] = value
+
+    # 第一遍：为每个链接列确定内容列，解析路径并按指纹和日志筛选出需要处理的链接
+    tasks = []
+    for sheet_info in hyperlink_index:
+        title = sheet_info["title"]
+        sheet = workbook[title] if workbook is not None else None
+        # 增量和续跑模式都复用已有的内容列（续跑时工作簿可能已在检查点保存过）
+        content_columns = assign_content_columns(
+            sheet, sheet_info, layout, incremental or resume
+        )
+
+        for link_col, links in sheet_info["groups"].items():
+            current_link_col, content_col_idx = content_columns[link_col]
+            for row, relative_or_absolute_path in links:
+                # 这是从Excel中读取的原始路径，可能是相对的
+                full_path = resolve_link_path(excel_base_dir, relative_or_absolute_path)
+
+                coordinate = f"{get_column_letter(current_link_col)}{row}"
+                fingerprint_key = f"{title}!{coordinate}"
+                fingerprint = get_file_fingerprint(full_path)
+                content_cell = (
+                    sheet.cell(row=row, column=content_col_idx) if sheet is not None else None
+                )
+                task = {
+                    "sheet": title,
+                    "row": row,
+                    "coordinate": coordinate,
+                    "content_col": content_col_idx,
+                    "content_cell": content_cell,
+                    "target": relative_or_absolute_path,
+                    "full_path": full_path,
+                    "fingerprint_key": fingerprint_key,
+                    "fingerprint": fingerprint,
+                }
+
+                # 增量模式：文件未变化且已有内容时直接跳过
+                if (
+                    incremental
+                    and fingerprint is not None
+                    and old_fingerprints.get(fingerprint_key) == fingerprint
+                    and content_cell.value not in (None, "")
+                ):
+                    new_fingerprints[fingerprint_key] = fingerprint
+                    skipped_count += 1
+                    continue
+
+                # 续跑模式：日志中已有该单元格的结果时直接写回
+                entry = journal.find(task) if resume and journal is not None else None
+                if entry is not None:
+                    write_content(task, entry["content"])
+                    if fingerprint is not None:
+                        new_fingerprints[fingerprint_key] = fingerprint
+                    resumed_count += 1
+                    continue
+
+                tasks.append(task)
+
+    # 同一文件被多个单元格引用时只处理一次，结果写回所有引用它的单元格
+    tasks_by_file: Dict[Tuple, Dict] = {}
+    for task in tasks:
+        file_key = get_canonical_file_key(task["full_path"])
+        primary = tasks_by_file.get(file_key)
+        if primary is None:
+            task["file_key"] = file_key
+            task["duplicates"] = []
+            tasks_by_file[file_key] = task
+        else:
+            primary["duplicates"].append(task)
+    duplicate_link_count = len(tasks) - len(tasks_by_file)
+    missing_count = sum(
+        1 + len(task["duplicates"])
+        for task in tasks_by_file.values()
+        if not os.path.isfile(task["full_path"])
+    )
+
+    finished_since_save = 0
+    last_save = time.monotonic()
+
+    def save_fingerprint_store():
+        """记录已写入工作簿的链接的文件指纹；stream 模式不修改原文件，不记录。"""
+        if workbook is None:
+            return
+        try:
+            save_fingerprints(fingerprint_store_path, new_fingerprints)
+        except Exception as e:
+            print(f"    保存文件指纹失败，下次增量运行将重新处理这些链接: {e}")
+
+    def maybe_checkpoint():
+        """按 CHECKPOINT_CONFIG 定期原子保存工作簿（stream 模式只依赖日志）。"""
+        nonlocal finished_since_save, last_save
+        if workbook is None:
+            return
+        every_links = CHECKPOINT_CONFIG.get("save_every_links") or 0
+        every_seconds = CHECKPOINT_CONFIG.get("save_every_seconds") or 0
+        if not (
+            (every_links and finished_since_save >= every_links)
+            or (every_seconds and time.monotonic() - last_save >= every_seconds)
+        ):
+            return
+        try:
+            with trace_span("checkpoint_save", file=output_path) as span:
+                save_workbook_atomically(workbook, output_path)
+                span["bytes"] = _file_size(output_path)
+            save_fingerprint_store()
+            print(f"    [检查点] 已保存工作簿（本段完成 {finished_since_save} 个链接）")
+        except Exception as e:
+            print(f"    [检查点] 保存工作簿失败，稍后重试: {e}")
+        finished_since_save = 0
+        last_save = time.monotonic()
+
+    def write_results(task: Dict, content: str, completed: bool):
+        """
+        把结果写回任务及引用同一文件的所有单元格。
+        completed=True 表示内容完整（没有出错、图片分析全部成功），会记录指纹和日志，
+        下次增量或续跑时可以跳过；否则下次重新处理。
+        """
+        nonlocal finished_since_save
+        # 仍带占位符的内容引用的是临时图片，不能作为完成结果写入日志或跨工作簿复用
+        completed = completed and not has_unresolved_placeholders(content)
+        # 超长内容外置到存储目录，单元格和日志中只保存预览和文件键
+        cell_value = store_oversized_content(content, output_path)
+        for linked_task in [task, *task["duplicates"]]:
+            write_content(linked_task, cell_value)
+            if not completed:
+                continue
+            if linked_task["fingerprint"] is not None:
+                new_fingerprints[linked_task["fingerprint_key"]] = linked_task["fingerprint"]
+            if journal is not None:
+                journal.record(linked_task, cell_value)
+        if completed:
+            result_key = get_document_result_key(task["file_key"], task["full_path"])
+            if result_key is not None:
+                _document_results.put(result_key, content)
+        finished_since_save += 1 + len(task["duplicates"])
+        maybe_checkpoint()
+
+    # 同一会话中其他工作簿已经处理过的文件直接复用结果
+    reused_count = 0
+    pending_tasks = []
+    for task in tasks_by_file.values():
+        result_key = (
+            get_document_result_key(task["file_key"], task["full_path"])
+            if _document_results
+            else None
+        )
+        reused_content = _document_results.get(result_key) if result_key is not None else None
+        if reused_content is not None:
+            write_results(task, reused_content, completed=True)
+            reused_count += 1 + len(task["duplicates"])
+        else:
+            pending_tasks.append(task)
+    tasks = pending_tasks
+
+    if workers is None:
+        workers = PROCESSING_CONFIG.get("parse_workers", 1)
+    workers = max(1, int(workers))
+
+    # 整个工作簿共用一个去重索引，跨链接复用相同图片的描述
+    deduplicator = create_image_deduplicator()
+    triage_skipped_before = _triage_totals["skipped"]
+    failed_count = 0
+
+    def finish_task(
+        task: Dict,
+        prepared: Optional[Tuple[str, List[str]]],
+        error=None,
+        final_markdown: Optional[str] = None,
+        completed: bool = False,
+    ):
+        """
+        在主进程中完成图片分析并写回单元格（openpyxl 只在主进程中访问）。
+        流水线模式下图片分析已在各阶段线程中完成，传入 final_markdown 和 completed 时只写回。
+        """
+        nonlocal failed_count
+        try:
+            if error is not None:
+                raise error
+            if final_markdown is None:
+                markdown_with_placeholders, image_paths = prepared
+                final_markdown, completed = enrich_document_checked(
+                    markdown_with_placeholders, image_paths, deduplicator
+                )
+
+            # 步骤5: 插入到Excel单元格（包括引用同一文件的其他单元格）
+            # 有图片没有得到描述（未配置密钥、接口出错、分析失败）时不记录指纹和日志，下次运行时重试
+            write_results(task, final_markdown, completed=completed)
+            if not completed:
+                print(f"    部分图片未能分析，下次运行时将重新处理")
+
+            print(f"    完成")
+
+        except Exception as e:
+            print(f"    处理出错: {e}")
+            failed_count += 1 + len(task["duplicates"])
+            # 出错时使用原始文本
+            write_results(task, get_fallback_content(task["full_path"]), completed=False)
+
+    def describe_task(task: Dict) -> str:
+        duplicate_note = (
+            f"（另有 {len(task['duplicates'])} 个单元格引用同一文件）"
+            if task["duplicates"]
+            else ""
+        )
+        return (
+            f"  - 正在处理 {task['fingerprint_key']}: "
+            f"'{task['target']}' -> 解析为 '{task['full_path']}'{duplicate_note}"
+        )
+
+    profile_target = TRACE_CONFIG.get("profile_link")
+
+    def is_profile_target(task: Dict) -> bool:
+        return bool(profile_target) and profile_target in (
+            task["coordinate"],
+            task["fingerprint_key"],
+            task["target"],
+            task["full_path"],
+        )
+
+    def run_task_stages(task: Dict):
+        try:
+            prepared = prepare_document(task["full_path"], temp_manager)
+        except Exception as e:
+            finish_task(task, None, e)
+            return
+        finish_task(task, prepared)
+
+    def run_task_locally(task: Dict):
+        """在主进程中完成一个链接的解析和图片分析；命中 profile_link 时进行性能剖析。"""
+        print(describe_task(task))
+        if is_profile_target(task):
+            base, _ = os.path.splitext(os.path.abspath(excel_path))
+            profile_path = f"{base}.{task['coordinate']}.prof"
+            with profile_section(task["fingerprint_key"], profile_path):
+                run_task_stages(task)
+        else:
+            run_task_stages(task)
+
+    def run_pipeline(pipeline_tasks: List[Dict]):
+        """
+        分阶段流水线：解析 → 图片预处理 → 图片分析 → 替换占位符 → 写回单元格。
+        workers > 1 时解析阶段的每个线程把文档交给解析进程池并等待结果，
+        大型PDF在解析线程中直接解析，页码范围由 extract_pdf_pages 分发给进程池并行提取；
+        写回阶段在当前线程中执行，保证 openpyxl、日志和检查点只在一个线程中访问。
+        """
+        executor = get_parse_pool(workers) if workers > 1 else None
+
+        def parse_stage(item: Dict):
+            task = item["task"]
+            print(describe_task(task))
+            if executor is None or is_page_parallel_pdf(task["full_path"]):
+                item["markdown"], item["image_paths"] = prepare_document(
+                    task["full_path"], temp_manager
+                )
+                return
+            future = executor.submit(
+                _prepare_document_in_worker, task["full_path"], temp_manager.temp_dir
+            )
+            item["markdown"], item["image_paths"], spans = future.result()
+            if _active_tracer is not None:
+                _active_tracer.extend(spans)
+
+        def image_stage(item: Dict):
+            item["descriptions"], item["to_analyze"] = prepare_images(
+                item["image_paths"], deduplicator
+            )
+
+        def llm_stage(item: Dict):
+            item["descriptions"] = describe_images(
+                item["descriptions"], item["to_analyze"], deduplicator
+            )
+
+        def replace_stage(item: Dict):
+            descriptions = item.pop("descriptions")
+            item["completed"] = images_fully_described(item["image_paths"], descriptions)
+            item["final_markdown"] = apply_image_descriptions(
+                item.pop("markdown"), item["image_paths"], descriptions
+            )
+
+        def write_stage(item: Dict):
+            finish_task(
+                item["task"],
+                None,
+                item["error"],
+                final_markdown=item.get("final_markdown"),
+                completed=item.get("completed", False),
+            )
+
+        # 图片预处理阶段固定单线程，去重索引按链接顺序分配代表图片
+        pipeline = StagePipeline(
+            [
+                ("解析", parse_stage, workers),
+                ("图片预处理", image_stage, 1),
+                ("图片分析", llm_stage, PROCESSING_CONFIG.get("llm_workers", 1)),
+                ("替换占位符", replace_stage, 1),
+            ],
+            queue_size=PROCESSING_CONFIG.get("queue_size", 2),
+        )
+        print(
+            f"使用分阶段流水线处理 {len(pipeline_tasks)} 个文件"
+            f"（解析 {workers}，图片分析 {pipeline.stages[2][2]} 个并发）..."
+        )
+        started_at = time.perf_counter()
+        pipeline.run([{"task": task} for task in pipeline_tasks], write_stage, "写回单元格")
+        busy = "，".join(
+            f"{name} {seconds:.2f}s" for name, seconds in pipeline.busy_seconds.items()
+        )
+        print(
+            f"\n流水线各阶段累计耗时: {busy}；"
+            f"总耗时 {time.perf_counter() - started_at:.2f}s"
+        )
+
+    saved = False
+    with tracing_session(excel_path):
+        # 使用临时文件管理器来管理提取的图片
+        with TempFileManager() as temp_manager:
+            use_pipeline = PROCESSING_CONFIG.get("pipeline", True) and len(tasks) > 1
+            # 需要剖析的链接始终在主进程中单独处理，其余链接按 workers 串行或并行解析
+            pool_tasks = tasks
+            if (workers > 1 or use_pipeline) and profile_target:
+                for task in tasks:
+                    if is_profile_target(task):
+                        run_task_locally(task)
+                pool_tasks = [task for task in tasks if not is_profile_target(task)]
+
+            if use_pipeline:
+                if pool_tasks:
+                    run_pipeline(pool_tasks)
+            elif workers == 1 or len(tasks) <= 1:
+                for task in tasks:
+                    run_task_locally(task)
+            elif pool_tasks:
+                # 多进程并行解析文档，主进程负责LLM分析和写回单元格
+                print(f"使用 {workers} 个进程并行解析文档...")
+                executor = get_parse_pool(workers)
+                # 大型PDF在主进程中解析，页码范围分发给进程池，与其他文档的解析任务一起排队
+                large_pdf_tasks = [
+                    task for task in pool_tasks if is_page_parallel_pdf(task["full_path"])
+                ]
+                futures = {
+                    executor.submit(
+                        _prepare_document_in_worker,
+                        task["full_path"],
+                        temp_manager.temp_dir,
+                    ): task
+                    for task in pool_tasks
+                    if task not in large_pdf_tasks
+                }
+                for task in large_pdf_tasks:
+                    run_task_locally(task)
+                for future in as_completed(futures):
+                    task = futures[future]
+                    print(describe_task(task))
+                    try:
+                        markdown_with_placeholders, image_paths, spans = future.result()
+                    except Exception as e:
+                        finish_task(task, None, e)
+                        continue
+                    if _active_tracer is not None:
+                        _active_tracer.extend(spans)
+                    finish_task(task, (markdown_with_placeholders, image_paths))
+
+        if skipped_count:
+            print(f"\n增量模式：{skipped_count} 个链接的文件未变化，已跳过。")
+
+        if resumed_count:
+            print(f"\n续跑模式：{resumed_count} 个链接已在日志中完成，直接复用。")
+
+        if duplicate_link_count:
+            print(
+                f"\n链接去重: {duplicate_link_count} 个链接与其他链接指向同一文件，"
+                f"实际处理 {len(tasks_by_file)} 个文件，结果已写回所有引用单元格"
+            )
+
+        if reused_count:
+            print(f"\n{reused_count} 个链接的文件已在本次会话的其他工作簿中处理过，直接复用结果。")
+
+        if deduplicator is not None and (
+            deduplicator.exact_duplicates or deduplicator.near_duplicates
+        ):
+            print(
+                f"\n图片去重: 完全相同 {deduplicator.exact_duplicates} 张，"
+                f"视觉近似 {deduplicator.near_duplicates} 张，均复用了代表图片的描述"
+            )
+        triage_skipped = _triage_totals["skipped"] - triage_skipped_before
+        if triage_skipped:
+            print(f"\n图片预筛: {triage_skipped} 张图标、分隔线或纯色图片未调用模型分析")
+        close_shared_resources()
+
+        try:
+            if workbook is None:
+                print(f"\n正在流式写出新文件: '{output_path}'...")
+            else:
+                print(f"\n正在将更改保存到原始文件: '{excel_path}'...")
+            with trace_span("save_workbook", file=output_path, layout=layout) as span:
+                if workbook is None:
+                    save_streamed_workbook(
+                        excel_path, output_path, hyperlink_index, stream_contents
+                    )
+                else:
+                    save_workbook_atomically(workbook, output_path)
+                span["bytes"] = _file_size(output_path)
+            save_fingerprint_store()
+            saved = True
+            if workbook is None:
+                print("处理完成！结果已写入新文件，原始文件未修改。")
+            else:
+                print("处理完成！原始文件已更新。")
+        except PermissionError:
+            print(
+                f"\n错误：无法保存文件。请确保 '{output_path}' 没有被其他程序（如Excel）打开。"
+            )
+        except Exception as e:
+            print(f"\n保存文件 '{output_path}' 时发生未知错误: {e}")
+
+    # 保存成功后日志不再需要；保存失败时保留日志，可用 resume 继续
+    if journal is not None:
+        if saved:
+            journal.remove()
+        else:
+            journal.close()
+            print(f"已完成的单元格保存在日志 '{journal.path}' 中，可使用 resume 继续。")
+
+    summary.update(
+        processed=len(tasks),
+        skipped=skipped_count,
+        resumed=resumed_count,
+        duplicates=duplicate_link_count,
+        reused=reused_count,
+        missing=missing_count,
+        failed=failed_count,
+    )
+    return finish_summary("ok" if saved else "failed")
+
+
+def inspect_workbook_links(excel_path: str) -> Dict:
+    """
+    试运行：只建立超链接索引并检查链接文件是否存在，不解析文档、不调用API、不修改工作簿。
+    返回与 process_excel_in_place 相同结构的汇总字典（status 为 dry_run / no_links / failed）。
+    """
+    from openpyxl.utils import get_column_letter
+
+    started = time.monotonic()
+    summary = {"workbook": os.path.abspath(excel_path), "status": "failed", "links": 0}
+    try:
+        hyperlink_index = build_hyperlink_index(excel_path)
+    except Exception as e:
+        print(f"加载 Excel 文件 '{excel_path}' 时出错: {e}")
+        summary["seconds"] = round(time.monotonic() - started, 3)
+        return summary
+
+    excel_base_dir = os.path.dirname(os.path.abspath(excel_path))
+    file_keys = set()
+    missing = []
+    formats: Dict[str, int] = {}
+    for sheet_info in hyperlink_index:
+        for link_col, links in sheet_info["groups"].items():
+            for row, target in links:
+                summary["links"] += 1
+                full_path = resolve_link_path(excel_base_dir, target)
+                file_keys.add(get_canonical_file_key(full_path))
+                if not os.path.isfile(full_path):
+                    missing.append(f"{sheet_info['title']}!{get_column_letter(link_col)}{row}")
+                extension = os.path.splitext(full_path)[1].lower() or "(无扩展名)"
+                formats[extension] = formats.get(extension, 0) + 1
+
+    print(
+        f"[试运行] '{excel_path}': {summary['links']} 个超链接，"
+        f"{len(file_keys)} 个唯一文件，{len(missing)} 个链接文件不存在"
+    )
+    if formats:
+        print("  格式分布: " + "，".join(f"{ext} {count}" for ext, count in sorted(formats.items())))
+    for coordinate in missing[:20]:
+        print(f"  文件不存在: {coordinate}")
+    if len(missing) > 20:
+        print(f"  ……另有 {len(missing) - 20} 个")
+
+    summary.update(
+        status="dry_run" if summary["links"] else "no_links",
+        unique_files=len(file_keys),
+        missing=len(missing),
+        formats=formats,
+        seconds=round(time.monotonic() - started, 3),
+    )
+    return summary
+
+
+# --- 命令行入口 ---
+# 退出码：全部成功 / 有工作簿加载或保存失败 / 参数错误或没有找到工作簿 / 部分链接文件不存在或处理出错
+EXIT_OK = 0
+EXIT_WORKBOOK_FAILED = 1
+EXIT_USAGE = 2
+EXIT_LINKS_FAILED = 3
+EXIT_SERVICE_UNAVAILABLE = 4
+
+WORKBOOK_EXTENSIONS = (".xlsx", ".xlsm")
+
+
+def collect_workbook_paths(inputs: List[str], recursive: bool = False) -> List[str]:
+    """
+    展开命令行输入：文件、目录（查找其中的 .xlsx/.xlsm）或通配符，按出现顺序去重。
+    跳过 Excel 的锁文件（~$ 开头）以及本工具写出的副本。
+    """
+    output_suffix = WORKBOOK_CONFIG.get("stream_suffix", "_linkcontent")
+    paths = []
+    seen = set()
+
+    def add(path: str):
+        name = os.path.basename(path)
+        stem, extension = os.path.splitext(name)
+        if extension.lower() not in WORKBOOK_EXTENSIONS or name.startswith("~$"):
+            return
+        if output_suffix and stem.endswith(output_suffix):
+            return
+        key = os.path.normcase(os.path.abspath(path))
+        if key not in seen:
+            seen.add(key)
+            paths.append(path)
+
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*") if recursive else os.path.join(item, "*")
+            for path in sorted(glob.glob(pattern, recursive=recursive)):
+                if os.path.isfile(path):
+                    add(path)
+        elif os.path.isfile(item):
+            add(item)
+        else:
+            for path in sorted(glob.glob(item, recursive=True)):
+                if os.path.isfile(path):
+                    add(path)
+    return paths
+
+
+def get_copy_output_path(excel_path: str, output_dir: Optional[str] = None) -> str:
+    """--output copy 时副本的路径：<目录>/<工作簿名><stream_suffix>.xlsx。"""
+    base, extension = os.path.splitext(os.path.basename(excel_path))
+    directory = output_dir or os.path.dirname(os.path.abspath(excel_path))
+    suffix = WORKBOOK_CONFIG.get("stream_suffix", "_linkcontent")
+    return os.path.join(directory, f"{base}{suffix}{extension}")
+
+
+def run_workbook(
+    excel_path: str,
+    output: str = "inplace",
+    output_dir: Optional[str] = None,
+    layout: Optional[str] = None,
+    incremental: bool = False,
+    resume: bool = False,
+    dry_run: bool = False,
+    workers: Optional[int] = None,
+) -> Dict:
+    """
+    按命令行选项处理一个工作簿并返回汇总字典，命令行和常驻服务共用。
+    output="copy" 时写入 get_copy_output_path 给出的副本，不修改原文件。
+    """
+    if dry_run:
+        return inspect_workbook_links(excel_path)
+    target_path, output_path = excel_path, None
+    if output == "copy":
+        copy_path = get_copy_output_path(excel_path, output_dir)
+        if layout == "stream":
+            # stream 模式本身就写出新文件，不需要先复制
+            output_path = copy_path
+        else:
+            # 续跑时继续使用上次的副本（其中可能已有检查点保存的内容）
+            if not (resume and os.path.exists(copy_path)):
+                os.makedirs(os.path.dirname(copy_path), exist_ok=True)
+                shutil.copy2(excel_path, copy_path)
+            target_path = copy_path
+    summary = process_excel_in_place(
+        target_path,
+        incremental=incremental,
+        workers=workers,
+        layout=layout,
+        output_path=output_path,
+        resume=resume,
+    )
+    summary["source"] = os.path.abspath(excel_path)
+    return summary
+
+
+def extract_document_content(full_path: str) -> str:
+    """
+    提取单个文档的最终内容（解析 + 图片分析），出错时退回原始文本。
+    在 shared_resources_session 内，未修改过的文件直接复用之前的结果。
+    """
+    result_key = get_document_result_key(get_canonical_file_key(full_path), full_path)
+    if result_key is not None:
+        reused_content = _document_results.get(result_key)
+        if reused_content is not None:
+            return reused_content
+    with TempFileManager() as temp_manager:
+        try:
+            markdown_with_placeholders, image_paths = prepare_document(full_path, temp_manager)
+            content, completed = enrich_document_checked(
+                markdown_with_placeholders, image_paths, create_image_deduplicator()
+            )
+        except Exception as e:
+            print(f"    处理出错: {e}")
+            return get_fallback_content(full_path)
+    # 只缓存所有图片都得到描述的结果，失败的文档下次请求时重新分析
+    if result_key is not None and completed and not has_unresolved_placeholders(content):
+        _document_results.put(result_key, content)
+    return content
+
+
+# --- 常驻服务 ---
+
+# 服务支持的任务类型：workbook 处理一个工作簿，extract 提取单个文档的内容
+SERVICE_JOB_TYPES = ("workbook", "extract")
+# workbook 任务可以携带的参数（与 run_workbook 的关键字参数一致）
+WORKBOOK_JOB_OPTIONS = (
+    "output", "output_dir", "layout", "incremental", "resume", "dry_run", "workers",
+)
+_FINISHED_JOB_STATES = ("done", "failed", "cancelled")
+
+
+def get_service_token_path(port: int) -> str:
+    """返回服务自动生成的令牌文件路径（每个端口一个文件）。"""
+    return os.path.join(SERVICE_CONFIG["token_dir"], f"service-{port}.token")
+
+
+def read_service_token(port: int) -> Optional[str]:
+    """读取本机服务自动生成的令牌，文件不存在或无法读取时返回 None。"""
+    try:
+        with open(get_service_token_path(port), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _write_service_token(token_path: str, token: str):
+    """以仅当前用户可读写的权限写入令牌文件。"""
+    os.makedirs(os.path.dirname(token_path), mode=0o700, exist_ok=True)
+    fd = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        # 文件已存在时 os.open 不会修改权限
+        os.chmod(token_path, 0o600)
+        f.write(token)
+
+
+class LinkContentService:
+    """
+    常驻服务：在本机HTTP端口上接收任务，由单个工作线程按优先级依次执行。
+    所有任务在同一个 shared_resources_session 中运行，共享API连接池、图片描述缓存、
+    解析进程池和已完成文档的结果。工作簿处理依赖模块级的配置和追踪状态，因此任务串行执行，
+    并行度来自单个任务内部的解析进程池和LLM并发。
+    服务会原地改写任务指定的工作簿，因此所有请求都必须带令牌（未配置时自动生成），
+    配置了 allowed_roots 时任务中的路径还必须位于这些目录之内。
+
+    接口（JSON）：
+        GET    /health               服务状态和队列长度
+        POST   /jobs                 提交任务 {"type", "params", "priority"}，返回任务
+        GET    /jobs                 任务列表（不含结果）
+        GET    /jobs/<id>?wait=秒    查询任务，wait>0 时最多等待到任务结束
+        DELETE /jobs/<id>            取消排队中的任务
+        POST   /shutdown             执行完当前任务后退出，排队中的任务被取消
+    """
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        token: Optional[str] = None,
+        workers: Optional[int] = None,
+        allowed_roots: Optional[List[str]] = None,
+    ):
+        from http.server import ThreadingHTTPServer
+
+        self.workers = workers
+        self.token = token if token is not None else SERVICE_CONFIG.get("token")
+        self.token_path: Optional[str] = None
+        if allowed_roots is None:
+            allowed_roots = SERVICE_CONFIG.get("allowed_roots") or []
+        self.allowed_roots = [os.path.realpath(root) for root in allowed_roots]
+        self.started = time.time()
+        self._jobs: Dict[str, Dict] = {}
+        self._queue: List[Tuple[int, int, str]] = []
+        self._sequence = 0
+        self._stopping = False
+        self._condition = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._server = ThreadingHTTPServer(
+            (
+                host or SERVICE_CONFIG.get("host", "127.0.0.1"),
+                SERVICE_CONFIG.get("port", 8766) if port is None else port,
+            ),
+            self._make_handler(),
+        )
+        self._server.daemon_threads = True
+        if not self.token:
+            import secrets
+
+            self.token = secrets.token_urlsafe(32)
+            self.token_path = get_service_token_path(self._server.server_address[1])
+            _write_service_token(self.token_path, self.token)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # 任务队列
+
+    def submit(self, job_type: str, params: Dict, priority: int = 0) -> Dict:
+        """校验并排队一个任务，priority 越大越先执行，相同优先级按提交顺序。"""
+        import heapq
+
+        if job_type not in SERVICE_JOB_TYPES:
+            raise ValueError(f"不支持的任务类型: {job_type}")
+        if not isinstance(params, dict):
+            raise ValueError("params 必须是 JSON 对象")
+        path = params.get("path")
+        if not isinstance(path, str) or not os.path.isabs(path):
+            raise ValueError("params.path 必须是绝对路径（服务的工作目录与调用方不同）")
+        unknown = set(params) - {"path"} - (
+            set(WORKBOOK_JOB_OPTIONS) if job_type == "workbook" else set()
+        )
+        if unknown:
+            raise ValueError(f"不支持的参数: {', '.join(sorted(unknown))}")
+        self._check_allowed_path("params.path", path)
+        output_dir = params.get("output_dir")
+        if output_dir is not None:
+            if not isinstance(output_dir, str) or not os.path.isabs(output_dir):
+                raise ValueError("params.output_dir 必须是绝对路径")
+            self._check_allowed_path("params.output_dir", output_dir)
+        priority = int(priority or 0)
+
+        with self._condition:
+            if self._stopping:
+                raise RuntimeError("服务正在退出，不再接收任务")
+            self._sequence += 1
+            job_id = uuid.uuid4().hex[:12]
+            self._jobs[job_id] = {
+                "id": job_id,
+                "type": job_type,
+                "params": params,
+                "priority": priority,
+                "status": "queued",
+                "submitted": time.time(),
+                "started": None,
+                "finished": None,
+                "result": None,
+                "error": None,
+            }
+            heapq.heappush(self._queue, (-priority, self._sequence, job_id))
+            self._condition.notify_all()
+            return self._snapshot(self._jobs[job_id])
+
+    def _check_allowed_path(self, name: str, path: str):
+        """配置了 allowed_roots 时，解析符号链接后不在任何允许目录之内的路径抛出 PermissionError。"""
+        if not self.allowed_roots:
+            return
+        real_path = os.path.realpath(path)
+        for root in self.allowed_roots:
+            try:
+                if os.path.commonpath([root, real_path]) == root:
+                    return
+            except ValueError:
+                # Windows 上不同盘符的路径没有公共前缀
+                continue
+        raise PermissionError(f"{name} 不在服务允许访问的目录之内: {path}")
+
+    def get(self, job_id: str, wait: float = 0) -> Optional[Dict]:
+        """返回任务的当前状态；wait>0 时最多等待 wait 秒直到任务结束。"""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if wait > 0:
+                self._condition.wait_for(
+                    lambda: job["status"] in _FINISHED_JOB_STATES, timeout=wait
+                )
+            return self._snapshot(job)
+
+    def list_jobs(self) -> List[Dict]:
+        with self._condition:
+            return [
+                self._snapshot(job, include_result=False) for job in self._jobs.values()
+            ]
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """取消排队中的任务；正在执行或已结束的任务保持原状态。"""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] == "queued":
+                job.update(status="cancelled", finished=time.time())
+                self._condition.notify_all()
+            return self._snapshot(job)
+
+    def health(self) -> Dict:
+        with self._condition:
+            states = [job["status"] for job in self._jobs.values()]
+        return {
+            "status": "stopping" if self._stopping else "ok",
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started, 1),
+            "queued": states.count("queued"),
+            "running": states.count("running"),
+            "finished": sum(states.count(state) for state in _FINISHED_JOB_STATES),
+        }
+
+    def _snapshot(self, job: Dict, include_result: bool = True) -> Dict:
+        """任务的只读副本；排队中的任务附带前面还有多少个任务（调用方需持有锁）。"""
+        snapshot = {
+            key: value for key, value in job.items() if include_result or key != "result"
+        }
+        if job["status"] == "queued":
+            own_key = next(entry for entry in self._queue if entry[2] == job["id"])[:2]
+            snapshot["ahead"] = sum(
+                1
+                for entry in self._queue
+                if entry[:2] < own_key and self._jobs[entry[2]]["status"] == "queued"
+            ) + sum(1 for other in self._jobs.values() if other["status"] == "running")
+        return snapshot
+
+    def _prune_history(self):
+        """只保留最近 job_history 个已结束的任务（调用方需持有锁）。"""
+        limit = SERVICE_CONFIG.get("job_history", 200)
+        finished = [
+            job for job in self._jobs.values() if job["status"] in _FINISHED_JOB_STATES
+        ]
+        if len(finished) <= limit:
+            return
+        finished.sort(key=lambda job: job["finished"] or 0)
+        for job in finished[: len(finished) - limit]:
+            del self._jobs[job["id"]]
+
+    # 任务执行
+
+    def _next_job(self) -> Optional[Dict]:
+        import heapq
+
+        with self._condition:
+            while True:
+                while not self._queue and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return None
+                _, _, job_id = heapq.heappop(self._queue)
+                job = self._jobs.get(job_id)
+                if job is not None and job["status"] == "queued":
+                    job.update(status="running", started=time.time())
+                    self._condition.notify_all()
+                    return job
+
+    def _run_job(self, job: Dict) -> Dict:
+        params = job["params"]
+        if job["type"] == "workbook":
+            options = {key: params[key] for key in WORKBOOK_JOB_OPTIONS if key in params}
+            options.setdefault("workers", self.workers)
+            return run_workbook(params["path"], **options)
+        if not os.path.isfile(params["path"]):
+            return {"file": params["path"], "status": "missing", "chars": 0, "content": ""}
+        content = extract_document_content(params["path"])
+        return {"file": params["path"], "status": "ok", "chars": len(content), "content": content}
+
+    def _work_loop(self):
+        with shared_resources_session():
+            last_evict = time.monotonic()
+            while True:
+                job = self._next_job()
+                if job is None:
+                    return
+                print(f"\n===== [任务 {job['id']}] {job['type']}: {job['params']['path']} =====")
+                try:
+                    result, status, error = self._run_job(job), "done", None
+                except Exception as e:
+                    result, status, error = None, "failed", f"{type(e).__name__}: {e}"
+                    print(f"任务 {job['id']} 执行出错: {error}")
+                with self._condition:
+                    job.update(status=status, result=result, error=error, finished=time.time())
+                    self._prune_history()
+                    self._condition.notify_all()
+                # 会话内缓存不会关闭，定期淘汰过期描述，避免长期运行时缓存只增不减
+                interval = SERVICE_CONFIG.get("cache_evict_interval") or 0
+                if interval and time.monotonic() - last_evict >= interval:
+                    last_evict = time.monotonic()
+                    self._evict_description_cache()
+
+    @staticmethod
+    def _evict_description_cache():
+        cache = get_description_cache()
+        if cache is None:
+            return
+        try:
+            removed = cache.evict()
+            if removed:
+                print(f"图片描述缓存: 淘汰 {removed} 条过期或超出上限的条目")
+        except Exception as e:
+            print(f"整理图片描述缓存时出错: {e}")
+
+    # 生命周期
+
+    def serve_forever(self):
+        """启动工作线程并处理HTTP请求，直到 stop() 或 Ctrl+C；退出前等待当前任务完成。"""
+        self._worker = threading.Thread(target=self._work_loop, name="linkcontent-worker")
+        self._worker.start()
+        print(f"常驻服务已启动: {self.base_url}（进程 {os.getpid()}）")
+        if self.token_path is not None:
+            print(f"未配置令牌，已生成随机令牌并写入 '{self.token_path}'（仅当前用户可读）")
+        if self.allowed_roots:
+            print(f"只接受以下目录中的文件: {', '.join(self.allowed_roots)}")
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stop_queue()
+            print("服务退出中，等待当前任务完成...")
+            self._worker.join()
+            self._server.server_close()
+            if self.token_path is not None:
+                try:
+                    os.remove(self.token_path)
+                except OSError:
+                    pass
+            print("常驻服务已退出")
+
+    def stop(self):
+        """从其他线程请求退出。"""
+        self._stop_queue()
+        self._server.shutdown()
+
+    def _stop_queue(self):
+        with self._condition:
+            self._stopping = True
+            for job in self._jobs.values():
+                if job["status"] == "queued":
+                    job.update(status="cancelled", finished=time.time())
+            self._condition.notify_all()
+
+    def _make_handler(self):
+        import hmac
+        from http.server import BaseHTTPRequestHandler
+        from urllib.parse import parse_qs, urlsplit
+
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send_json(self, status: int, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _authorized(self) -> bool:
+                supplied = self.headers.get("X-LinkContent-Token", "")
+                if hmac.compare_digest(supplied.encode("utf-8"), service.token.encode("utf-8")):
+                    return True
+                self._send_json(401, {"error": "令牌无效"})
+                return False
+
+            def _route(self):
+                url = urlsplit(self.path)
+                parts = [part for part in url.path.split("/") if part]
+                return parts, parse_qs(url.query)
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                parts, query = self._route()
+                if parts == ["health"]:
+                    self._send_json(200, service.health())
+                elif parts == ["jobs"]:
+                    self._send_json(200, service.list_jobs())
+                elif len(parts) == 2 and parts[0] == "jobs":
+                    try:
+                        wait = min(float(query.get("wait", ["0"])[0]), 300.0)
+                    except ValueError:
+                        wait = 0.0
+                    job = service.get(parts[1], wait=wait)
+                    if job is None:
+                        self._send_json(404, {"error": f"任务不存在: {parts[1]}"})
+                    else:
+                        self._send_json(200, job)
+                else:
+                    self._send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+                parts, _ = self._route()
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self._send_json(400, {"error": "请求体不是有效的 JSON"})
+                    return
+                if parts == ["jobs"]:
+                    try:
+                        job = service.submit(
+                            request.get("type"), request.get("params"), request.get("priority", 0)
+                        )
+                    except (ValueError, TypeError) as e:
+                        self._send_json(400, {"error": str(e)})
+                    except PermissionError as e:
+                        self._send_json(403, {"error": str(e)})
+                    except RuntimeError as e:
+                        self._send_json(503, {"error": str(e)})
+                    else:
+                        self._send_json(202, job)
+                elif parts == ["shutdown"]:
+                    self._send_json(202, {"status": "stopping"})
+                    # shutdown() 会等待 serve_forever 退出，不能阻塞当前请求线程
+                    threading.Thread(target=service.stop, daemon=True).start()
+                else:
+                    self._send_json(404, {"error": "not found"})
+
+            def do_DELETE(self):
+                if not self._authorized():
+                    return
+                parts, _ = self._route()
+                job = service.cancel(parts[1]) if len(parts) == 2 and parts[0] == "jobs" else None
+                if job is None:
+                    self._send_json(404, {"error": "任务不存在"})
+                elif job["status"] != "cancelled":
+                    self._send_json(
+                        409, {"error": f"任务状态为 {job['status']}，无法取消", "job": job}
+                    )
+                else:
+                    self._send_json(200, job)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class ServiceClient:
+    """常驻服务的轻量客户端，只依赖标准库，供命令行的 --server 模式和 RPA 脚本使用。"""
+
+    def __init__(self, base_url: Optional[str] = None, token: Optional[str] = None):
+        self.base_url = (
+            base_url
+            or f"http://{SERVICE_CONFIG.get('host', '127.0.0.1')}:{SERVICE_CONFIG.get('port', 8766)}"
+        ).rstrip("/")
+        self.token = token if token is not None else SERVICE_CONFIG.get("token")
+
+    def _get_token(self) -> Optional[str]:
+        """
+        返回请求使用的令牌。未配置时读取本机服务按端口自动生成的令牌文件；
+        每次请求时读取，客户端可以先于服务创建，服务重启换了令牌也能继续使用。
+        """
+        if self.token:
+            return self.token
+        from urllib.parse import urlsplit
+
+        port = urlsplit(self.base_url).port
+        return read_service_token(port) if port is not None else None
+
+    def _request(self, method: str, path: str, payload: Optional[Dict] = None, timeout: float = 30):
+        import urllib.error
+        import urllib.request
+
+        data = None if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        request.add_header("Content-Type", "application/json")
+        token = self._get_token()
+        if token:
+            request.add_header("X-LinkContent-Token", token)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read() or b"null")
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error", e.reason)
+            except (ValueError, AttributeError):
+                message = e.reason
+            raise RuntimeError(f"服务返回 {e.code}: {message}") from None
+        except (urllib.error.URLError, OSError) as e:
+            raise ConnectionError(f"无法连接常驻服务 {self.base_url}: {e}") from None
+
+    def health(self) -> Dict:
+        return self._request("GET", "/health", timeout=5)
+
+    def submit(self, job_type: str, params: Dict, priority: int = 0) -> Dict:
+        return self._request(
+            "POST", "/jobs", {"type": job_type, "params": params, "priority": priority}
+        )
+
+    def get(self, job_id: str, wait: float = 0) -> Dict:
+        return self._request("GET", f"/jobs/{job_id}?wait={wait:g}", timeout=wait + 30)
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Dict:
+        """长轮询直到任务结束（done / failed / cancelled）或超时，返回最后一次查询到的任务。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        poll_wait = SERVICE_CONFIG.get("poll_wait", 30)
+        while True:
+            remaining = poll_wait if deadline is None else min(poll_wait, deadline - time.monotonic())
+            job = self.get(job_id, wait=max(0.0, remaining))
+            if job["status"] in _FINISHED_JOB_STATES:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+
+    def cancel(self, job_id: str) -> Dict:
+        return self._request("DELETE", f"/jobs/{job_id}")
+
+    def shutdown(self) -> Dict:
+        return self._request("POST", "/shutdown")
+
+
+def run_extract(inputs: List[str], client: Optional[ServiceClient], priority: int = 0) -> int:
+    """--extract：逐个提取文档内容，每个文档输出一行 [EXTRACT] JSON。"""
+    paths = []
+    for item in inputs:
+        matches = [item] if os.path.exists(item) else sorted(glob.glob(item, recursive=True))
+        paths.extend(os.path.abspath(path) for path in (matches or [item]))
+
+    results = []
+    if client is not None:
+        jobs = [client.submit("extract", {"path": path}, priority) for path in paths]
+        for job in jobs:
+            finished = client.wait(job["id"])
+            results.append(
+                finished["result"]
+                if finished["status"] == "done"
+                else {"file": job["params"]["path"], "status": "failed", "chars": 0,
+                      "content": "", "error": finished.get("error") or finished["status"]}
+            )
+            print(f"[EXTRACT] {json.dumps(results[-1], ensure_ascii=False)}")
+    else:
+        with shared_resources_session():
+            for path in paths:
+                if os.path.isfile(path):
+                    content = extract_document_content(path)
+                    result = {"file": path, "status": "ok", "chars": len(content), "content": content}
+                else:
+                    result = {"file": path, "status": "missing", "chars": 0, "content": ""}
+                results.append(result)
+                print(f"[EXTRACT] {json.dumps(result, ensure_ascii=False)}")
+
+    if any(result["status"] != "ok" for result in results):
+        return EXIT_LINKS_FAILED
+    return EXIT_OK
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    命令行入口：在一个进程中依次处理多个工作簿，共享API连接池、图片描述缓存和解析进程池。
+    --serve 启动常驻服务；--server 把任务提交给已运行的常驻服务并等待结果。
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="提取Excel中链接文档的内容（含图片分析），写入链接旁的内容列。"
+    )
+    parser.add_argument("inputs", nargs="*", help="工作簿文件、目录或通配符（如 'data/**/*.xlsx'）")
+    parser.add_argument("-r", "--recursive", action="store_true", help="目录输入时递归查找子目录")
+    parser.add_argument("--workers", type=int, default=None, help="解析文档的进程数")
+    parser.add_argument("--llm-concurrency", type=int, default=None, help="单个文档内并发分析图片的请求数")
+    parser.add_argument(
+        "--output",
+        choices=("inplace", "copy"),
+        default="inplace",
+        help="inplace：直接修改原文件；copy：写入 <工作簿名>_linkcontent.xlsx 副本",
+    )
+    parser.add_argument("--output-dir", default=None, help="--output copy 时副本所在目录")
+    parser.add_argument(
+        "--layout", choices=("insert", "append", "stream"), default=None, help="内容列的写入方式"
+    )
+    parser.add_argument("--incremental", action="store_true", help="增量模式：只处理新增或已变化的链接")
+    parser.add_argument("--resume", action="store_true", help="从上次中断的日志继续，跳过已完成的链接")
+    parser.add_argument("--dry-run", action="store_true", help="只检查超链接和链接文件，不做任何修改")
+    parser.add_argument("--summary-file", default=None, help="把所有工作簿的汇总写入该 JSON 文件")
+    parser.add_argument("--extract", action="store_true", help="输入为文档文件：只提取内容，输出 [EXTRACT] 行")
+    parser.add_argument("--serve", action="store_true", help="启动常驻服务，在本机HTTP端口上接收任务")
+    parser.add_argument("--host", default=None, help="--serve 的监听地址")
+    parser.add_argument("--port", type=int, default=None, help="--serve 的监听端口")
+    parser.add_argument(
+        "--server",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="URL",
+        help="把任务提交给常驻服务并等待结果（不带 URL 时使用 SERVICE_CONFIG 中的地址）",
+    )
+    parser.add_argument("--priority", type=int, default=0, help="--server 模式的任务优先级，越大越先执行")
+    parser.add_argument("--stop-server", action="store_true", help="通知常驻服务在当前任务完成后退出")
+    args = parser.parse_args(argv)
+
+    if args.llm_concurrency is not None:
+        QWEN_VL_CONFIG["max_concurrency"] = max(1, args.llm_concurrency)
+
+    if args.serve:
+        LinkContentService(host=args.host, port=args.port, workers=args.workers).serve_forever()
+        return EXIT_OK
+
+    client = None
+    if args.server is not None or args.stop_server:
+        client = ServiceClient(args.server or None)
+        try:
+            health = client.health()
+        except ConnectionError as e:
+            print(f"错误：{e}")
+            return EXIT_SERVICE_UNAVAILABLE
+        if args.stop_server:
+            client.shutdown()
+            print(f"已通知常驻服务退出（进程 {health['pid']}）")
+            if not args.inputs:
+                return EXIT_OK
+            print("错误：--stop-server 不能与输入文件同时使用。")
+            return EXIT_USAGE
+        if args.llm_concurrency is not None:
+            print("提示：--server 模式下 --llm-concurrency 由常驻服务的配置决定，此处忽略。")
+
+    if not args.inputs:
+        parser.print_usage()
+        print("错误：需要至少一个输入（或使用 --serve / --stop-server）。")
+        return EXIT_USAGE
+
+    if args.extract:
+        return run_extract(args.inputs, client, args.priority)
+
+    workbook_paths = collect_workbook_paths(args.inputs, args.recursive)
+    if not workbook_paths:
+        print("错误：没有找到任何 .xlsx/.xlsm 工作簿。")
+        return EXIT_USAGE
+
+    options = {
+        "output": args.output,
+        "output_dir": os.path.abspath(args.output_dir) if args.output_dir else None,
+        "layout": args.layout,
+        "incremental": args.incremental,
+        "resume": args.resume,
+        "dry_run": args.dry_run,
+        "workers": args.workers,
+    }
+    summaries = []
+    if client is not None:
+        # 先全部提交再依次等待，由服务按优先级排队执行
+        jobs = [
+            client.submit("workbook", dict(options, path=os.path.abspath(path)), args.priority)
+            for path in workbook_paths
+        ]
+        print(f"已向 {client.base_url} 提交 {len(jobs)} 个工作簿任务")
+        for index, job in enumerate(jobs, 1):
+            finished = client.wait(job["id"])
+            if finished["status"] == "done":
+                summary = finished["result"]
+            else:
+                summary = {
+                    "workbook": job["params"]["path"],
+                    "status": "failed",
+                    "error": finished.get("error") or finished["status"],
+                }
+            print(f"[{index}/{len(jobs)}] 任务 {job['id']}: {finished['status']}")
+            summaries.append(summary)
+            print(f"[SUMMARY] {json.dumps(summary, ensure_ascii=False)}")
+    else:
+        with shared_resources_session():
+            for index, excel_path in enumerate(workbook_paths, 1):
+                print(f"\n===== [{index}/{len(workbook_paths)}] {excel_path} =====")
+                summary = run_workbook(excel_path, **options)
+                summaries.append(summary)
+                # 每个工作簿一行，便于 RPA 工具解析
+                print(f"[SUMMARY] {json.dumps(summary, ensure_ascii=False)}")
+
+    if args.summary_file:
+        with open(args.summary_file, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, ensure_ascii=False, indent=1)
+
+    if any(summary["status"] == "failed" for summary in summaries):
+        return EXIT_WORKBOOK_FAILED
+    if any(summary.get("failed") or summary.get("missing") for summary in summaries):
+        return EXIT_LINKS_FAILED
+    return EXIT_OK
+
+
+# --- 脚本主入口 ---
+if __name__ == "__main__":
+    # --- 警告 ---
+    # 默认直接修改原始文件（--output copy 可写入副本）。
+    # 强烈建议在运行前对您的 Excel 文件进行备份。
+    #
+    # 用法示例：
+    #   python write_file_excel.py 任务管理.xlsx
+    #   python write_file_excel.py 资料目录/ --workers 4 --output copy
+    #   python write_file_excel.py --serve                      # 启动常驻服务
+    #   python write_file_excel.py 任务管理.xlsx --server        # 交给常驻服务处理
+    sys.exit(main())